@@ -0,0 +1,77 @@
+"""
+Import time of the package entry points.
+
+Every timed call imports one module in a fresh interpreter, so the numbers include the interpreter startup, measured
+on its own by the 'import.python' baseline. Importing an entry point must not touch the network nor load the libraries
+that only its functions need: pandas, the HTTP clients, boto3 and sodapy for the api modules, the ODBC drivers for the
+db modules (pandas included). A call fails if one of them shows up in sys.modules.
+
+    python benchmarks/harness.py run --filter 'import.*'
+    python benchmarks/bench_import_time.py api.get_data     # -X importtime breakdown, slowest imports first
+"""
+import subprocess
+import sys
+
+from harness import ROOT, benchmark
+
+_API_LAZY = ['pandas', 'requests', 'aiohttp', 'sodapy', 'boto3', 'pyodbc', 'pypyodbc']
+_DB_LAZY = ['pandas', 'numpy', 'pyodbc', 'pypyodbc', 'psycopg2', 'boto3']
+# module -> libraries it must not import at import time
+MODULES = {
+    'api.get_data': _API_LAZY,
+    'api.async_api': _API_LAZY,
+    'common.db_utilities.db_utilities': _DB_LAZY,
+    'common.db_utilities.db_access': _DB_LAZY,
+}
+
+
+def _import_code(module):
+    return (f"import sys; sys.path[:0] = [{str(ROOT)!r}, {str(ROOT / 'src')!r}]; import {module}; "
+            f"loaded = [name for name in {MODULES.get(module, [])!r} if name in sys.modules]; "
+            f"sys.exit('{module} imported ' + ', '.join(loaded) if loaded else 0)")
+
+
+def import_module(module=None, *options):
+    code = _import_code(module) if module else 'pass'
+    return subprocess.run([sys.executable, *options, '-c', code], check=True, capture_output=True, text=True)
+
+
+def _register(module):
+    @benchmark(f'import.{module}')
+    def bench():
+        import_module(module)
+    return bench
+
+
+@benchmark('import.python')
+def bench_python():
+    import_module()
+
+
+for _module in MODULES:
+    _register(_module)
+
+
+def importtime(module, top=15):
+    """
+    Returns the slowest imports of module, from the interpreter's -X importtime report.
+    @param module: dotted module name
+    @param top: number of imports returned
+    @return: list of (cumulative microseconds, imported module) tuples
+    """
+    report = subprocess.run([sys.executable, '-X', 'importtime', '-c', _import_code(module)], capture_output=True,
+                            text=True).stderr
+    rows = list()
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    for _name in sys.argv[1:] or MODULES:
+        print(_name)
+        for _us, _imported in importtime(_name):
+            print(f'{_us / 1e3:>10.1f} ms  {_imported}')
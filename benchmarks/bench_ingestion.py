@@ -0,0 +1,178 @@
+"""
+Benchmarks for the ingestion (API pulls), blending and loading hot paths.
+
+Pulls run against the local MockSocrataServer, its size and latency can be tuned with the BENCH_ROWS,
+BENCH_PAGE_SIZE and BENCH_LATENCY environment variables. bulk_insert needs a SQL Server ODBC connection string in
+BENCH_ODBC_CONN_STR and is skipped otherwise.
+"""
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+from harness import SkipBenchmark, benchmark
+from mock_socrata import MockSocrataServer
+from synthetic import synthetic_frame
+
+BENCH_ROWS = int(os.getenv('BENCH_ROWS', 200_000))
+BENCH_PAGE_SIZE = int(os.getenv('BENCH_PAGE_SIZE', 50_000))
+BENCH_LATENCY = float(os.getenv('BENCH_LATENCY', 0.05))
+
+BLEND_FIELDS = {
+    'collision_id': 'collision_id',
+    'crash_date': 'crash_date',
+    'crash_time': 'crash_time',
+    'borough': 'borough',
+    'zip_code': 'zip_code',
+    'number_of_persons_injured': 'persons_injured',
+    'number_of_persons_killed': 'persons_killed',
+    'contributing_factor_vehicle_1': 'factor',
+    'vehicle_type_code1': 'vehicle_type',
+    'latitude': None,
+    'longitude': None,
+}
+
+
+def _start_server():
+    return dict(server=MockSocrataServer(total_rows=BENCH_ROWS, latency=BENCH_LATENCY).start())
+
+
+def _stop_server(kwargs):
+    kwargs['server'].stop()
+
+
+def _frame():
+    return dict(df=synthetic_frame(BENCH_ROWS))
+
+
+@benchmark('api.get_data.api_pagination_results', setup=_start_server, teardown=_stop_server)
+def bench_api_pagination_results(server):
+    from api.get_data import api_pagination_results
+
+    # the mock server needs no credentials
+    df = api_pagination_results(endpoint=server.endpoint, limit=BENCH_PAGE_SIZE, auth=False)
+    assert len(df) == BENCH_ROWS
+
+
+@benchmark('api.async_api.get_async_data', setup=_start_server, teardown=_stop_server)
+def bench_get_async_data(server):
+    from api.async_api import create_urls, get_async_data
+
+    sent = server.bytes_sent
+    urls = create_urls(endpoint=server.endpoint, limit=BENCH_PAGE_SIZE, total=BENCH_ROWS)
+    df = get_async_data(urls)
+    assert len(df) == BENCH_ROWS
+    return dict(wire_bytes=server.bytes_sent - sent)
+
+
+@benchmark('api.async_api.get_async_data.fields', setup=_start_server, teardown=_stop_server)
+def bench_get_async_data_fields(server):
+    from api.async_api import create_urls, get_async_data
+
+    # only the BLEND_FIELDS columns are transferred and parsed
+    sent = server.bytes_sent
+    urls = create_urls(endpoint=server.endpoint, limit=BENCH_PAGE_SIZE, total=BENCH_ROWS, fields=BLEND_FIELDS)
+    df = get_async_data(urls)
+    assert len(df) == BENCH_ROWS and len(df.columns) == len(BLEND_FIELDS)
+    return dict(wire_bytes=server.bytes_sent - sent)
+
+
+@benchmark('common.data_blend.df_prepare', setup=_frame)
+def bench_df_prepare(df):
+    from common.data_blend.operations import df_prepare
+
+    df_prepare(df, BLEND_FIELDS)
+
+
+@benchmark('common.data_blend.validate', setup=_frame)
+def bench_validate(df):
+    from common.data_blend.validation import validate
+
+    validate(df)
+
+
+@benchmark('common.data_blend.row_hashes', setup=_frame)
+def bench_row_hashes(df):
+    from common.data_blend.hashing import row_hashes
+
+    row_hashes(df)
+
+
+@benchmark('common.utilities.profile_frame', setup=_frame)
+def bench_profile_frame(df):
+    from common.utilities.profiling import profile_frame
+
+    profile_frame(df).to_frame()
+
+
+@benchmark('common.utilities.heavy_hitters', setup=_frame)
+def bench_heavy_hitters(df):
+    from common.utilities.heavy_hitters import HeavyHitters
+
+    hitters = HeavyHitters(['zip_code', 'on_street_name', 'vehicle_type_code1'])
+    # fed page by page, as from CheckpointedDownloader(on_page=...)
+    for start in range(0, len(df), 50_000):
+        hitters.update(df.iloc[start:start + 50_000])
+    hitters.top('zip_code', 10)
+
+
+def _rollup_store():
+    from common.query import RollupStore
+
+    df = synthetic_frame(BENCH_ROWS)
+    store = RollupStore(tempfile.mkdtemp(prefix='bench_rollups_'))
+    store.rebuild(df, version='base')
+    # a daily sync: 1% new or amended rows
+    return dict(df=df, store=store, delta=df.sample(frac=0.01, random_state=0))
+
+
+def _remove_rollup_store(kwargs):
+    shutil.rmtree(kwargs['store'].directory, ignore_errors=True)
+
+
+@benchmark('common.query.rollups.rebuild', setup=_rollup_store, teardown=_remove_rollup_store)
+def bench_rollups_rebuild(df, store, delta):
+    store.rebuild(df, version='base')
+
+
+@benchmark('common.query.rollups.apply', setup=_rollup_store, teardown=_remove_rollup_store)
+def bench_rollups_apply(df, store, delta):
+    # applied and retracted, so that every repeat starts from the same rollups
+    store.apply(inserted=delta, retracted=delta, since='base', version='base')
+
+
+@benchmark('common.db_utilities.map_pandas_to_sql_data_types', setup=_frame)
+def bench_map_pandas_to_sql_data_types(df):
+    from common.db_utilities.db_utilities import map_pandas_to_sql_data_types
+
+    list(map_pandas_to_sql_data_types(df))
+
+
+@benchmark('common.db_utilities.parameters.values', setup=_frame)
+def bench_parameters_values(df):
+    # the executemany parameters as bulk_insert built them before the Arrow path
+    rows = list(map(tuple, df.values))
+    for start in range(0, len(rows), 10 ** 4):
+        [[None if pd.isnull(y) else y for y in x] for x in rows[start:start + 10 ** 4]]
+
+
+@benchmark('common.db_utilities.parameters.arrow', setup=_frame)
+def bench_parameters_arrow(df):
+    from common.db_utilities.db_utilities import arrow_batches, batch_parameters
+
+    for batch in arrow_batches(df, 10 ** 4):
+        batch_parameters(batch)
+
+
+def _bulk_insert_setup():
+    conn_str = os.getenv('BENCH_ODBC_CONN_STR')
+    if not conn_str:
+        raise SkipBenchmark('BENCH_ODBC_CONN_STR is not set')
+    return dict(df=synthetic_frame(BENCH_ROWS), conn_str=conn_str)
+
+
+@benchmark('common.db_utilities.bulk_insert', setup=_bulk_insert_setup, repeat=3)
+def bench_bulk_insert(df, conn_str):
+    from common.db_utilities.db_utilities import bulk_insert
+
+    bulk_insert(df, conn_str, schema='bench', table='mvcc', pre_insert_query='TRUNCATE TABLE [bench].[mvcc]')
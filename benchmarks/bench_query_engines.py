@@ -0,0 +1,79 @@
+"""
+Compares the query engines of common.query on the part2_eda questions.
+
+    python benchmarks/bench_query_engines.py --rows 2000000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / 'src'))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+import pandas as pd
+from common.query import QUESTIONS, ENGINES, get_engine, run_question, write_snapshot
+from synthetic import synthetic_frame
+
+
+def write_store(directory, rows):
+    df = synthetic_frame(rows)
+    paths = {
+        'parquet': os.path.join(directory, 'output.parquet'),
+        'csv': os.path.join(directory, 'output.csv'),
+        'arrow': os.path.join(directory, 'output.feather'),
+    }
+    df.to_parquet(paths['parquet'], index=False)
+    df.to_csv(paths['csv'], index=False)
+    write_snapshot(df, paths['arrow'])
+    return paths
+
+
+def bench(paths, engines, questions, repeat=3, threads=None):
+    results = list()
+    for engine_name in engines:
+        try:
+            engine = get_engine(engine_name, threads=threads)
+        except ImportError:
+            continue
+        for file_format, path in paths.items():
+            for question in questions:
+                timings = list()
+                try:
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        run_question(engine, path, question)
+                        timings.append(time.perf_counter() - start)
+                except ValueError as err:
+                    print(f'{engine_name} / {file_format} / {question}: skipped - {err}')
+                    continue
+                results.append({
+                    'engine': engine_name, 'format': file_format, 'question': question,
+                    'best_ms': min(timings) * 1000, 'mean_ms': sum(timings) / len(timings) * 1000,
+                })
+    return pd.DataFrame(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES))
+    parser.add_argument('--questions', nargs='+', default=list(QUESTIONS))
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_store(directory, args.rows)
+        results = bench(paths, args.engines, args.questions, repeat=args.repeat, threads=args.threads)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(results.pivot_table(index=['question', 'format'], columns='engine', values='best_ms').round(1))
+    return results
+
+
+if __name__ == '__main__':
+    main()
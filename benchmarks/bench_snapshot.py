@@ -0,0 +1,62 @@
+"""
+Startup cost of loading the collisions table: output.csv parsed by pandas, the Parquet store, and the memory-mapped
+Arrow snapshot of common.query.snapshot, BENCH_ROWS rows each.
+"""
+import os
+import shutil
+import tempfile
+
+from harness import benchmark
+from synthetic import synthetic_frame
+
+BENCH_ROWS = int(os.getenv('BENCH_ROWS', 200_000))
+# columns used by a typical EDA question
+COLUMNS = ['crash_date', 'borough', 'number_of_persons_injured']
+
+
+def _write_stores():
+    from common.query import write_snapshot
+
+    directory = tempfile.mkdtemp(prefix='bench_snapshot_')
+    df = synthetic_frame(BENCH_ROWS)
+    paths = dict(csv=os.path.join(directory, 'output.csv'), parquet=os.path.join(directory, 'output.parquet'),
+                 arrow=os.path.join(directory, 'output.feather'))
+    df.to_csv(paths['csv'], index=False)
+    df.to_parquet(paths['parquet'], index=False)
+    write_snapshot(df, paths['arrow'])
+    return dict(directory=directory, paths=paths)
+
+
+def _remove_stores(kwargs):
+    shutil.rmtree(kwargs['directory'], ignore_errors=True)
+
+
+@benchmark('common.query.snapshot.load.csv', setup=_write_stores, teardown=_remove_stores)
+def bench_load_csv(directory, paths):
+    import pandas as pd
+
+    assert len(pd.read_csv(paths['csv'], dtype={'zip_code': str})) == BENCH_ROWS
+
+
+@benchmark('common.query.snapshot.load.parquet', setup=_write_stores, teardown=_remove_stores)
+def bench_load_parquet(directory, paths):
+    import pandas as pd
+
+    assert len(pd.read_parquet(paths['parquet'])) == BENCH_ROWS
+
+
+@benchmark('common.query.snapshot.load.arrow', setup=_write_stores, teardown=_remove_stores)
+def bench_load_arrow(directory, paths):
+    from common.query import read_snapshot
+
+    assert len(read_snapshot(paths['arrow'])) == BENCH_ROWS
+
+
+@benchmark('common.query.snapshot.open.arrow', setup=_write_stores, teardown=_remove_stores)
+def bench_open_arrow(directory, paths):
+    from common.query import open_snapshot
+
+    # zero-copy: only the mapped pages of the used columns are touched
+    table = open_snapshot(paths['arrow'], columns=COLUMNS)
+    assert table.num_rows == BENCH_ROWS
+    return dict(nbytes=table.nbytes)
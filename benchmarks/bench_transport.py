@@ -0,0 +1,69 @@
+"""
+Transfer size and parse time of one API page per export format (.json / .csv) and content encoding.
+
+Runs against the local MockSocrataServer, BENCH_PAGE_SIZE rows per page. Every benchmark reports the bytes sent over
+the wire next to its timings, the 'parse' benchmarks time the parsing of an already downloaded body on its own.
+"""
+import os
+
+import requests
+from harness import benchmark
+from mock_socrata import MockSocrataServer
+
+BENCH_PAGE_SIZE = int(os.getenv('BENCH_PAGE_SIZE', 50_000))
+ENCODINGS = ('identity', 'gzip', 'deflate')
+
+
+def _start_server():
+    server = MockSocrataServer(total_rows=BENCH_PAGE_SIZE).start()
+    return dict(server=server)
+
+
+def _stop_server(kwargs):
+    kwargs['server'].stop()
+
+
+def _page_url(server, file_format):
+    from api.transport import resource_url
+
+    return f'{resource_url(server.endpoint, file_format)}?$limit={BENCH_PAGE_SIZE}&$offset=0&$order=collision_id'
+
+
+def _register_fetch(file_format, encoding):
+    @benchmark(f'api.transport.fetch_frame.{file_format}.{encoding}', setup=_start_server, teardown=_stop_server)
+    def bench(server):
+        from api.transport import open_stream, parse_body
+
+        stream = open_stream(_page_url(server, file_format), accept_encoding=encoding)
+        try:
+            df = parse_body(stream, file_format)
+        finally:
+            stream.close()
+        assert len(df) == BENCH_PAGE_SIZE
+        return dict(wire_bytes=stream.wire_bytes)
+    return bench
+
+
+def _download(file_format):
+    server = MockSocrataServer(total_rows=BENCH_PAGE_SIZE).start()
+    try:
+        body = requests.get(_page_url(server, file_format), headers={'Accept-Encoding': 'identity'}).content
+    finally:
+        server.stop()
+    return dict(body=body)
+
+
+def _register_parse(file_format):
+    @benchmark(f'api.transport.parse_body.{file_format}', setup=lambda: _download(file_format))
+    def bench(body):
+        from api.transport import parse_body
+
+        assert len(parse_body(body, file_format)) == BENCH_PAGE_SIZE
+        return dict(body_bytes=len(body))
+    return bench
+
+
+for _file_format in ('json', 'csv'):
+    _register_parse(_file_format)
+    for _encoding in ENCODINGS:
+        _register_fetch(_file_format, _encoding)
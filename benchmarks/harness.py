@@ -0,0 +1,187 @@
+"""
+Minimal benchmark harness for the ingestion, blending and loading hot paths.
+
+Benchmarks are plain functions registered with @benchmark, an optional setup callable provides their keyword
+arguments. Every call is timed with time.perf_counter_ns and a run is written as JSON under .benchmarks/ together with
+the git commit, so that two runs can be compared:
+
+    python benchmarks/harness.py run --repeat 5
+    python benchmarks/harness.py compare .benchmarks/<old>.json .benchmarks/<new>.json
+"""
+import argparse
+import fnmatch
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = ROOT / '.benchmarks'
+BENCHMARK_MODULES = ['bench_ingestion', 'bench_import_time', 'bench_transport', 'bench_snapshot']
+
+sys.path.append(str(ROOT))
+sys.path.append(str(ROOT / 'src'))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+_REGISTRY = dict()
+
+if __name__ == '__main__':
+    # benchmark modules import `harness`, make sure they register into this module and not a second copy
+    sys.modules['harness'] = sys.modules[__name__]
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark (or its setup) when it can not run in the current environment."""
+
+
+def benchmark(name=None, setup=None, teardown=None, repeat=None):
+    """
+    Registers a benchmark function.
+    @param name: Optional: name of the benchmark, defaults to the function name
+    @param setup: Optional: callable returning a dict of keyword arguments passed to every timed call
+    @param teardown: Optional: callable receiving the setup dict once the benchmark is done
+    @param repeat: Optional: overrides the number of timed calls for this benchmark
+    @return: the undecorated function
+    """
+    def deco(func):
+        _REGISTRY[name or func.__name__] = dict(func=func, setup=setup, teardown=teardown, repeat=repeat)
+        return func
+    return deco
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_one(name, spec, repeat):
+    kwargs = dict()
+    try:
+        if spec['setup']:
+            kwargs = spec['setup']() or dict()
+        # one untimed warm-up call, so that imports and connection setup are not in the numbers
+        spec['func'](**kwargs)
+        timings = list()
+        extra = None
+        for _ in range(spec['repeat'] or repeat):
+            start = time.perf_counter_ns()
+            extra = spec['func'](**kwargs)
+            timings.append(time.perf_counter_ns() - start)
+    except (SkipBenchmark, ImportError) as err:
+        return dict(name=name, status='skipped', reason=f'{err.__class__.__name__}: {err}')
+    finally:
+        if spec['teardown'] and kwargs:
+            spec['teardown'](kwargs)
+
+    return dict(
+        name=name,
+        status='ok',
+        repeat=len(timings),
+        min_ms=min(timings) / 1e6,
+        median_ms=statistics.median(timings) / 1e6,
+        mean_ms=statistics.mean(timings) / 1e6,
+        stdev_ms=(statistics.stdev(timings) / 1e6) if len(timings) > 1 else 0.0,
+        # a benchmark may return a dict of measures besides time, e.g. transferred bytes
+        **(dict(extra=extra) if isinstance(extra, dict) else dict()),
+    )
+
+
+def run(pattern='*', repeat=5, output=None, logger=print):
+    """
+    Runs every registered benchmark matching pattern and writes the results as JSON.
+    @param pattern: fnmatch pattern on benchmark names
+    @param repeat: number of timed calls per benchmark
+    @param output: Optional: path of the JSON result file, defaults to .benchmarks/<timestamp>_<commit>.json
+    @param logger: Optional - allows to change between print and logging.info
+    @return: dict with the run metadata and results
+    """
+    for module in BENCHMARK_MODULES:
+        importlib.import_module(module)
+
+    commit = git_commit()
+    results = list()
+    for name, spec in _REGISTRY.items():
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        result = run_one(name, spec, repeat)
+        results.append(result)
+        if result['status'] == 'ok':
+            extra = ''.join(f'  {key}={value}' for key, value in result.get('extra', dict()).items())
+            logger(f"{name:<50} median {result['median_ms']:>10.2f} ms  min {result['min_ms']:>10.2f} ms{extra}")
+        else:
+            logger(f"{name:<50} skipped ({result['reason']})")
+
+    run_data = dict(
+        commit=commit,
+        created=datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cpu_count=os.cpu_count(),
+        results=results,
+    )
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json"
+    with open(output, 'w') as fp:
+        json.dump(run_data, fp, indent=2)
+    logger(f'Results written to {output}')
+    return run_data
+
+
+def compare(old_path, new_path, threshold=0.1, logger=print):
+    """
+    Compares the median timings of two result files.
+    @param old_path: JSON result of the baseline run
+    @param new_path: JSON result of the new run
+    @param threshold: relative slowdown above which a benchmark is reported as a regression
+    @param logger: Optional - allows to change between print and logging.info
+    @return: list of names of the regressed benchmarks
+    """
+    with open(old_path) as fp:
+        old = {r['name']: r for r in json.load(fp)['results'] if r['status'] == 'ok'}
+    with open(new_path) as fp:
+        new = {r['name']: r for r in json.load(fp)['results'] if r['status'] == 'ok'}
+
+    regressions = list()
+    for name in sorted(set(old) & set(new)):
+        ratio = new[name]['median_ms'] / old[name]['median_ms'] if old[name]['median_ms'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        logger(f"{name:<50} {old[name]['median_ms']:>10.2f} -> {new[name]['median_ms']:>10.2f} ms "
+               f"({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--filter', default='*', help='fnmatch pattern on benchmark names')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--output', default=None)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args.filter, args.repeat, args.output)
+    else:
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
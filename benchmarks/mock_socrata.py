@@ -0,0 +1,208 @@
+"""
+Local HTTP server that mimics the Socrata resource endpoint with synthetic MVCC pages, served as .json or .csv and
+gzip/deflate compressed when the client asks for it.
+
+Plain pages ($limit/$offset) are generated per offset. Queries with a $where or $select run against one synthetic
+table of total_rows rows and support what the partition planner and the column projection send:
+    $select=date_trunc_ym(<column>) AS <alias>, count(*) AS <alias>[, max(:updated_at) AS <alias>]&$group=<alias>
+    $select=<column>, <column>, ...
+    $where=<column> between '<from>' and '<to>'
+
+    with MockSocrataServer(total_rows=200_000, latency=0.05) as server:
+        requests.get(f'{server.endpoint}?$limit=50000&$offset=0&$order=collision_id')
+"""
+import gzip
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from synthetic import frame_records, synthetic_frame, synthetic_records
+
+_BETWEEN = re.compile(r"(\w+) between '([^']+)' and '([^']+)'")
+_MONTHLY_COUNT = re.compile(r'date_trunc_ym\((\w+)\) AS (\w+), count\(\*\) AS (\w+)(?:, max\(:updated_at\) AS (\w+))?')
+# the synthetic rows are never updated, every month reports this last update
+UPDATED_AT = '2021-09-01T00:00:00.000'
+_COLUMNS = re.compile(r'\w+(\s*,\s*\w+)*')
+
+
+class QueryError(ValueError):
+    pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # keep benchmark output clean
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        server.record(requests=1)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not url.path.startswith('/resource/'):
+            return self._send(404, b'{"error": "not found"}')
+
+        file_format = 'csv' if url.path.endswith('.csv') else 'json'
+        accepted = {value.split(';')[0].strip() for value in self.headers.get('Accept-Encoding', '').split(',')}
+        encoding = next((value for value in ('gzip', 'deflate') if value in accepted), None)
+        limit = int(params.get('$limit', 1000))
+        offset = int(params.get('$offset', 0))
+        if '$where' in params or '$select' in params:
+            try:
+                body = server.query(params, limit, offset, file_format, encoding)
+            except QueryError as err:
+                return self._send(400, json.dumps({'message': str(err)}).encode())
+        else:
+            rows = max(0, min(limit, server.total_rows - offset))
+            body = server.page(offset, rows, file_format, encoding)
+        server.record(nbytes=len(body))
+        self._send(200, body, CONTENT_TYPES[file_format], encoding)
+
+    def _send(self, status, body, content_type='application/json', encoding=None):
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+CONTENT_TYPES = {'json': 'application/json', 'csv': 'text/csv'}
+ENCODERS = {'gzip': gzip.compress, 'deflate': zlib.compress}
+
+
+def _to_csv(records):
+    import pandas as pd
+
+    return pd.DataFrame.from_records(records).to_csv(index=False).encode('utf8')
+
+
+class MockSocrataServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, total_rows=100_000, latency=0.0, dataset_id='h9gi-nx95', host='127.0.0.1', port=0):
+        """
+        @param total_rows: number of rows the dataset pretends to have
+        @param latency: seconds slept before answering every request
+        @param dataset_id: Socrata dataset identifier served at /resource/<dataset_id>.json and .csv
+        @param host: interface to bind
+        @param port: port to bind, 0 picks a free one
+        """
+        super().__init__((host, port), _Handler)
+        self.total_rows = total_rows
+        self.latency = latency
+        self.dataset_id = dataset_id
+        self.requests = 0
+        self.bytes_sent = 0
+        self._pages = dict()
+        self._dataset = None
+        self._lock = threading.Lock()
+        # counters are updated by every handler thread, apart from the page cache lock held while generating pages
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def endpoint(self):
+        return f'{self.base_url}/resource/{self.dataset_id}.json'
+
+    def record(self, requests=0, nbytes=0):
+        with self._stats_lock:
+            self.requests += requests
+            self.bytes_sent += nbytes
+
+    def page(self, offset, rows, file_format='json', encoding=None):
+        # pages are generated once and reused so that repeated benchmark runs measure transfer, not generation
+        key = (offset, rows, file_format, encoding)
+        with self._lock:
+            if key not in self._pages:
+                records = synthetic_records(rows, offset=offset) if rows else []
+                if file_format == 'csv':
+                    body = _to_csv(records)
+                else:
+                    body = json.dumps(records).encode('utf8')
+                self._pages[key] = ENCODERS[encoding](body) if encoding else body
+            return self._pages[key]
+
+    @property
+    def dataset(self):
+        with self._lock:
+            if self._dataset is None:
+                self._dataset = synthetic_frame(self.total_rows)
+            return self._dataset
+
+    def query(self, params, limit, offset, file_format='json', encoding=None):
+        # answers are cached like the plain pages
+        key = (tuple(sorted(params.items())), file_format, encoding)
+        with self._lock:
+            body = self._pages.get(key)
+        if body is None:
+            body = self._query(params, limit, offset, file_format, encoding)
+            with self._lock:
+                self._pages[key] = body
+        return body
+
+    def _query(self, params, limit, offset, file_format, encoding):
+        df = self.dataset
+        if '$where' in params:
+            match = _BETWEEN.fullmatch(params['$where'].strip())
+            if not match:
+                raise QueryError(f"Unsupported $where={params['$where']}")
+            column, low, high = match.groups()
+            # floating timestamps in ISO format compare as strings
+            df = df[(df[column] >= low) & (df[column] <= high)]
+
+        select = params.get('$select', '').strip()
+        match = _MONTHLY_COUNT.fullmatch(select)
+        if match:
+            column, month, count, updated = match.groups()
+            counts = df.groupby(df[column].str[:7] + '-01T00:00:00.000').size().sort_index()
+            records = [{month: key, count: str(value), **({updated: UPDATED_AT} if updated else dict())}
+                       for key, value in counts.items()]
+        else:
+            columns = None
+            if select:
+                if not _COLUMNS.fullmatch(select):
+                    raise QueryError(f"Unsupported $select={select}")
+                columns = [col.strip() for col in select.split(',')]
+                unknown = set(columns) - set(df.columns)
+                if unknown:
+                    raise QueryError(f"No such column: {', '.join(sorted(unknown))}")
+            order = params.get('$order')
+            if order:
+                df = df.sort_values(order, kind='mergesort')
+            df = df.iloc[offset:offset + limit]
+            records = frame_records(df if columns is None else df[columns])
+
+        body = _to_csv(records) if file_format == 'csv' else json.dumps(records).encode('utf8')
+        return ENCODERS[encoding](body) if encoding else body
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-socrata', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,78 @@
+"""
+Synthetic MVCC (h9gi-nx95) data for benchmarks, with the same column names and value formats as the Socrata API.
+"""
+import numpy as np
+import pandas as pd
+
+BOROUGHS = ['BROOKLYN', 'QUEENS', 'MANHATTAN', 'BRONX', 'STATEN ISLAND', None]
+FACTORS = ['Unspecified', 'Driver Inattention/Distraction', 'Failure to Yield Right-of-Way', 'Following Too Closely',
+           'Backing Unsafely', 'Passing or Lane Usage Improper', 'unspecified', 'Illnes', None]
+VEHICLE_TYPES = ['Sedan', 'Station Wagon/Sport Utility Vehicle', 'SUV', 'Taxi', 'Pick-up Truck', 'Bike', 'Box Truck',
+                 '4 dr sedan', None]
+STREETS = ['BROADWAY', 'ATLANTIC AVENUE', 'atlantic ave', 'WEST 10 STREET', 'W 10 ST', 'BELT PARKWAY',
+           'NORTHERN BOULEVARD', '3 AVENUE', None]
+ZIP_CODES = ['10014', '11207', '11201', '10001', '11368', '10458', None]
+
+
+def synthetic_frame(rows, seed=18, start_id=4000000):
+    """
+    Builds a pandas.DataFrame that looks like the parsed MVCC table.
+    @param rows: number of rows
+    @param seed: random seed
+    @param start_id: first collision_id
+    @return: pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    def pick(values, size=rows):
+        return np.asarray(values, dtype=object)[rng.integers(0, len(values), size)]
+
+    crash_date = pd.Timestamp('2012-07-01') + pd.to_timedelta(rng.integers(0, 3400, rows), unit='D')
+    df = pd.DataFrame({
+        'crash_date': crash_date.strftime('%Y-%m-%dT00:00:00.000'),
+        'crash_time': [f'{h}:{m:02d}' for h, m in zip(rng.integers(0, 24, rows), rng.integers(0, 60, rows))],
+        'borough': pick(BOROUGHS),
+        'zip_code': pick(ZIP_CODES),
+        'latitude': rng.uniform(40.5, 40.9, rows).round(6),
+        'longitude': rng.uniform(-74.25, -73.7, rows).round(6),
+        'on_street_name': pick(STREETS),
+        'off_street_name': pick(STREETS),
+        'cross_street_name': pick(STREETS),
+        'number_of_persons_injured': rng.poisson(0.3, rows),
+        'number_of_persons_killed': rng.poisson(0.002, rows),
+        'number_of_pedestrians_injured': rng.poisson(0.05, rows),
+        'number_of_pedestrians_killed': rng.poisson(0.001, rows),
+        'number_of_cyclist_injured': rng.poisson(0.03, rows),
+        'number_of_cyclist_killed': rng.poisson(0.0005, rows),
+        'number_of_motorist_injured': rng.poisson(0.2, rows),
+        'number_of_motorist_killed': rng.poisson(0.001, rows),
+        'collision_id': np.arange(start_id, start_id + rows, dtype=np.int64),
+    })
+    for i in range(1, 6):
+        df[f'contributing_factor_vehicle_{i}'] = pick(FACTORS if i == 1 else FACTORS + [None] * (2 * i))
+    for i, col in enumerate(['vehicle_type_code1', 'vehicle_type_code2', 'vehicle_type_code_3',
+                             'vehicle_type_code_4', 'vehicle_type_code_5'], start=1):
+        df[col] = pick(VEHICLE_TYPES if i == 1 else VEHICLE_TYPES + [None] * (2 * i))
+    return df
+
+
+def synthetic_records(rows, offset=0, seed=18):
+    """
+    Builds one API page as a list of dicts, numbers are serialized as strings like the Socrata JSON endpoint does.
+    @param rows: number of records
+    @param offset: row offset of the page, used as the seed and for the collision_id range
+    @param seed: random seed
+    @return: list of dicts
+    """
+    return frame_records(synthetic_frame(rows, seed=seed + offset, start_id=4000000 + offset))
+
+
+def frame_records(df):
+    """
+    Serializes a synthetic frame like the Socrata JSON endpoint: numbers as strings, missing values left out.
+    @param df: pandas.DataFrame
+    @return: list of dicts
+    """
+    records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    return [{k: (str(v) if isinstance(v, (int, float, np.integer, np.floating)) else v)
+             for k, v in record.items() if v is not None} for record in records]
@@ -1,67 +1,317 @@
 # Use this code snippet in your app.
-# If you need more information about configurations or implementing the sample code, visit the AWS docs:   
+# If you need more information about configurations or implementing the sample code, visit the AWS docs:
 # https://aws.amazon.com/developers/getting-started/python/
 
-# Use this code snippet in your app.
-# If you need more information about configurations or implementing the sample code, visit the AWS docs:   
-# https://aws.amazon.com/developers/getting-started/python/
+# Secrets are read through a provider:
+#   - AWSSecretsProvider:  AWS Secrets Manager, one boto3 client per provider instead of one per call
+#   - EnvSecretsProvider:  environment variables, for offline runs and tests
+#   - FileSecretsProvider: a local json file {"<secret name>": "<secret string>" or {...}}
+#   - ChainSecretsProvider: first provider that knows the secret
+#   - CachedSecretsProvider: in-process TTL cache in front of any provider, optionally backed by an encrypted on-disk
+#     cache shared by worker processes
+#
+# get_secret(secret_name) keeps its signature and goes through the process wide default provider, which fetches each
+# secret at most once per TTL (NYC_SECRETS_TTL seconds, default 3600).
 
-import boto3
 import base64
-from botocore.exceptions import ClientError
+import json
 import os
+import re
+import tempfile
+import threading
+import time
 
-def get_secret(secret_name):
+REGION_NAME = "us-east-1"
+DEFAULT_TTL = 3600
+
+
+class SecretNotFound(KeyError):
+    pass
+
+
+class SecretsProvider:
+    def get(self, secret_name):
+        """
+        @param secret_name: name (or ARN) of the secret
+        @return: secret string, or bytes for binary secrets
+        """
+        raise NotImplementedError
+
+
+class AWSSecretsProvider(SecretsProvider):
+    def __init__(self, region_name=REGION_NAME, session=None):
+        """
+        @param region_name: AWS region of the secrets
+        @param session: Optional: boto3.session.Session, a new session is created on first use otherwise
+        """
+        self.region_name = region_name
+        self._session = session
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 clients are thread safe, unlike sessions, so one client is created and shared by every caller
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+
+                    session = self._session or boto3.session.Session()
+                    self._client = session.client(service_name='secretsmanager', region_name=self.region_name)
+        return self._client
+
+    def get(self, secret_name):
+        from botocore.exceptions import ClientError
+
+        # See https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
+        # DecryptionFailureException, InternalServiceErrorException, InvalidParameterException and
+        # InvalidRequestException are rethrown as is.
+        try:
+            get_secret_value_response = self.client.get_secret_value(SecretId=secret_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                raise SecretNotFound(secret_name) from e
+            raise
 
-    # secret_name = os.getenv('AWS_SECRET_NAME_NYC_OPEN_DATA')
-    
-    region_name = "us-east-1"
-
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
-
-    # In this sample we only handle the specific exceptions for the 'GetSecretValue' API.
-    # See https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
-    # We rethrow the exception by default.
-
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'DecryptionFailureException':
-            # Secrets Manager can't decrypt the protected secret text using the provided KMS key.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response['Error']['Code'] == 'InternalServiceErrorException':
-            # An error occurred on the server side.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response['Error']['Code'] == 'InvalidParameterException':
-            # You provided an invalid value for a parameter.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response['Error']['Code'] == 'InvalidRequestException':
-            # You provided a parameter value that is not valid for the current state of the resource.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response['Error']['Code'] == 'ResourceNotFoundException':
-            # We can't find the resource that you asked for.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-    else:
         # Decrypts secret using the associated KMS CMK.
         # Depending on whether the secret is a string or binary, one of these fields will be populated.
         if 'SecretString' in get_secret_value_response:
-            secret = get_secret_value_response['SecretString']
-            return secret
-        else:
-            decoded_binary_secret = base64.b64decode(get_secret_value_response['SecretBinary'])
-            return decoded_binary_secret
+            return get_secret_value_response['SecretString']
+        return base64.b64decode(get_secret_value_response['SecretBinary'])
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} region_name={self.region_name}>"
+
+
+def env_var_name(secret_name, prefix='SECRET_'):
+    """
+    Returns the environment variable holding a secret, e.g. 'nyc/open-data' -> 'SECRET_NYC_OPEN_DATA'.
+    """
+    return prefix + re.sub(r'[^0-9A-Z]+', '_', secret_name.upper()).strip('_')
+
+
+class EnvSecretsProvider(SecretsProvider):
+    def __init__(self, prefix='SECRET_', environ=None):
+        self.prefix = prefix
+        self.environ = os.environ if environ is None else environ
+
+    def get(self, secret_name):
+        name = env_var_name(secret_name, self.prefix)
+        if name not in self.environ:
+            raise SecretNotFound(secret_name)
+        return self.environ[name]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} prefix={self.prefix}>"
+
+
+class FileSecretsProvider(SecretsProvider):
+    def __init__(self, path):
+        """
+        @param path: json file mapping secret names to secret strings, dict values are returned as json strings
+        """
+        self.path = path
+
+    def get(self, secret_name):
+        with open(self.path) as fp:
+            secrets = json.load(fp)
+        if secret_name not in secrets:
+            raise SecretNotFound(secret_name)
+        secret = secrets[secret_name]
+        return secret if isinstance(secret, str) else json.dumps(secret)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} path={self.path}>"
+
+
+class ChainSecretsProvider(SecretsProvider):
+    def __init__(self, providers):
+        self.providers = list(providers)
+
+    def get(self, secret_name):
+        for provider in self.providers:
+            try:
+                return provider.get(secret_name)
+            except SecretNotFound:
+                continue
+        raise SecretNotFound(secret_name)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} providers={self.providers}>"
+
+
+class EncryptedDiskCache:
+    """
+    Secrets encrypted with Fernet (cryptography) in a single json file, so that worker processes started within the
+    TTL reuse the secret fetched by the first one. The file is written atomically and only readable by its owner.
+    """
+    def __init__(self, path, key=None):
+        """
+        @param path: cache file
+        @param key: Optional: urlsafe base64 Fernet key, defaults to $NYC_SECRETS_CACHE_KEY
+        """
+        from cryptography.fernet import Fernet
+
+        key = key or os.getenv('NYC_SECRETS_CACHE_KEY')
+        if not key:
+            raise ValueError('An encryption key is required, pass key or set NYC_SECRETS_CACHE_KEY')
+        self.path = path
+        self._fernet = Fernet(key)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return dict()
+
+    def get(self, secret_name):
+        """
+        @return: (secret, fetched_at epoch seconds) or None
+        """
+        from cryptography.fernet import InvalidToken
+
+        with self._lock:
+            entry = self._read().get(secret_name)
+        if entry is None:
+            return None
+        try:
+            payload = json.loads(self._fernet.decrypt(entry.encode()))
+        except (InvalidToken, ValueError):
+            # written with another key, or corrupted: refetch
+            return None
+        secret = base64.b64decode(payload['secret']) if payload['binary'] else payload['secret']
+        return secret, payload['fetched_at']
+
+    def set(self, secret_name, secret, fetched_at):
+        binary = isinstance(secret, bytes)
+        payload = dict(secret=base64.b64encode(secret).decode() if binary else secret, binary=binary,
+                       fetched_at=fetched_at)
+        token = self._fernet.encrypt(json.dumps(payload).encode()).decode()
+        with self._lock:
+            entries = self._read()
+            entries[secret_name] = token
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.secrets-')
+            try:
+                with os.fdopen(fd, 'w') as fp:
+                    json.dump(entries, fp)
+                os.chmod(tmp_path, 0o600)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} path={self.path}>"
+
+
+class CachedSecretsProvider(SecretsProvider):
+    """
+    TTL cache in front of a provider, shared by threads: concurrent callers asking for the same expired secret wait
+    for a single fetch instead of each calling the provider.
+    """
+    def __init__(self, provider, ttl=DEFAULT_TTL, disk_cache=None, clock=time.time):
+        """
+        @param provider: SecretsProvider doing the actual fetch
+        @param ttl: seconds a secret is served from the cache
+        @param disk_cache: Optional: EncryptedDiskCache consulted before the provider
+        @param clock: epoch seconds function, time.time so that the disk cache can be shared by processes
+        """
+        self.provider = provider
+        self.ttl = ttl
+        self.disk_cache = disk_cache
+        self.clock = clock
+        self._cache = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def _fresh(self, entry):
+        return entry is not None and self.clock() - entry[1] < self.ttl
+
+    def get(self, secret_name):
+        entry = self._cache.get(secret_name)
+        if self._fresh(entry):
+            return entry[0]
+
+        with self._lock:
+            name_lock = self._locks.setdefault(secret_name, threading.Lock())
+        with name_lock:
+            entry = self._cache.get(secret_name)
+            if self._fresh(entry):
+                # fetched by another thread while we waited
+                return entry[0]
+            entry = self.disk_cache.get(secret_name) if self.disk_cache else None
+            if not self._fresh(entry):
+                entry = (self.provider.get(secret_name), self.clock())
+                self.fetches += 1
+                if self.disk_cache:
+                    self.disk_cache.set(secret_name, *entry)
+            self._cache[secret_name] = entry
+            return entry[0]
+
+    def invalidate(self, secret_name=None):
+        """Drops one secret, or every secret, from the in-process cache, e.g. after a credential rotation."""
+        with self._lock:
+            if secret_name is None:
+                self._cache = dict()
+            else:
+                self._cache.pop(secret_name, None)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} provider={self.provider}, ttl={self.ttl}>"
+
+
+def default_provider():
+    """
+    Builds the provider used by get_secret:
+        - $SECRET_<NAME> environment variables
+        - the json file in $NYC_SECRETS_FILE, if set
+        - AWS Secrets Manager in $AWS_REGION (default us-east-1)
+    cached for $NYC_SECRETS_TTL seconds, and on disk as well when $NYC_SECRETS_CACHE_FILE and $NYC_SECRETS_CACHE_KEY
+    are set.
+    """
+    providers = [EnvSecretsProvider()]
+    if os.getenv('NYC_SECRETS_FILE'):
+        providers.append(FileSecretsProvider(os.getenv('NYC_SECRETS_FILE')))
+    providers.append(AWSSecretsProvider(region_name=os.getenv('AWS_REGION') or REGION_NAME))
+
+    disk_cache = None
+    if os.getenv('NYC_SECRETS_CACHE_FILE') and os.getenv('NYC_SECRETS_CACHE_KEY'):
+        disk_cache = EncryptedDiskCache(os.getenv('NYC_SECRETS_CACHE_FILE'))
+    return CachedSecretsProvider(ChainSecretsProvider(providers), ttl=float(os.getenv('NYC_SECRETS_TTL', DEFAULT_TTL)),
+                                 disk_cache=disk_cache)
+
+
+_PROVIDER = None
+_PROVIDER_LOCK = threading.Lock()
+
+
+def get_provider():
+    global _PROVIDER
+    if _PROVIDER is None:
+        with _PROVIDER_LOCK:
+            if _PROVIDER is None:
+                _PROVIDER = default_provider()
+    return _PROVIDER
+
+
+def set_provider(provider):
+    """Replaces the provider used by get_secret, e.g. with a FileSecretsProvider in tests."""
+    global _PROVIDER
+    with _PROVIDER_LOCK:
+        _PROVIDER = provider
+
+
+def get_secret(secret_name, provider=None):
+
+    # secret_name = os.getenv('AWS_SECRET_NAME_NYC_OPEN_DATA')
+
+    return (provider or get_provider()).get(secret_name)
 
 
-# print(get_secret())
\ No newline at end of file
+# print(get_secret())
@@ -0,0 +1,187 @@
+"""
+Aggregations pushed down to Socrata with SoQL.
+
+The EDA questions (common.query.QUESTIONS) only need a few aggregated rows, which the API computes itself with
+$select/$where/$group in a few KB instead of the 2M rows of a full download:
+
+    engine = SoQLEngine(local_source='.data/crashes.parquet')
+    engine.count_by(None, by='borough', where={'zip_code': ['11207', '11201']}, top=5)
+    run_question(engine, '.data/crashes.parquet', 'collisions_by_borough')
+
+SoQLEngine has the QueryEngine.count_by interface and returns the same typed frame as the local engines: group-by
+columns, a `collisions` count and the requested sums, sorted by count. Requests that use a column SoQL can not compute,
+e.g. `hour` (crash_time is text) or columns that only exist after blending, are answered by a local engine on the
+source / local_source store instead.
+"""
+import json
+import logging
+
+from common.query.engines import COUNT_COLUMN, DERIVED_COLUMNS, QueryEngine, _conditions, get_engine
+from common.utilities.metrics import span
+from .config import NYC_OPEN_DATA_API_ENDPOINT
+from .soql import quote_literal, soql_url
+
+# SoQL expressions of the common.query derived columns, with the conversion to the local engines' values
+SOQL_DERIVED_COLUMNS = {
+    'year': dict(soql='date_extract_y(crash_date)', convert=None),
+    'month': dict(soql='date_extract_m(crash_date)', convert=None),
+    # Socrata counts days from Sunday=0, pandas from Monday=0
+    'day_of_week': dict(soql='date_extract_dow(crash_date)', convert=lambda values: (values + 6) % 7),
+}
+SOQL_OPERATORS = {'==': '=', '!=': '!=', '>': '>', '>=': '>=', '<': '<', '<=': '<='}
+# the API returns at most this many groups per request
+MAX_GROUPS = 50000
+
+logger = logging.getLogger(__name__)
+
+
+class LocalOnlyColumns(ValueError):
+    def __init__(self, columns):
+        super().__init__(f'Columns {sorted(columns)} can not be computed by SoQL')
+        self.columns = columns
+
+
+def _expression(col):
+    if col in SOQL_DERIVED_COLUMNS:
+        return SOQL_DERIVED_COLUMNS[col]['soql']
+    return col
+
+
+def local_only_columns(by, conditions=(), sums=(), remote_columns=None):
+    """
+    @param remote_columns: Optional: columns of the dataset, any other column is local only
+    @return: set of the columns SoQL can not compute
+    """
+    columns = set(by) | {col for col, _, _ in conditions} | set(sums)
+    local = {col for col in columns if col in DERIVED_COLUMNS and col not in SOQL_DERIVED_COLUMNS}
+    if remote_columns is not None:
+        local |= {col for col in columns if col not in DERIVED_COLUMNS and col not in remote_columns}
+    return local
+
+
+def build_query(by, where=None, top=None, sums=None, endpoint=NYC_OPEN_DATA_API_ENDPOINT, remote_columns=None):
+    """
+    Translates a count_by request to a SoQL url.
+    @param by: column name or list of column names, can include year, month and day_of_week
+    @param where: Optional: dict of filters, see common.query.engines._conditions
+    @param top: Optional: keep only the n largest groups
+    @param sums: Optional: numeric columns summed per group
+    @param endpoint: resource endpoint
+    @param remote_columns: Optional: columns of the dataset, used to detect local only columns
+    @return: url, raises LocalOnlyColumns if the request needs the local store
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    conditions = _conditions(where)
+    sums = list(sums or [])
+    local = local_only_columns(by, conditions, sums, remote_columns)
+    if local:
+        raise LocalOnlyColumns(local)
+
+    select = [f'{_expression(col)} AS {col}' for col in by]
+    select += [f'count(*) AS {COUNT_COLUMN}'] + [f'sum({col}) AS {col}' for col in sums]
+
+    # the local engines drop missing group keys
+    clauses = [f'{col} IS NOT NULL' for col in by if col not in SOQL_DERIVED_COLUMNS]
+    for col, op, value in conditions:
+        if op == 'in':
+            clauses.append(f"{_expression(col)} in({', '.join(quote_literal(v) for v in value)})")
+        else:
+            clauses.append(f'{_expression(col)} {SOQL_OPERATORS[op]} {quote_literal(value)}')
+
+    return soql_url(
+        endpoint,
+        select=', '.join(select),
+        where=' AND '.join(clauses) if clauses else None,
+        group=', '.join(_expression(col) for col in by),
+        order=f'{COUNT_COLUMN} DESC',
+        limit=int(top) if top else MAX_GROUPS,
+    )
+
+
+def to_frame(records, by, sums=(), dtypes=None):
+    """
+    Types the string values returned by the API: counts and sums are numeric, derived columns are integers in the
+    convention of the local engines, dtypes can cast the group-by columns.
+    @return: pandas.DataFrame sorted by COUNT_COLUMN descending
+    """
+    import pandas as pd
+
+    columns = list(by) + [COUNT_COLUMN] + list(sums)
+    df = pd.DataFrame.from_records(records, columns=columns)
+    for col in [COUNT_COLUMN] + list(sums):
+        df[col] = pd.to_numeric(df[col])
+    for col in by:
+        if col in SOQL_DERIVED_COLUMNS:
+            df[col] = pd.to_numeric(df[col]).astype('int64')
+            convert = SOQL_DERIVED_COLUMNS[col]['convert']
+            if convert:
+                df[col] = convert(df[col])
+    if dtypes:
+        df = df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+    return df.sort_values(COUNT_COLUMN, ascending=False, kind='stable').reset_index(drop=True)
+
+
+class SoQLEngine(QueryEngine):
+    name = 'soql'
+
+    def __init__(self, endpoint=NYC_OPEN_DATA_API_ENDPOINT, local_source=None, local_engine='auto', fetch=None,
+                 auth=None, remote_columns=None, dtypes=None, threads=None):
+        """
+        @param endpoint: resource endpoint
+        @param local_source: Optional: .parquet/.csv store used when count_by gets no source
+        @param local_engine: name of the common.query engine, or QueryEngine, used for local only requests
+        @param fetch: Optional: callable url -> list of records, defaults to get_data.get_page
+        @param auth: Optional: requests auth of the default fetch, False for an anonymous query
+        @param remote_columns: Optional: columns of the dataset, other columns are answered locally
+        @param dtypes: Optional: dict column -> dtype applied to the group-by columns of remote results
+        @param threads: Optional: threads of the local engine
+        """
+        super().__init__(threads)
+        self.endpoint = endpoint
+        self.local_source = local_source
+        self.local_engine = local_engine
+        self.fetch = fetch
+        self.auth = auth
+        self.remote_columns = remote_columns
+        self.dtypes = dtypes
+
+    def _fetch(self, url):
+        if self.fetch:
+            return self.fetch(url)
+        from .config import CONFIG
+        from .get_data import get_page
+
+        auth = CONFIG.auth if self.auth is None else self.auth
+        return json.loads(get_page(url, auth=auth).content)
+
+    def _local(self):
+        if isinstance(self.local_engine, QueryEngine):
+            return self.local_engine
+        self.local_engine = get_engine(self.local_engine, threads=self.threads, logger=logger.warning)
+        return self.local_engine
+
+    def count_by(self, source, by, where=None, top=None, sums=None):
+        """
+        Runs the aggregation on the API, or on the local store if it needs a local only column.
+        @param source: Optional: local .parquet/.csv store for the fallback, defaults to local_source
+        @return: pandas.DataFrame with the group-by columns, COUNT_COLUMN and the sums
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        if not by:
+            raise ValueError('Expected at least one column to group by.')
+        try:
+            url = build_query(by, where, top, sums, self.endpoint, self.remote_columns)
+        except LocalOnlyColumns as err:
+            source = source or self.local_source
+            if source is None:
+                raise ValueError(f'{err}, and no local store was given') from err
+            logger.info(f'{err}, falling back to the local store {source}')
+            return self._local().count_by(source, by, where=where, top=top, sums=sums)
+
+        with span('api.aggregate.soql') as s:
+            records = self._fetch(url)
+            s.add(rows=len(records))
+        return to_frame(records, by, list(sums or []), self.dtypes)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} endpoint={self.endpoint}, local_source={self.local_source}>"
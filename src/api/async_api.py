@@ -1,47 +1,77 @@
-from re import S
-import pandas as pd
 import asyncio
-from asyncio.events import get_event_loop
-from warnings import resetwarnings
-import aiohttp
 from asyncio import ensure_future, gather
 
-import time
-start = time.time()
+from common.utilities.rate_limit import get_limiter
+from common.utilities.retrying import (
+    FETCH_CIRCUIT_BREAKER, FETCH_RETRY_BUDGET, RetryableHTTPError, parse_retry_after, raise_for_retry_status,
+    retry_backoff
+)
+from .datasets import get_dataset
+from .soql import add_clauses, select_clause, soql_url
+from .transport import ACCEPT_ENCODING, parse_body, url_format
+
+# pandas and aiohttp are imported by the functions using them, importing this module stays cheap
 
 ###### Example 1: Using aiohttp.ClientSession with asyncio.ensure_future - uses gather to return the results
 
 async def request_controller(urls):
+    import aiohttp
+
     async with aiohttp.ClientSession() as sess:
         tasks = [ensure_future(request_worker(sess, url)) for url in urls]
         res = await gather(*tasks)
     return res
 
 
-async def request_worker(session, url):
-    async with session.get(url) as response:
-        return await response.json()
+@retry_backoff(
+    exceptions=(RetryableHTTPError, ConnectionError, asyncio.TimeoutError),
+    budget=FETCH_RETRY_BUDGET,
+    breaker=FETCH_CIRCUIT_BREAKER,
+)
+async def request_worker(session, url, limiter=None):
+    import aiohttp
+
+    limiter = limiter or get_limiter('socrata')
+    await limiter.acquire_async()
+    try:
+        async with session.get(url, headers={'Accept-Encoding': ACCEPT_ENCODING}) as response:
+            limiter.update(response.status, parse_retry_after(response.headers.get('Retry-After')))
+            raise_for_retry_status(response.status, response.headers, url)
+            response.raise_for_status()
+            # raw (decompressed) bytes, parsed by get_async_data without a round trip through str
+            return await response.read()
+    except aiohttp.ClientConnectionError as err:
+        raise ConnectionError(str(err)) from err
 
-def create_urls(id='collision_id'):
+def create_urls(id=None, endpoint=None, limit=50000, total=2_000_000, fields=None, dataset='crashes'):
     # we start with an offset of 0, we then increment the offset to be equal to the number of records returned. We are specifying the 
     # number of records returned via the API_LIMIT. 
-    offset, limit = 0, 50000
+    # fields (see data_blend.operations.df_prepare) becomes a $select, dropped columns are never transferred
+    # id and endpoint default to the order column and endpoint of the dataset (see datasets.DATASETS)
+    dataset = get_dataset(dataset)
+    id, endpoint = id or dataset.order, endpoint or dataset.endpoint
+    select = select_clause(fields)
+    offset = 0
     urls = list()
-    for _ in range(0, 2_000_000, limit): #2_000_000 / 
-        ENDPOINT = f'https://data.cityofnewyork.us/resource/h9gi-nx95.json?$limit={limit}&$offset={offset}&$order={id}'
+    for _ in range(0, total, limit): #2_000_000 / 
+        ENDPOINT = soql_url(endpoint, limit=limit, offset=offset, order=id, select=select)
         urls.append(ENDPOINT)
         offset += limit
     return urls
 
 
-def get_async_data():
-    urls = create_urls()
-    assert isinstance(urls, list), 'Urls is not a list!'
+def get_async_data(urls=None, fields=None, dataset='crashes'):
+    import pandas as pd
+
+    if urls is None:
+        urls = create_urls(fields=fields, dataset=dataset)
+    else:
+        assert isinstance(urls, list), 'Urls is not a list!'
+        urls = [add_clauses(url, select=select_clause(fields)) for url in urls]
     loop = asyncio.get_event_loop()
-    text_results = loop.run_until_complete(request_controller(urls))
-    print('Resuls of the first element in the text results: ')
-    print(text_results[0])
-    dfs = [pd.read_json(response, orient='records') for response in text_results]
+    bodies = loop.run_until_complete(request_controller(urls))
+    # .json pages become records, .csv pages (see transport.resource_url) are parsed by pandas.read_csv
+    dfs = [parse_body(body, url_format(url)) for url, body in zip(urls, bodies)]
     return pd.concat(dfs, ignore_index=True)
 
 
@@ -53,20 +83,25 @@ async def get_response_text_asynchronous(url, session):
         response = await session.request(method='GET', url=url)
     except Exception as err:
         print(f'Exception has occurred: {err}')
-    response_text = await response.text.encode("utf8")
+        raise
+    response_text = await response.read()
     return response_text
 
 async def run_all(url, session): # wrapper for running the asynchronous program
     try:
         text_response = await get_response_text_asynchronous(url, session)
     except Exception as err:
-        print('Exception has occurred, ')
+        # there is no page to return, gather fails with the error
+        print(f'Exception has occurred: {err}')
+        raise
     return text_response
 
-LIST_URLS = create_urls()
+async def finalize_program(urls=None):
+    import aiohttp
+    import pandas as pd
 
-async def finalize_program():
-    with asyncio.ClientSession() as session:
-        test_response = await gather(*[run_all(url, session) for url in LIST_URLS])
+    urls = create_urls() if urls is None else urls
+    async with aiohttp.ClientSession() as session:
+        test_response = await gather(*[run_all(url, session) for url in urls])
         dfs = [pd.read_json(response, orient='records') for response in test_response]
     return pd.concat(dfs, ignore_index=True)
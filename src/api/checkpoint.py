@@ -0,0 +1,265 @@
+"""
+Resumable, checkpointed download of the paginated API.
+
+Every page is written atomically to a spool directory (zstd compressed Parquet or gzipped NDJSON) and recorded in
+spool/manifest.json with its row count, the sha256 checksum of the spool file and the fetch time. A restarted download
+skips the pages whose spool file is present and matches its checksum, so a failure on page 37 of 40 costs one page,
+not the whole pull. Once every page is in, compact() concatenates the spool, in url order, into the main store file
+(.parquet or .csv) queried by common.query.
+
+    downloader = CheckpointedDownloader('.data/spool/crashes', create_urls())
+    downloader.run('.data/crashes.parquet')
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from common.utilities.executors import get_executor
+from common.utilities.filesystem import atomic_write
+from common.utilities.logging_settings import stage_fields
+from common.utilities.metrics import span
+
+FORMATS = {'parquet': '.parquet', 'ndjson': '.ndjson.gz'}
+MANIFEST = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+
+class IncompleteDownload(Exception):
+    def __init__(self, failed):
+        super().__init__(f'{len(failed)} page(s) failed, run the download again to fetch them: {sorted(failed)}')
+        self.failed = failed
+
+
+def page_key(url):
+    return hashlib.sha1(url.encode()).hexdigest()[:20]
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_store(df, output):
+    """
+    Writes df atomically to the main store file.
+    @param df: pandas.DataFrame
+    @param output: .parquet, .csv or .feather/.arrow (memory-mappable snapshot, see common.query.snapshot) path
+    """
+    if output.endswith(('.feather', '.arrow')):
+        from common.query.snapshot import write_snapshot
+
+        write_snapshot(df, output)
+    elif output.endswith('.parquet'):
+        with atomic_write(output, 'wb') as fp:
+            df.to_parquet(fp, index=False)
+    elif output.endswith('.csv'):
+        with atomic_write(output, 'w', newline='') as fp:
+            df.to_csv(fp, index=False)
+    else:
+        raise ValueError(f'Unknown file format for output={output}, expected .parquet, .csv or .feather')
+
+
+def read_store(path, columns=None):
+    """
+    Reads the main store file written by write_store.
+    @param path: .parquet, .csv or .feather/.arrow path
+    @param columns: Optional: columns to read
+    @return: pandas.DataFrame
+    """
+    import pandas as pd
+
+    if path.endswith(('.feather', '.arrow')):
+        from common.query.snapshot import read_snapshot
+
+        return read_snapshot(path, columns=columns)
+    elif path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    elif path.endswith('.csv'):
+        # the API returns every field as text, so does the csv store
+        return pd.read_csv(path, usecols=columns, dtype=str)
+    raise ValueError(f'Unknown file format for path={path}, expected .parquet, .csv or .feather')
+
+
+class Manifest:
+    """Page records of a spool directory, persisted atomically after every page."""
+    def __init__(self, path, file_format):
+        self.path = path
+        self.file_format = file_format
+        self.pages = dict()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as fp:
+                data = json.load(fp)
+            if data['format'] != file_format:
+                raise ValueError(f"Spool at {path} holds {data['format']} pages, got file_format={file_format}")
+            self.pages = data['pages']
+
+    def add(self, key, **entry):
+        with self._lock:
+            self.pages[key] = entry
+            with atomic_write(self.path, 'w') as fp:
+                json.dump(dict(format=self.file_format, pages=self.pages), fp, indent=1, sort_keys=True)
+
+    def is_complete(self, key, directory):
+        entry = self.pages.get(key)
+        if entry is None:
+            return False
+        path = os.path.join(directory, entry['file'])
+        return os.path.exists(path) and file_checksum(path) == entry['checksum']
+
+    def __len__(self):
+        return len(self.pages)
+
+
+class CheckpointedDownloader:
+    def __init__(self, spool_dir, urls, file_format='parquet', fetch=None, auth=None, executor='io', validator=None,
+                 on_page=None):
+        """
+        @param spool_dir: directory holding the page files and the manifest
+        @param urls: page urls, e.g. from async_api.create_urls, their order is the order of the compacted store
+        @param file_format: 'parquet' or 'ndjson'
+        @param fetch: Optional: callable url -> list of records, defaults to get_data.get_page
+        @param auth: Optional: requests auth for the default fetch, defaults to the basic auth of CONFIG,
+                     False for an anonymous pull
+        @param executor: name of a common.utilities.executors pool or an Executor, pages are fetched concurrently
+        @param validator: Optional: common.data_blend.validation.Validator, compact() only writes the valid rows and
+                          quarantines the others under the name of the output file
+        @param on_page: Optional: callable (url, pandas.DataFrame) called by compact() for every page, in url order,
+                        e.g. common.utilities.heavy_hitters.HeavyHitters.on_page
+        """
+        if file_format not in FORMATS:
+            raise ValueError(f"Expected one of {', '.join(FORMATS)} as file_format, got={file_format}")
+
+        self.spool_dir = spool_dir
+        self.urls = list(urls)
+        self.file_format = file_format
+        self.fetch = fetch or self._fetch
+        self.auth = auth
+        self.executor = executor
+        self.validator = validator
+        self.on_page = on_page
+        os.makedirs(spool_dir, exist_ok=True)
+        self.manifest = Manifest(os.path.join(spool_dir, MANIFEST), file_format)
+
+    def _fetch(self, url):
+        from .config import CONFIG
+        from .get_data import get_page
+
+        auth = CONFIG.auth if self.auth is None else self.auth
+        return json.loads(get_page(url, auth=auth).content)
+
+    def missing(self):
+        """
+        @return: urls whose page is not in the spool, or whose spool file is missing or corrupted
+        """
+        return [url for url in self.urls if not self.manifest.is_complete(page_key(url), self.spool_dir)]
+
+    def _write_page(self, path, records):
+        if self.file_format == 'parquet':
+            import pandas as pd
+
+            with atomic_write(path, 'wb') as fp:
+                pd.DataFrame.from_records(records).to_parquet(fp, compression='zstd', index=False)
+        else:
+            with atomic_write(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as fp:
+                for record in records:
+                    fp.write(json.dumps(record).encode() + b'\n')
+
+    def _read_page(self, path):
+        import pandas as pd
+
+        if self.file_format == 'parquet':
+            return pd.read_parquet(path)
+        with gzip.open(path, 'rt') as fp:
+            return pd.DataFrame.from_records([json.loads(line) for line in fp])
+
+    def download_page(self, url):
+        key = page_key(url)
+        file_name = key + FORMATS[self.file_format]
+        path = os.path.join(self.spool_dir, file_name)
+        with span('api.checkpoint.page') as s:
+            records = self.fetch(url)
+            self._write_page(path, records)
+            s.add(rows=len(records), nbytes=os.path.getsize(path))
+        logger.info(f'Spooled page {key} of {self.spool_dir}', extra=stage_fields(
+            'api.checkpoint.page', rows=s.rows, nbytes=s.nbytes, duration_s=s.elapsed_s, rate_limited=True))
+        self.manifest.add(key, url=url, file=file_name, rows=len(records), checksum=file_checksum(path),
+                          fetched_at=datetime.now(timezone.utc).isoformat())
+        return key
+
+    def submit(self):
+        """
+        Submits the missing pages to the executor without waiting, so that several downloaders can share the pool.
+        @return: dict url -> Future, to be passed to wait()
+        """
+        missing = self.missing()
+        logger.info(f'{len(self.urls) - len(missing)}/{len(self.urls)} pages already spooled in {self.spool_dir}')
+        pool = get_executor(self.executor) if isinstance(self.executor, str) else self.executor
+        return {url: pool.submit(self.download_page, url) for url in missing}
+
+    @staticmethod
+    def wait(futures):
+        """
+        Waits for submitted pages. Pages that fail are logged and reported together once the others are spooled.
+        """
+        failed = list()
+        for url, future in futures.items():
+            try:
+                future.result()
+            except Exception as err:
+                logger.error(f'{err.__class__.__name__} - {err} - page {url} not spooled')
+                failed.append(page_key(url))
+        if failed:
+            raise IncompleteDownload(failed)
+
+    def download(self):
+        """
+        Fetches the missing pages.
+        @return: number of pages fetched by this call
+        """
+        futures = self.submit()
+        self.wait(futures)
+        return len(futures)
+
+    def compact(self, output):
+        """
+        Concatenates the spooled pages, validated if a validator is set, into the main store, written atomically.
+        @param output: .parquet, .csv or .feather path
+        @return: number of rows written
+        """
+        import pandas as pd
+
+        missing = self.missing()
+        if missing:
+            raise IncompleteDownload([page_key(url) for url in missing])
+
+        with span('api.checkpoint.compact') as s:
+            frames = list()
+            for url in self.urls:
+                frame = self._read_page(os.path.join(self.spool_dir, self.manifest.pages[page_key(url)]['file']))
+                if self.on_page is not None:
+                    # pages spooled by an earlier run are seen too, unlike in download_page
+                    self.on_page(url, frame)
+                frames.append(frame)
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            if self.validator is not None:
+                df = self.validator.validate(df, part=os.path.splitext(os.path.basename(output))[0]).valid
+            write_store(df, output)
+            s.add(rows=len(df), nbytes=os.path.getsize(output))
+        return len(df)
+
+    def run(self, output):
+        self.download()
+        return self.compact(output)
+
+    def __repr__(self):
+        return (f"<{self.__class__.__name__} spool_dir={self.spool_dir}, pages={len(self.manifest)}/{len(self.urls)}, "
+                f"file_format={self.file_format}>")
@@ -0,0 +1,96 @@
+"""
+Lazy configuration and credentials for the NYC Open Data API.
+
+Nothing is read at import time: the secret name is resolved from the environment or infra/aws/secret.json, and the
+secret itself is fetched through infra.aws.secrets_manager, the first time a credential is accessed. The secrets
+provider caches it for its TTL, so credential properties can be read on every request.
+"""
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    # infra/ lives next to src/
+    sys.path.append(str(ROOT))
+
+API_LIMIT = 50000  # we want to pull 50,000 records at each iteration
+# requests (connect, read) timeout in seconds: a hung connection raises requests.Timeout and is retried instead of
+# blocking a pool worker forever
+REQUEST_TIMEOUT = (10, 120)
+NYC_OPEN_DATA_API_ENDPOINT = 'https://data.cityofnewyork.us/resource/h9gi-nx95.json'
+SECRET_FILE = ROOT / 'infra' / 'aws' / 'secret.json'
+
+
+class OpenDataConfig:
+    def __init__(self, endpoint=NYC_OPEN_DATA_API_ENDPOINT, api_limit=API_LIMIT, secret_name=None, secret_file=None,
+                 provider=None, timeout=REQUEST_TIMEOUT):
+        """
+        @param endpoint: dataset resource endpoint
+        @param api_limit: page size used by the paginated pulls
+        @param secret_name: Optional: AWS secret name, defaults to $AWS_SECRET_NAME_NYC_OPEN_DATA or the secret file
+        @param secret_file: Optional: json file holding [{"AWS_SECRET_NAME_NYC_OPEN_DATA": ...}], defaults to
+                            $NYC_OPEN_DATA_SECRET_FILE or infra/aws/secret.json
+        @param provider: Optional: infra.aws.secrets_manager.SecretsProvider, defaults to the process wide provider
+        @param timeout: requests timeout of every page fetch, seconds or a (connect, read) tuple
+        """
+        self.endpoint = endpoint
+        self.api_limit = api_limit
+        self._secret_name = secret_name
+        self.secret_file = secret_file or os.getenv('NYC_OPEN_DATA_SECRET_FILE') or str(SECRET_FILE)
+        self.provider = provider
+        self.timeout = timeout
+
+    @property
+    def secret_name(self):
+        if self._secret_name is None:
+            name = os.getenv('AWS_SECRET_NAME_NYC_OPEN_DATA')
+            if not name:
+                with open(self.secret_file) as fp:
+                    name = json.load(fp)[0].get('AWS_SECRET_NAME_NYC_OPEN_DATA')
+            self._secret_name = name
+        return self._secret_name
+
+    @property
+    def secret_data(self):
+        from infra.aws.secrets_manager import get_secret
+
+        data = json.loads(get_secret(self.secret_name, provider=self.provider))
+        if not isinstance(data, dict):
+            raise ValueError('SECRET_DATA was not loaded properly!')
+        return data
+
+    @property
+    def api_key(self):
+        return self.secret_data['NYC_OPEN_DATA_API_KEY']
+
+    @property
+    def api_secret(self):
+        return self.secret_data['NYC_OPEN_DATA_API_SECRET']
+
+    @property
+    def app_token(self):
+        return self.secret_data['NYC_OPEN_DATA_APP_TOKEN']
+
+    @property
+    def app_secret(self):
+        return self.secret_data['NYC_OPEN_DATA_APP_SECRET']
+
+    @property
+    def auth(self):
+        from requests.auth import HTTPBasicAuth
+
+        return HTTPBasicAuth(self.api_key, self.api_secret)
+
+    @property
+    def headers(self):
+        credentials = base64.b64encode(str.encode(f'{self.api_key}:{self.api_secret}')).decode()
+        return {'Authorization': f'Basic {credentials}', }
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} endpoint={self.endpoint}, provider={self.provider}>"
+
+
+CONFIG = OpenDataConfig()
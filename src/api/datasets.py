@@ -0,0 +1,106 @@
+"""
+Registry of the Socrata datasets the ingestion engine can pull.
+
+Every NYC Open Data table is pulled the same way: sliced by a date column, pages ordered by a unique key, cached per
+partition and synced by row hashes. Only the names differ, a Dataset holds them:
+
+    fetcher = PartitionedFetcher('.data/partitions/persons', dataset='persons')
+    fetcher.sync('.data/persons.parquet')
+    create_urls(dataset='vehicles', total=100_000)
+
+The Motor Vehicle Collisions tables share the collision_id column, their stores are joined locally with DuckDB:
+
+    join_datasets({'crashes': '.data/crashes.parquet', 'persons': '.data/persons.parquet'},
+                  columns={'crashes': ['borough'], 'persons': ['person_type', 'person_injury']})
+"""
+DOMAIN = 'data.cityofnewyork.us'
+JOIN_KEY = 'collision_id'
+
+# Socrata serves every number as a JSON string, the stores keep them as pulled and the joins cast them
+_COUNT_TYPES = {col: 'INTEGER' for col in [
+    'number_of_persons_injured', 'number_of_persons_killed', 'number_of_pedestrians_injured',
+    'number_of_pedestrians_killed', 'number_of_cyclist_injured', 'number_of_cyclist_killed',
+    'number_of_motorist_injured', 'number_of_motorist_killed',
+]}
+
+
+class Dataset:
+    def __init__(self, name, dataset_id, key, order=None, date_column='crash_date', updated_column=':updated_at',
+                 dtypes=None, join_key=JOIN_KEY, domain=DOMAIN):
+        """
+        @param name: short name, also the default name of its cache directory, store and database table
+        @param dataset_id: Socrata dataset identifier, e.g. h9gi-nx95
+        @param key: column unique per row, the key of the row hashes and of the upserts
+        @param order: Optional: unique column ordering the pages, defaults to key
+        @param date_column: floating timestamp column the dataset is partitioned on
+        @param updated_column: column holding the last update of a row, the :updated_at system field of Socrata; the
+                               partitions holding an updated row are re-pulled (see api.partitions), None to disable
+        @param dtypes: Optional: dict column -> DuckDB type the column is cast to when the store is queried
+        @param join_key: column relating the dataset to the other tables, None if it can not be joined
+        @param domain: Socrata domain hosting the dataset
+        """
+        self.name = name
+        self.dataset_id = dataset_id
+        self.key = key
+        self.order = order or key
+        self.date_column = date_column
+        self.updated_column = updated_column
+        self.dtypes = dict(dtypes or dict())
+        self.join_key = join_key
+        self.domain = domain
+
+    @property
+    def endpoint(self):
+        return f'https://{self.domain}/resource/{self.dataset_id}.json'
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} name={self.name}, dataset_id={self.dataset_id}, key={self.key}>"
+
+
+DATASETS = {dataset.name: dataset for dataset in [
+    Dataset('crashes', 'h9gi-nx95', key='collision_id',
+            dtypes={'collision_id': 'BIGINT', 'crash_date': 'TIMESTAMP', 'latitude': 'DOUBLE', 'longitude': 'DOUBLE',
+                    **_COUNT_TYPES}),
+    Dataset('persons', 'f55k-p6yu', key='unique_id',
+            dtypes={'unique_id': 'BIGINT', 'collision_id': 'BIGINT', 'crash_date': 'TIMESTAMP',
+                    'vehicle_id': 'BIGINT', 'person_age': 'INTEGER'}),
+    Dataset('vehicles', 'bm4k-52h4', key='unique_id',
+            dtypes={'unique_id': 'BIGINT', 'collision_id': 'BIGINT', 'crash_date': 'TIMESTAMP',
+                    'vehicle_year': 'INTEGER', 'vehicle_occupants': 'INTEGER'}),
+]}
+
+
+def get_dataset(dataset):
+    """
+    @param dataset: Dataset, or the name or Socrata identifier of a registered one
+    @return: Dataset
+    """
+    if isinstance(dataset, Dataset):
+        return dataset
+    if dataset in DATASETS:
+        return DATASETS[dataset]
+    for candidate in DATASETS.values():
+        if candidate.dataset_id == dataset:
+            return candidate
+    raise ValueError(f"Unknown dataset={dataset}, expected one of {', '.join(DATASETS)} or a Dataset")
+
+
+def join_datasets(stores, columns=None, where=None, how='inner', connection=None):
+    """
+    Joins the stores of registered datasets on their join key, see common.query.joins.join_stores.
+    @param stores: dict dataset name -> .parquet, .csv or .feather store, the first one is joined to the others
+    @param columns: Optional: dict dataset name -> columns selected from its store
+    @param where: Optional: dict of filters keyed by 'dataset.column'
+    @param how: 'inner' or 'left'
+    @param connection: Optional: duckdb connection
+    @return: pandas.DataFrame
+    """
+    from common.query.joins import join_stores
+
+    datasets = {name: get_dataset(name) for name in stores}
+    keys = {dataset.join_key for dataset in datasets.values()}
+    if len(keys) != 1 or None in keys:
+        join_keys = {name: dataset.join_key for name, dataset in datasets.items()}
+        raise ValueError(f'Expected datasets sharing one join key, got={join_keys}')
+    tables = {name: (source, datasets[name].dtypes) for name, source in stores.items()}
+    return join_stores(tables, on=keys.pop(), columns=columns, where=where, how=how, connection=connection)
@@ -20,73 +20,124 @@
 
 # https://dev.socrata.com/docs/queries/
 # We want to use "Pagination" to query through the API to pull back all the records.
-import sys
-import os
-from pathlib import Path
-CWD = str(Path.cwd().parent.parent)
-sys.path.append(CWD)
-from pandas.core import api
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import base64 
-import traceback
-from datetime import datetime, timedelta
-import warnings
-from infra.aws.secrets_manager import get_secret
-from sodapy import Socrata
-import pandas as pd
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import API_LIMIT, CONFIG, NYC_OPEN_DATA_API_ENDPOINT
+from .datasets import get_dataset
+from .soql import select_clause, soql_url
+from common.utilities.rate_limit import get_limiter
+from common.utilities.retrying import (
+    FETCH_CIRCUIT_BREAKER, FETCH_RETRY_BUDGET, RetryableHTTPError, parse_retry_after, raise_for_retry_status,
+    retry_backoff
+)
+
+# pandas, requests and sodapy are imported by the functions using them, and the credentials are only fetched from
+# AWS Secrets Manager on first use (see api.config), so importing this module is fast and needs no network.
 
 # Constant flags
 API_VERIFY_SSL = False
 # API_OUTPUT = '/Users/jordancarson/Projects/JPM/data-engineering-nyc/.data/json/data_pagination.json'
 # API_WRITE_FILE = open(API_OUTPUT, 'w')
 
-# API Constants
-API_LIMIT = 50000 # we want to pull 50,000 records at each iteration
-NYC_OPEN_DATA_API_ENDPOINT = 'https://data.cityofnewyork.us/resource/h9gi-nx95.json'
-
-secretARN = json.load(open(os.path.join('/Users/jordancarson/Projects/JPM/data-engineering-nyc', 'infra', 'aws', 'secret.json')))[0]
-SECRET_DATA = json.loads(get_secret(os.getenv('AWS_SECRET_NAME_NYC_OPEN_DATA') or secretARN.get('AWS_SECRET_NAME_NYC_OPEN_DATA')))
-assert isinstance(SECRET_DATA, dict), 'SECRET_DATA was not loaded properly!'
+# credentials previously loaded at import time, now resolved lazily through __getattr__
+_LAZY_CONSTANTS = {
+    'SECRET_DATA': lambda: CONFIG.secret_data,
+    'NYC_OPEN_DATA_API_KEY': lambda: CONFIG.api_key,
+    'NYC_OPEN_DATA_API_SECRET': lambda: CONFIG.api_secret,
+    'NYC_OPEN_DATA_APP_TOKEN': lambda: CONFIG.app_token,
+    'NYC_OPEN_DATA_APP_SECRET': lambda: CONFIG.app_secret,
+    'TOKEN_DATA': lambda: {'client_id': CONFIG.api_key, 'client_secret': CONFIG.api_secret},
+    'TOKEN_HEADERS': lambda: CONFIG.headers,
+    'HEADERS': lambda: CONFIG.headers,
+}
+_lazy_lock = threading.Lock()
 
-NYC_OPEN_DATA_API_KEY = SECRET_DATA["NYC_OPEN_DATA_API_KEY"]
-NYC_OPEN_DATA_API_SECRET =  SECRET_DATA['NYC_OPEN_DATA_API_SECRET']
-NYC_OPEN_DATA_APP_TOKEN = SECRET_DATA['NYC_OPEN_DATA_APP_TOKEN']
-NYC_OPEN_DATA_APP_SECRET = SECRET_DATA['NYC_OPEN_DATA_APP_SECRET']
 
-BASE_CREDENTIALS_64 = base64.b64encode(str.encode(f'{NYC_OPEN_DATA_API_KEY}:{NYC_OPEN_DATA_API_SECRET}')).decode()
-TOKEN_DATA = {
-    'client_id': NYC_OPEN_DATA_API_KEY, 'client_secret': NYC_OPEN_DATA_API_SECRET
-}
-TOKEN_HEADERS = HEADERS = {'Authorization': f'Basic {BASE_CREDENTIALS_64}', }
+def __getattr__(name):
+    if name not in _LAZY_CONSTANTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _lazy_lock:
+        value = globals()[name] = _LAZY_CONSTANTS[name]()
+    return value
 
 
 def get_response():
-    response = requests.get(NYC_OPEN_DATA_API_ENDPOINT, None)
+    import requests
+
+    response = requests.get(NYC_OPEN_DATA_API_ENDPOINT, None, timeout=CONFIG.timeout)
+    return response
+
+
+@retry_backoff(exceptions=(RetryableHTTPError, ConnectionError, TimeoutError), budget=FETCH_RETRY_BUDGET,
+               breaker=FETCH_CIRCUIT_BREAKER)
+def get_page(url, auth=None, limiter=None, timeout=None):
+    """
+    GET one page of the API, retried with jittered backoff on throttling (429), transient server errors, timeouts and
+    connection problems. Other HTTP errors are raised immediately. Requests go through the process wide 'socrata'
+    token bucket, shared with the asyncio fetcher.
+    @param timeout: Optional: requests timeout, defaults to CONFIG.timeout
+    """
+    import requests
+
+    limiter = limiter or get_limiter('socrata')
+    limiter.acquire()
+    try:
+        response = requests.get(url, auth=auth, timeout=CONFIG.timeout if timeout is None else timeout)
+    except requests.ConnectionError as err:
+        raise ConnectionError(str(err)) from err
+    except requests.Timeout as err:
+        raise TimeoutError(str(err)) from err
+    limiter.update(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    raise_for_retry_status(response.status_code, response.headers, url)
+    response.raise_for_status()
     return response
 
 
-def api_pagination_results(last_offset_value=1829000, orient = 'records'):
+def get_all(urls, workers=15, auth=None):
+    """
+    Fetches urls on a thread pool, the shared token bucket keeps the workers under the API request rate.
+    @param urls: list of page urls, e.g. from async_api.create_urls
+    @param workers: number of threads
+    @param auth: Optional: requests auth
+    @return: list of response bodies as bytes, in the order of urls
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda url: get_page(url, auth=auth).content, urls))
+
+
+def api_pagination_results(last_offset_value=1829000, orient = 'records', endpoint=None, limit=API_LIMIT, auth=None,
+                           fields=None, dataset='crashes'):
     """
     One method to pull data from the Open Source API is to 
+    @param auth: Optional: requests auth, defaults to the basic auth of CONFIG, pass False for an anonymous pull
+    @param fields: Optional: fields spec of data_blend.operations.df_prepare, only the columns it keeps are requested
+    @param dataset: datasets.Dataset or name of a registered one, its endpoint is used when endpoint is not given
     """
-    ID = 'collision_id'
+    import pandas as pd
+
+    auth = CONFIG.auth if auth is None else auth
+    dataset = get_dataset(dataset)
+    endpoint = endpoint or dataset.endpoint
+    ID = dataset.order
+    select = select_clause(fields)
     finished = False
     offset = 0
     out_frames = list()
     while not finished:
-        ENDPOINT = f'https://data.cityofnewyork.us/resource/h9gi-nx95.json?$limit={API_LIMIT}&$offset={offset}&$order={ID}'
-        response = requests.get(ENDPOINT, auth=HTTPBasicAuth(NYC_OPEN_DATA_API_KEY, NYC_OPEN_DATA_API_SECRET))
+        ENDPOINT = soql_url(endpoint, limit=limit, offset=offset, order=ID, select=select)
+        response = get_page(ENDPOINT, auth=auth)
 
-        temp_df = pd.read_json(response.text, orient=orient)
+        # parsed from the raw bytes, response.text would decode (and guess the charset of) the whole page first
+        temp_df = pd.read_json(io.BytesIO(response.content), orient=orient)
         length = len(temp_df)
         out_frames.append(temp_df)
         print(length)
         
         offset += temp_df.shape[0] # len(temp_df)
 
-        if length < API_LIMIT:
+        if length < limit:
             finished = True
         
     # concatenate the list into one master dataframe
@@ -94,12 +145,15 @@ def api_pagination_results(last_offset_value=1829000, orient = 'records'):
     return df
     
 
-def socrate_results():
+def socrate_results(dataset='crashes'):
+    import pandas as pd
+    from sodapy import Socrata
 
     # Unauthenticated client only works with public data sets. Note 'None'
     # in place of application token, and no username or password:
     print("Running via Socrata...")
-    client = Socrata("data.cityofnewyork.us", None)
+    dataset = get_dataset(dataset)
+    client = Socrata(dataset.domain, None)
 
     # Example authenticated client (needed for non-public datasets):
     # client = Socrata(data.cityofnewyork.us,
@@ -109,7 +163,7 @@ def socrate_results():
 
     # First 2000 results, returned as JSON from API / converted to Python list of
     # dictionaries by sodapy.
-    results = client.get("h9gi-nx95", limit=2000, offset=0)
+    results = client.get(dataset.dataset_id, limit=2000, offset=0)
 
     # Convert to pandas DataFrame
     results_df = pd.DataFrame.from_records(results)
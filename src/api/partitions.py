@@ -0,0 +1,355 @@
+"""
+Partitioned pull of a Socrata dataset by ranges of its date column.
+
+Offset pagination over the whole table makes the server sort all rows for every page. Instead, the planner asks for
+the number of rows per month once:
+
+    $select=date_trunc_ym(crash_date) AS month, count(*) AS n, max(:updated_at) AS updated&$group=month&$order=month
+
+and slices every year into calendar-aligned halves, quarters or months of at most target_rows, each fetched with
+`$where=crash_date between '<first day>T00:00:00.000' and '<last day>T23:59:59.999'`. Slices are independent: their
+pages are fetched concurrently on the io pool (or by the async fetcher, see PartitionedFetcher.urls), each one is
+checkpointed and cached on its own under cache_dir, and a refresh only re-pulls the slices whose count changed or
+that end after refresh_since or hold a row updated since they were cached, leaving historical partitions untouched:
+
+    fetcher = PartitionedFetcher('.data/partitions/crashes')
+    fetcher.fetch(refresh_since=date(2021, 9, 1))
+    fetcher.compact('.data/crashes.parquet')
+
+Other registered datasets (see api.datasets) are pulled the same way, e.g. with dataset='persons'.
+"""
+import json
+import logging
+import os
+import shutil
+from datetime import date, datetime, timedelta, timezone
+
+from common.data_blend.hashing import (
+    dedupe, diff, fingerprint, hashes_path, read_hashes, row_hashes, write_hashes
+)
+from common.utilities.filesystem import atomic_write
+from common.utilities.metrics import span
+from .checkpoint import CheckpointedDownloader, read_store, write_store
+from .config import API_LIMIT, NYC_OPEN_DATA_API_ENDPOINT
+from .datasets import get_dataset
+from .soql import quote_literal, select_clause, soql_url
+
+STATE = 'partitions.json'
+
+logger = logging.getLogger(__name__)
+
+
+class Partition:
+    def __init__(self, start, end, rows, updated=None):
+        """
+        @param start: first day of the first month of the slice
+        @param end: first day of the month following the slice
+        @param rows: number of rows reported by the count query
+        @param updated: Optional: last update of a row of the slice reported by the count query, ISO timestamp
+        """
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.updated = updated
+
+    @property
+    def key(self):
+        return f'{self.start:%Y-%m}_{self.end:%Y-%m}'
+
+    @property
+    def last_day(self):
+        return self.end - timedelta(days=1)
+
+    def where(self, date_column='crash_date'):
+        return (f"{date_column} between {quote_literal(self.start)} and "
+                f"'{self.last_day.isoformat()}T23:59:59.999'")
+
+    def __eq__(self, other):
+        if not isinstance(other, Partition):
+            return NotImplemented
+        return (self.start, self.end, self.rows) == (other.start, other.end, other.rows)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} key={self.key}, rows={self.rows}>"
+
+
+# calendar-aligned slice lengths in months, a slice of more than target_rows rows is split into the next length
+SLICE_MONTHS = (12, 6, 3, 1)
+
+
+def count_url(endpoint=NYC_OPEN_DATA_API_ENDPOINT, date_column='crash_date', updated_column=None):
+    select = f'date_trunc_ym({date_column}) AS month, count(*) AS n'
+    if updated_column:
+        select += f', max({updated_column}) AS updated'
+    return soql_url(endpoint, select=select, group='month', order='month', limit=10000)
+
+
+def parse_counts(records):
+    """
+    Parses the count query result.
+    @param records: [{'month': '2012-07-01T00:00:00.000', 'n': '12345'}, ...], records without month are skipped
+    @return: list of (date first day of month, int count), sorted by month
+    """
+    counts = [(datetime.strptime(record['month'][:10], '%Y-%m-%d').date(), int(record['n']))
+              for record in records if record.get('month')]
+    return sorted(counts)
+
+
+def parse_updated(records):
+    """
+    @param records: count query result, see parse_counts, with the updated field of count_url(updated_column=...)
+    @return: dict first day of month -> last update of its rows, ISO timestamp
+    """
+    return {datetime.strptime(record['month'][:10], '%Y-%m-%d').date(): record['updated']
+            for record in records if record.get('month') and record.get('updated')}
+
+
+def add_months(day, months):
+    """
+    @return: date, first day of the month months after the month of day
+    """
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _slice(start, level, counts, target_rows, updated, partitions):
+    months = SLICE_MONTHS[level]
+    end = add_months(start, months)
+    rows = sum(count for month, count in counts if start <= month < end)
+    if not rows:
+        return
+    if rows <= target_rows or level + 1 == len(SLICE_MONTHS):
+        last_update = max((value for month, value in updated.items() if start <= month < end), default=None)
+        partitions.append(Partition(start, end, rows, last_update))
+        return
+    step = SLICE_MONTHS[level + 1]
+    for offset in range(0, months, step):
+        _slice(add_months(start, offset), level + 1, counts, target_rows, updated, partitions)
+
+
+def plan_partitions(counts, target_rows=500_000, updated=None):
+    """
+    Slices the dataset into calendar-aligned blocks: every year is split into halves, quarters and then months while
+    a block has more than target_rows rows, a month larger than target_rows is a slice on its own and blocks without
+    rows are skipped. The boundaries of a block only depend on its own rows: rows added to a month, e.g. reports filed
+    late for an old month, only re-slice the block holding that month and every other cached partition keeps its key.
+    @param counts: list of (first day of month, count) as returned by parse_counts
+    @param target_rows: maximum rows per slice, unless a single month holds more
+    @param updated: Optional: dict month -> last update as returned by parse_updated
+    @return: list of Partition, sorted by start
+    """
+    partitions = list()
+    for year in sorted({month.year for month, _ in counts}):
+        _slice(date(year, 1, 1), 0, counts, target_rows, updated or dict(), partitions)
+    return partitions
+
+
+class PartitionedFetcher:
+    def __init__(self, cache_dir, endpoint=None, date_column=None, order=None, target_rows=500_000, limit=API_LIMIT,
+                 fetch=None, auth=None, executor='io', fields=None, validator=None, on_page=None, dataset='crashes',
+                 updated_column=None):
+        """
+        @param cache_dir: directory holding one parquet file per partition, their spools and partitions.json
+        @param endpoint: Optional: resource endpoint, defaults to the endpoint of the dataset
+        @param date_column: Optional: floating timestamp column the dataset is sliced on, defaults to the dataset's
+        @param order: Optional: unique column ordering the pages of a slice, defaults to the dataset's
+        @param target_rows: maximum rows per slice
+        @param limit: page size within a slice
+        @param fetch: Optional: callable url -> list of records, defaults to get_data.get_page
+        @param auth: Optional: requests auth of the default fetch, False for an anonymous pull
+        @param executor: name of a common.utilities.executors pool or an Executor
+        @param fields: Optional: fields spec of data_blend.operations.df_prepare, only the columns it keeps are pulled
+        @param validator: Optional: common.data_blend.validation.Validator applied to every partition, quarantined
+                          rows are written per partition key
+        @param on_page: Optional: callable (url, pandas.DataFrame) called for every page of the fetched partitions,
+                        see CheckpointedDownloader
+        @param dataset: api.datasets.Dataset or name of a registered one, e.g. 'persons'
+        @param updated_column: Optional: column holding the last update of a row, defaults to the dataset's; a
+                               partition with a row updated since it was cached is re-pulled, False to disable
+        """
+        self.dataset = get_dataset(dataset)
+        self.cache_dir = cache_dir
+        self.endpoint = endpoint or self.dataset.endpoint
+        self.date_column = date_column or self.dataset.date_column
+        self.order = order or self.dataset.order
+        self.updated_column = self.dataset.updated_column if updated_column is None else updated_column
+        self.target_rows = target_rows
+        self.limit = limit
+        self.fetch_records = fetch
+        self.auth = auth
+        self.executor = executor
+        self.select = select_clause(fields)
+        self.validator = validator
+        self.on_page = on_page
+        self.partitions = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        path = os.path.join(self.cache_dir, STATE)
+        if not os.path.exists(path):
+            return dict()
+        with open(path) as fp:
+            return json.load(fp)
+
+    def _save_state(self):
+        with atomic_write(os.path.join(self.cache_dir, STATE), 'w') as fp:
+            json.dump(self.state, fp, indent=1, sort_keys=True)
+
+    def _fetch(self, url):
+        if self.fetch_records:
+            return self.fetch_records(url)
+        from .config import CONFIG
+        from .get_data import get_page
+
+        auth = CONFIG.auth if self.auth is None else self.auth
+        return json.loads(get_page(url, auth=auth).content)
+
+    def plan(self):
+        """
+        Runs the count query and splits the dataset into partitions.
+        @return: list of Partition
+        """
+        with span('api.partitions.plan'):
+            records = self._fetch(count_url(self.endpoint, self.date_column, self.updated_column))
+        self.partitions = plan_partitions(parse_counts(records), self.target_rows, parse_updated(records))
+        logger.info(f'{sum(p.rows for p in self.partitions)} rows in {len(self.partitions)} partitions')
+        return self.partitions
+
+    def page_urls(self, partition):
+        # one extra page catches rows added since the count query
+        pages = partition.rows // self.limit + 1
+        return [soql_url(self.endpoint, select=self.select, where=partition.where(self.date_column), order=self.order,
+                         limit=self.limit, offset=page * self.limit) for page in range(pages)]
+
+    def urls(self):
+        """
+        @return: page urls of every partition, e.g. for async_api.get_async_data
+        """
+        partitions = self.partitions if self.partitions is not None else self.plan()
+        return [url for partition in partitions for url in self.page_urls(partition)]
+
+    def path(self, partition):
+        return os.path.join(self.cache_dir, f'{partition.key}.parquet')
+
+    def is_stale(self, partition, refresh_since=None):
+        """
+        A partition is (re)fetched when it is not cached, when its row count or the selected columns changed since it
+        was cached, when one of its rows was updated since (amended reports keep the count), or when it ends after
+        refresh_since.
+        """
+        cached = self.state.get(partition.key)
+        if cached is None or not os.path.exists(self.path(partition)) or cached['rows'] != partition.rows:
+            return True
+        if cached.get('select') != self.select:
+            return True
+        if partition.updated and cached.get('updated') and partition.updated > cached['updated']:
+            return True
+        return refresh_since is not None and partition.end > refresh_since
+
+    def fetch(self, refresh_since=None, refresh_all=False):
+        """
+        Fetches the stale partitions, every page of every stale partition is submitted to the pool at once.
+        @param refresh_since: Optional: date, partitions ending after it are re-pulled even if their count is unchanged
+        @param refresh_all: re-pull every partition
+        @return: list of the fetched Partition
+        """
+        partitions = self.plan()
+        stale = [p for p in partitions if refresh_all or self.is_stale(p, refresh_since)]
+        logger.info(f'{len(stale)}/{len(partitions)} partitions to fetch')
+
+        downloaders = dict()
+        for partition in stale:
+            spool_dir = os.path.join(self.cache_dir, 'spool', partition.key)
+            if partition.key in self.state:
+                # a refresh starts from an empty spool, the cached pages are outdated
+                shutil.rmtree(spool_dir, ignore_errors=True)
+            downloaders[partition.key] = CheckpointedDownloader(spool_dir, self.page_urls(partition),
+                                                                fetch=self._fetch, executor=self.executor,
+                                                                validator=self.validator, on_page=self.on_page)
+
+        futures = dict()
+        for downloader in downloaders.values():
+            futures.update(downloader.submit())
+        CheckpointedDownloader.wait(futures)
+
+        for partition in stale:
+            downloader = downloaders[partition.key]
+            rows = downloader.compact(self.path(partition))
+            shutil.rmtree(downloader.spool_dir, ignore_errors=True)
+            self.state[partition.key] = dict(start=partition.start.isoformat(), end=partition.end.isoformat(),
+                                             rows=partition.rows, fetched_rows=rows, select=self.select,
+                                             updated=partition.updated,
+                                             fetched_at=datetime.now(timezone.utc).isoformat())
+        self._drop_outdated(partitions)
+        self._save_state()
+        return stale
+
+    def _drop_outdated(self, partitions):
+        # a block whose rows crossed target_rows is sliced again, the files of its previous slices are superseded
+        keys = {partition.key for partition in partitions}
+        for key in [key for key in self.state if key not in keys]:
+            del self.state[key]
+            path = os.path.join(self.cache_dir, f'{key}.parquet')
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self, columns=None):
+        """
+        @param columns: Optional: columns to read
+        @return: pandas.DataFrame of every cached partition, oldest first, without duplicated order keys
+        """
+        import pandas as pd
+
+        paths = [os.path.join(self.cache_dir, f'{key}.parquet') for key in sorted(self.state)]
+        frames = [pd.read_parquet(path, columns=columns) for path in paths]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        # a row whose date was amended between two pulls can be cached in two partitions
+        return dedupe(df, self.order) if self.order in df.columns else df
+
+    def compact(self, output):
+        """
+        Writes every cached partition into the main store.
+        @param output: .parquet or .csv path
+        @return: number of rows written
+        """
+        df = self.load()
+        write_store(df, output)
+        return len(df)
+
+    def sync(self, output, rollups=None):
+        """
+        Writes every cached partition into the main store, with the row hashes next to it, and compares them with the
+        hashes of the previous sync.
+        @param output: .parquet, .csv or .feather path
+        @param rollups: Optional: common.query.rollups.RollupStore, updated with the inserted, updated and deleted rows
+        @return: common.data_blend.hashing.ChangeSet, e.g. changes.rows(df) are the rows to upsert
+        """
+        df = self.load()
+        hashes = row_hashes(df, self.order)
+        previous = read_hashes(hashes_path(output), self.order)
+        changes = diff(previous, hashes, self.order)
+        if rollups is not None:
+            self._update_rollups(rollups, output, df, changes, fingerprint(previous), fingerprint(hashes))
+        write_store(df, output)
+        write_hashes(hashes, hashes_path(output))
+        return changes
+
+    def _update_rollups(self, rollups, output, df, changes, since, version):
+        # the rollups are updated before the store, an interrupted sync leaves them at a version the next sync rebuilds
+        retracted = None
+        if len(changes.updated) or len(changes.deleted):
+            if os.path.exists(output):
+                columns = list(dict.fromkeys([self.order] + rollups.columns))
+                previous = read_store(output, columns=[col for col in columns if col in df.columns])
+                retracted = changes.rows(previous, 'updated', 'deleted')
+            else:
+                # the previous rows are gone, the rollups can not be retracted from
+                since = None
+        actions = rollups.update(df, inserted=changes.rows(df, 'inserted', 'updated'), retracted=retracted,
+                                 since=since, version=version)
+        logger.info(f'Rollups: {actions}')
+
+    def __repr__(self):
+        return (f"<{self.__class__.__name__} dataset={self.dataset.name}, cache_dir={self.cache_dir}, "
+                f"partitions={len(self.state)}>")
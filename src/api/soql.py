@@ -0,0 +1,98 @@
+"""
+Helpers to build SoQL query urls for the Socrata resource endpoints.
+
+    soql_url(endpoint, select='date_trunc_ym(crash_date) AS month, count(*) AS n', group='month', order='month')
+    soql_url(endpoint, select=select_clause({'collision_id': Field.KEEP, 'location': Field.DROP}), limit=50000)
+
+https://dev.socrata.com/docs/queries/
+"""
+from datetime import date, datetime
+from urllib.parse import parse_qs, quote, urlencode, urlsplit
+
+from common.data_blend import Field
+
+# characters of SoQL clauses that do not need to be percent-encoded, keeps the urls readable in logs and manifests
+_SAFE = "$(),*':"
+
+
+def quote_literal(value):
+    """
+    Returns value as a SoQL literal: strings and dates are single quoted, numbers are left as they are.
+    """
+    if isinstance(value, datetime):
+        return f"'{floating_timestamp(value)}'"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}T00:00:00.000'"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def floating_timestamp(value):
+    """
+    Formats a datetime like the Socrata floating timestamps, e.g. 2012-07-01T00:00:00.000
+    """
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}'
+
+
+def select_columns(fields):
+    """
+    Translates the fields spec of data_blend.operations.df_prepare into the columns to request: the keys of a dict
+    whose action is not Field.DROP (Field.KEEP, a new name or None), or the given columns.
+    @param fields: None, dict {original_column: action/rename} or (list, set, str, tuple)
+    @return: list of column names, None to request every column
+    """
+    if fields is None:
+        return None
+    elif isinstance(fields, dict):
+        columns = [col for col, action in fields.items() if action is not Field.DROP]
+    elif isinstance(fields, str):
+        columns = [fields]
+    elif isinstance(fields, (list, set, tuple)):
+        columns = sorted(fields) if isinstance(fields, set) else list(fields)
+    else:
+        raise ValueError(f'Unknown structure of fields, expected None, dict, list, set, str or tuple. '
+                         f'Got={type(fields)}')
+
+    if not columns:
+        raise ValueError('Expected at least one column to select.')
+    return columns
+
+
+def select_clause(fields):
+    """
+    @param fields: see select_columns
+    @return: $select clause, e.g. 'collision_id, crash_date', None to request every column
+    """
+    columns = select_columns(fields)
+    return None if columns is None else ', '.join(columns)
+
+
+def soql_url(endpoint, **clauses):
+    """
+    Builds a query url, every keyword is a SoQL clause without its $ prefix, None clauses are skipped.
+    @param endpoint: resource endpoint, e.g. https://data.cityofnewyork.us/resource/h9gi-nx95.json
+    @param clauses: select, where, group, having, order, limit, offset, q
+    @return: url
+    """
+    params = {f'${name}': value for name, value in clauses.items() if value is not None}
+    if not params:
+        return endpoint
+    return f'{endpoint}?{urlencode(params, quote_via=quote, safe=_SAFE)}'
+
+
+def add_clauses(url, **clauses):
+    """
+    Adds clauses to a query url, e.g. a $select to the page urls of async_api.create_urls. None clauses are skipped.
+    @param url: url built by soql_url or by hand
+    @param clauses: see soql_url, they must not already be in url
+    @return: url
+    """
+    params = {f'${name}': value for name, value in clauses.items() if value is not None}
+    if not params:
+        return url
+    present = set(params) & set(parse_qs(urlsplit(url).query))
+    if present:
+        raise ValueError(f"Clauses {', '.join(sorted(present))} are already in url={url}")
+    separator = '&' if urlsplit(url).query else '?'
+    return f'{url}{separator}{urlencode(params, quote_via=quote, safe=_SAFE)}'
@@ -0,0 +1,184 @@
+"""
+Transport layer of the Open Data client: compressed transfer, streamed bodies and bytes end to end.
+
+Requests ask for gzip/deflate explicitly and read the body as a stream: CSV pages are parsed by pandas while they are
+downloaded, JSON pages are read in chunks and handed to json.loads as bytes, so the body is never decoded to a Python
+str first (response.text / response.json() both do, and requests guesses the charset on the way). The CSV export of a
+resource (`/resource/<id>.csv`) is much cheaper to parse than its JSON:
+
+    df = fetch_frame(resource_url(NYC_OPEN_DATA_API_ENDPOINT, 'csv') + '?$limit=50000&$offset=0&$order=collision_id')
+
+Every fetch records a span 'api.transport.<format>' with the rows parsed and the bytes on the wire, so the formats
+and encodings can be compared with common.utilities.metrics.REGISTRY or benchmarks/bench_transport.py.
+"""
+import io
+import json
+from urllib.parse import urlparse
+
+from common.utilities.metrics import span
+from common.utilities.rate_limit import get_limiter
+from common.utilities.retrying import (
+    FETCH_CIRCUIT_BREAKER, FETCH_RETRY_BUDGET, RetryableHTTPError, parse_retry_after, raise_for_retry_status,
+    retry_backoff
+)
+
+ACCEPT_ENCODING = 'gzip, deflate'
+FORMATS = ('json', 'csv')
+CHUNK_SIZE = 1 << 16
+
+
+def resource_url(endpoint, file_format='json'):
+    """
+    Returns the endpoint of a resource in another export format, e.g. .../h9gi-nx95.json -> .../h9gi-nx95.csv
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Expected one of {', '.join(FORMATS)} as file_format, got={file_format}")
+    base, _, extension = endpoint.rpartition('.')
+    if extension not in FORMATS:
+        raise ValueError(f'Expected a .json or .csv resource endpoint, got={endpoint}')
+    return f'{base}.{file_format}'
+
+
+def url_format(url):
+    return 'csv' if urlparse(url).path.endswith('.csv') else 'json'
+
+
+def parse_body(body, file_format='json', dtype=None):
+    """
+    Parses a page body into a DataFrame.
+    @param body: bytes, or a binary file-like object that is parsed while it is read
+    @param file_format: 'json' or 'csv'
+    @param dtype: Optional: dtype passed to pandas.read_csv, e.g. str to keep the JSON string values
+    @return: pandas.DataFrame
+    """
+    import pandas as pd
+
+    if file_format == 'csv':
+        return pd.read_csv(io.BytesIO(body) if isinstance(body, (bytes, bytearray)) else body, dtype=dtype)
+    if not isinstance(body, (bytes, bytearray)):
+        body = read_chunks(body)
+    # json.loads detects the utf-8 encoding of bytes itself
+    return pd.DataFrame.from_records(json.loads(body))
+
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    buffer = bytearray()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        buffer += chunk
+    return bytes(buffer)
+
+
+class _Stream(io.RawIOBase):
+    """Open streamed response, its raw body is decompressed while it is read and counts the bytes on the wire."""
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+        self.raw = response.raw
+        self.raw.decode_content = True
+
+    @property
+    def wire_bytes(self):
+        return self.raw.tell()
+
+    @property
+    def content_encoding(self):
+        return self.response.headers.get('Content-Encoding', 'identity')
+
+    def read(self, size=-1):
+        import urllib3
+
+        try:
+            return self.raw.read(None if size is None or size < 0 else size)
+        except urllib3.exceptions.ReadTimeoutError as err:
+            raise TimeoutError(str(err)) from err
+        except urllib3.exceptions.HTTPError as err:
+            # connection dropped mid body: the whole page is retried
+            raise ConnectionError(str(err)) from err
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.response.close()
+        super().close()
+
+
+def open_stream(url, auth=None, session=None, limiter=None, timeout=None, accept_encoding=ACCEPT_ENCODING):
+    """
+    Sends the GET with Accept-Encoding: gzip, deflate and returns the response with its body not yet read.
+    @param url: page url
+    @param auth: Optional: requests auth
+    @param session: Optional: requests.Session, keeps connections alive across pages
+    @param limiter: Optional: TokenBucket, defaults to the process wide 'socrata' bucket
+    @param timeout: Optional: requests timeout, defaults to config.CONFIG.timeout
+    @param accept_encoding: Accept-Encoding header, 'identity' for an uncompressed body
+    @return: _Stream
+    """
+    import requests
+    from .config import CONFIG
+
+    timeout = CONFIG.timeout if timeout is None else timeout
+    limiter = limiter or get_limiter('socrata')
+    limiter.acquire()
+    try:
+        response = (session or requests).get(url, auth=auth, headers={'Accept-Encoding': accept_encoding},
+                                             stream=True, timeout=timeout)
+    except requests.ConnectionError as err:
+        raise ConnectionError(str(err)) from err
+    except requests.Timeout as err:
+        raise TimeoutError(str(err)) from err
+    limiter.update(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    try:
+        raise_for_retry_status(response.status_code, response.headers, url)
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return _Stream(response)
+
+
+@retry_backoff(exceptions=(RetryableHTTPError, ConnectionError, TimeoutError), budget=FETCH_RETRY_BUDGET,
+               breaker=FETCH_CIRCUIT_BREAKER)
+def fetch_bytes(url, auth=None, session=None, limiter=None, chunk_size=CHUNK_SIZE, timeout=None):
+    """
+    GET one page as decompressed bytes, retried like get_data.get_page.
+    @return: (body bytes, bytes on the wire)
+    """
+    stream = open_stream(url, auth=auth, session=session, limiter=limiter, timeout=timeout)
+    try:
+        with span(f'api.transport.{url_format(url)}.bytes') as s:
+            body = read_chunks(stream, chunk_size)
+            s.add(nbytes=stream.wire_bytes)
+        return body, stream.wire_bytes
+    finally:
+        stream.close()
+
+
+@retry_backoff(exceptions=(RetryableHTTPError, ConnectionError, TimeoutError), budget=FETCH_RETRY_BUDGET,
+               breaker=FETCH_CIRCUIT_BREAKER)
+def fetch_frame(url, auth=None, session=None, limiter=None, file_format=None, dtype=None, timeout=None):
+    """
+    GET one page and parse it while it streams in.
+    @param url: page url of a .json or .csv resource
+    @param auth: Optional: requests auth
+    @param session: Optional: requests.Session
+    @param limiter: Optional: TokenBucket
+    @param file_format: Optional: 'json' or 'csv', defaults to the extension of the url
+    @param dtype: Optional: dtype of the CSV columns
+    @param timeout: Optional: requests timeout, defaults to config.CONFIG.timeout
+    @return: pandas.DataFrame
+    """
+    file_format = file_format or url_format(url)
+    stream = open_stream(url, auth=auth, session=session, limiter=limiter, timeout=timeout)
+    try:
+        with span(f'api.transport.{file_format}') as s:
+            df = parse_body(stream, file_format, dtype=dtype)
+            s.add(rows=len(df), nbytes=stream.wire_bytes)
+        return df
+    finally:
+        stream.close()
@@ -0,0 +1,161 @@
+"""
+Row fingerprints, deduplication by key and change detection between two versions of the table.
+
+Every row gets a 64 bit hash of its values (pandas.util.hash_pandas_object, vectorized per column and combined in the
+sorted column order, so the hash does not depend on the order of the columns). Comparing the hashes of two snapshots
+by collision_id tells which rows were inserted, updated, deleted or left unchanged, so an incremental sync or a DB
+upsert only touches the changed rows. The hashes are small (key + uint64) and are stored next to the Parquet store:
+
+    hashes = row_hashes(df)
+    changes = diff(read_hashes(hashes_path('.data/crashes.parquet')), hashes)
+    upsert(changes.rows(df, 'inserted', 'updated'))
+    write_hashes(hashes, hashes_path('.data/crashes.parquet'))
+
+Hashes are stable across runs and processes for the same values and dtypes, e.g. between two stores written by the
+same pipeline; '1' and 1 hash differently.
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.utilities.filesystem import atomic_write
+from common.utilities.metrics import span
+
+HASH_COLUMN = 'row_hash'
+KEY_COLUMN = 'collision_id'
+# fixed so that hashes can be stored and compared between processes
+HASH_KEY = '0123456789abcdef'
+CHANGE_KINDS = ('inserted', 'updated', 'deleted', 'unchanged')
+
+logger = logging.getLogger(__name__)
+
+
+def row_hashes(df, key=KEY_COLUMN, columns=None):
+    """
+    Computes one fingerprint per row over the given columns.
+    @param df: pandas.DataFrame
+    @param key: key column, returned next to the hashes and not hashed itself
+    @param columns: Optional: columns to hash, defaults to every column but key
+    @return: pandas.DataFrame with the key and the HASH_COLUMN (uint64) columns
+    """
+    columns = sorted(col for col in df.columns if col != key) if columns is None else sorted(columns)
+    with span('common.data_blend.row_hashes', rows=len(df)):
+        hashes = np.zeros(len(df), dtype=np.uint64)
+        for col in columns:
+            values = pd.util.hash_pandas_object(df[col], index=False, hash_key=HASH_KEY).to_numpy()
+            # boost::hash_combine, order dependent so that swapped values between columns change the hash
+            hashes ^= values + np.uint64(0x9E3779B97F4A7C15) + (hashes << np.uint64(6)) + (hashes >> np.uint64(2))
+    return pd.DataFrame({key: df[key].to_numpy(), HASH_COLUMN: hashes})
+
+
+def dedupe(df, key=KEY_COLUMN, keep='last'):
+    """
+    Drops the rows with a duplicated key, e.g. from overlapping pages or a re-sync.
+    @param df: pandas.DataFrame
+    @param key: key column or list of columns
+    @param keep: 'last' keeps the most recently fetched row, 'first' the oldest
+    @return: pandas.DataFrame, df itself when there are no duplicates
+    """
+    duplicated = df.duplicated(subset=key, keep=keep).to_numpy()
+    if not duplicated.any():
+        return df
+    logger.info(f'Dropped {int(duplicated.sum())} rows with a duplicated {key}')
+    return df[~duplicated]
+
+
+class ChangeSet:
+    def __init__(self, key, inserted, updated, deleted, unchanged):
+        """
+        @param key: key column
+        @param inserted: keys only in the new table
+        @param updated: keys in both tables whose hash changed
+        @param deleted: keys only in the old table
+        @param unchanged: keys in both tables with the same hash
+        """
+        self.key = key
+        self.inserted = inserted
+        self.updated = updated
+        self.deleted = deleted
+        self.unchanged = unchanged
+
+    def counts(self):
+        return {kind: len(getattr(self, kind)) for kind in CHANGE_KINDS}
+
+    def rows(self, df, *kinds):
+        """
+        @param df: pandas.DataFrame holding the key column, usually the new table
+        @param kinds: change kinds to select, defaults to inserted and updated
+        @return: rows of df whose key is in the selected change sets
+        """
+        keys = np.concatenate([getattr(self, kind) for kind in kinds or ('inserted', 'updated')])
+        return df[df[self.key].isin(keys)]
+
+    def __repr__(self):
+        counts = ', '.join(f'{kind}={n}' for kind, n in self.counts().items())
+        return f"<{self.__class__.__name__} {counts}>"
+
+
+def _as_hashes(table, key):
+    if HASH_COLUMN not in table.columns:
+        table = row_hashes(table, key)
+    return dedupe(table[[key, HASH_COLUMN]], key)
+
+
+def diff(old, new, key=KEY_COLUMN):
+    """
+    Compares two versions of the table by key.
+    @param old: pandas.DataFrame, the table or its row_hashes
+    @param new: pandas.DataFrame, the table or its row_hashes
+    @param key: key column
+    @return: ChangeSet
+    """
+    old, new = _as_hashes(old, key), _as_hashes(new, key)
+    with span('common.data_blend.diff', rows=len(old) + len(new)):
+        old_keys, new_keys = pd.Index(old[key]), new[key].to_numpy()
+        # keys are unique after dedupe, positions of the new keys in old (-1 if missing) keep the uint64 hashes exact
+        positions = old_keys.get_indexer(new_keys)
+        present = positions >= 0
+        same = present.copy()
+        same[present] = new[HASH_COLUMN].to_numpy()[present] == old[HASH_COLUMN].to_numpy()[positions[present]]
+        changes = ChangeSet(
+            key,
+            inserted=new_keys[~present],
+            updated=new_keys[present & ~same],
+            deleted=old_keys[~old_keys.isin(new_keys)].to_numpy(),
+            unchanged=new_keys[same],
+        )
+    logger.info(f'{changes}')
+    return changes
+
+
+def fingerprint(hashes):
+    """
+    Order independent fingerprint of a whole table: its row count and the sum of its row hashes modulo 2^64.
+    @param hashes: pandas.DataFrame of row_hashes, without duplicated keys
+    @return: str, e.g. '1843212:5be1c0ffee0dd0e5'
+    """
+    total = int(hashes[HASH_COLUMN].to_numpy(dtype=np.uint64).sum(dtype=np.uint64)) if len(hashes) else 0
+    return f'{len(hashes)}:{total:016x}'
+
+
+def hashes_path(store):
+    """
+    @return: path of the hashes stored next to the store, e.g. .data/crashes.hashes.parquet
+    """
+    return f'{os.path.splitext(store)[0]}.hashes.parquet'
+
+
+def write_hashes(hashes, path):
+    with atomic_write(path, 'wb') as fp:
+        hashes.to_parquet(fp, index=False)
+
+
+def read_hashes(path, key=KEY_COLUMN):
+    """
+    @return: pandas.DataFrame of the stored hashes, empty if there is none yet
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame({key: pd.Series(dtype=object), HASH_COLUMN: pd.Series(dtype=np.uint64)})
+    return pd.read_parquet(path)
@@ -1,5 +1,5 @@
 import pandas as pd
-from rice.data_blend import Field
+from common.data_blend import Field
 
 
 def df_apply(df, funcs):
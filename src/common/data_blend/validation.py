@@ -0,0 +1,281 @@
+"""
+Data-quality rules for the MVCC table, evaluated as vectorized masks.
+
+The EDA found the problems by hand: 0.0 latitudes, zip codes stored as '10014.0', missing boroughs, negative or
+inconsistent person counts. Here they are declared once as rules, every rule computes the boolean mask of the rows
+that fail it in one vectorized pass, and a Validator splits a frame into valid and quarantined rows:
+
+    validator = Validator(quarantine_dir='.data/quarantine')
+    result = validator.validate(df)
+    result.valid         # rows passing every ERROR rule
+    validator.counts     # failing rows per rule, over every validated frame
+
+Rules with Severity.ERROR send the row to the quarantine Parquet file, Severity.WARN rules are only counted. Regex
+and enum rules are evaluated on the distinct values of the column (factorized once, as in normalize), so their cost
+does not grow with the number of rows.
+"""
+import logging
+import os
+import threading
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+from common.utilities.filesystem import atomic_write
+from common.utilities.metrics import span
+
+FAILED_RULES_COLUMN = 'failed_rules'
+
+logger = logging.getLogger(__name__)
+
+
+class Severity(Enum):
+    WARN = 1
+    ERROR = 2
+
+
+def _column(df, col):
+    # Socrata leaves out fields that are null in every row of a page
+    return df[col] if col in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def _numeric(df, col):
+    values = _column(df, col)
+    return values if pd.api.types.is_numeric_dtype(values) else pd.to_numeric(values, errors='coerce')
+
+
+def _missing(values):
+    missing = values.isna().to_numpy()
+    if values.dtype == object:
+        # numpy compares object arrays several times faster than the pandas string comparison
+        missing |= values.to_numpy() == ''
+    return missing
+
+
+def _on_distinct(values, func):
+    """
+    Evaluates func on the distinct non null values and maps the result back to the rows.
+    @return: numpy bool array, False for null values
+    """
+    codes, uniques = pd.factorize(values)
+    if not len(uniques):
+        return np.zeros(len(values), dtype=bool)
+    result = np.append(np.asarray(func(pd.Series(uniques)), dtype=bool), False)
+    # code -1 (null) points at the appended False
+    return result[codes]
+
+
+class Rule:
+    def __init__(self, name, columns, severity=Severity.ERROR):
+        """
+        @param name: rule name, used in the counts and in the failed_rules column of the quarantine
+        @param columns: columns read by the rule
+        @param severity: Severity.ERROR quarantines failing rows, Severity.WARN only counts them
+        """
+        self.name = name
+        self.columns = list(columns)
+        self.severity = severity
+
+    def failures(self, df):
+        """
+        @return: numpy bool array, True for the rows failing the rule
+        """
+        raise NotImplementedError("Make sure this method is implemented.")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} name={self.name}, severity={self.severity.name}>"
+
+
+class NotNull(Rule):
+    def __init__(self, column, severity=Severity.ERROR, name=None):
+        super().__init__(name or f'{column}_not_null', [column], severity)
+
+    def failures(self, df):
+        return _missing(_column(df, self.columns[0]))
+
+
+class InRange(Rule):
+    def __init__(self, column, low=None, high=None, severity=Severity.ERROR, name=None):
+        """
+        Null values pass, non numeric values fail.
+        @param low: Optional: inclusive lower bound
+        @param high: Optional: inclusive upper bound
+        """
+        super().__init__(name or f'{column}_in_range', [column], severity)
+        self.low = low
+        self.high = high
+
+    def failures(self, df):
+        values = _column(df, self.columns[0])
+        numbers = _numeric(df, self.columns[0]).to_numpy(dtype=float, na_value=np.nan)
+        failed = np.isnan(numbers) & ~_missing(values)
+        if self.low is not None:
+            failed |= numbers < self.low
+        if self.high is not None:
+            failed |= numbers > self.high
+        return failed
+
+
+class Matches(Rule):
+    def __init__(self, column, pattern, severity=Severity.ERROR, name=None):
+        """
+        Non null values must match the regular expression entirely.
+        """
+        super().__init__(name or f'{column}_format', [column], severity)
+        self.pattern = pattern
+
+    def failures(self, df):
+        return _on_distinct(_column(df, self.columns[0]), lambda uniques: ~uniques.astype(str).str.fullmatch(
+            self.pattern).fillna(False).astype(bool))
+
+
+class InSet(Rule):
+    def __init__(self, column, values, severity=Severity.ERROR, name=None):
+        """
+        Non null values must be one of values.
+        """
+        super().__init__(name or f'{column}_in_set', [column], severity)
+        self.values = set(values)
+
+    def failures(self, df):
+        return _on_distinct(_column(df, self.columns[0]), lambda uniques: ~uniques.isin(self.values))
+
+
+class Check(Rule):
+    def __init__(self, name, columns, func, severity=Severity.ERROR):
+        """
+        Cross-field rule.
+        @param func: callable df -> boolean Series or array, True for valid rows; NA results count as valid
+        """
+        super().__init__(name, columns, severity)
+        self.func = func
+
+    def failures(self, df):
+        valid = pd.Series(self.func(df), index=df.index)
+        return ~valid.fillna(True).astype(bool).to_numpy()
+
+
+def _total_at_least_parts(total, parts):
+    def func(df):
+        values = _numeric(df, total)
+        return values.isna() | (values >= sum(_numeric(df, col).fillna(0) for col in parts))
+    return func
+
+
+BOROUGHS = {'BRONX', 'BROOKLYN', 'MANHATTAN', 'QUEENS', 'STATEN ISLAND'}
+PERSON_COUNT_COLUMNS = [f'number_of_{who}_{what}' for who in ('persons', 'pedestrians', 'cyclist', 'motorist')
+                        for what in ('injured', 'killed')]
+
+DEFAULT_RULES = [
+    NotNull('collision_id'),
+    NotNull('crash_date'),
+    *[InRange(col, low=0) for col in PERSON_COUNT_COLUMNS],
+    Check('persons_killed_total', PERSON_COUNT_COLUMNS[1::2],
+          _total_at_least_parts('number_of_persons_killed', PERSON_COUNT_COLUMNS[3::2])),
+    Check('persons_injured_total', PERSON_COUNT_COLUMNS[0::2],
+          _total_at_least_parts('number_of_persons_injured', PERSON_COUNT_COLUMNS[2::2]), severity=Severity.WARN),
+    # NYC bounding box, catches the 0.0 coordinates
+    InRange('latitude', 40.4, 41.0, severity=Severity.WARN),
+    InRange('longitude', -74.3, -73.6, severity=Severity.WARN),
+    # catches '10014.0' and other float formatted zip codes
+    Matches('zip_code', r'\d{5}', severity=Severity.WARN),
+    Matches('crash_time', r'\d{1,2}:\d{2}', severity=Severity.WARN),
+    NotNull('borough', severity=Severity.WARN),
+    InSet('borough', BOROUGHS, severity=Severity.WARN),
+]
+
+
+class ValidationResult:
+    def __init__(self, valid, quarantined, counts):
+        """
+        @param valid: pandas.DataFrame of the rows passing every ERROR rule
+        @param quarantined: pandas.DataFrame of the other rows, with the failed_rules column
+        @param counts: dict rule name -> number of failing rows
+        """
+        self.valid = valid
+        self.quarantined = quarantined
+        self.counts = counts
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} valid={len(self.valid)}, quarantined={len(self.quarantined)}>"
+
+
+def evaluate(df, rules=None):
+    """
+    Evaluates every rule on df.
+    @param df: pandas.DataFrame
+    @param rules: Optional: list of Rule, defaults to DEFAULT_RULES
+    @return: list of rules, numpy bool matrix of shape (rules, rows), True where a row fails a rule
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    masks = np.zeros((len(rules), len(df)), dtype=bool)
+    for i, rule in enumerate(rules):
+        masks[i] = rule.failures(df)
+    return rules, masks
+
+
+def validate(df, rules=None):
+    """
+    Splits df into valid and quarantined rows.
+    @param df: pandas.DataFrame
+    @param rules: Optional: list of Rule, defaults to DEFAULT_RULES
+    @return: ValidationResult
+    """
+    rules, masks = evaluate(df, rules)
+    errors = np.array([rule.severity is Severity.ERROR for rule in rules], dtype=bool)
+    quarantine = masks[errors].any(axis=0) if errors.any() else np.zeros(len(df), dtype=bool)
+    counts = {rule.name: int(n) for rule, n in zip(rules, masks.sum(axis=1))}
+
+    quarantined = df[quarantine].copy()
+    names = np.array([rule.name for rule in rules], dtype=object)
+    quarantined[FAILED_RULES_COLUMN] = [','.join(names[failed]) for failed in masks[:, quarantine].T]
+    # a clean frame is passed through without copying it
+    valid = df[~quarantine] if len(quarantined) else df
+    return ValidationResult(valid, quarantined, counts)
+
+
+class Validator:
+    def __init__(self, rules=None, quarantine_dir=None):
+        """
+        @param rules: Optional: list of Rule, defaults to DEFAULT_RULES
+        @param quarantine_dir: Optional: directory of the quarantine Parquet files, one per validated part
+        """
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.quarantine_dir = quarantine_dir
+        self.rows = 0
+        self.quarantined = 0
+        self.counts = {rule.name: 0 for rule in self.rules}
+        self._lock = threading.Lock()
+
+    def validate(self, df, part='quarantine'):
+        """
+        Validates df, writes its quarantined rows to <quarantine_dir>/<part>.parquet and adds to the counts. Safe to
+        call from several threads with different parts.
+        @param df: pandas.DataFrame
+        @param part: name of the quarantine file, e.g. a partition key
+        @return: ValidationResult
+        """
+        with span('common.data_blend.validate', rows=len(df)):
+            result = validate(df, self.rules)
+
+        path = os.path.join(self.quarantine_dir, f'{part}.parquet') if self.quarantine_dir else None
+        if path and len(result.quarantined):
+            with atomic_write(path, 'wb') as fp:
+                result.quarantined.to_parquet(fp, index=False)
+        elif path and os.path.exists(path):
+            # a re-validated part without failures replaces its previous quarantine
+            os.remove(path)
+
+        with self._lock:
+            self.rows += len(df)
+            self.quarantined += len(result.quarantined)
+            for name, n in result.counts.items():
+                self.counts[name] = self.counts.get(name, 0) + n
+        failing = {name: n for name, n in result.counts.items() if n}
+        logger.info(f'{len(result.quarantined)}/{len(df)} rows quarantined, failing rows per rule: {failing}')
+        return result
+
+    def __repr__(self):
+        return (f"<{self.__class__.__name__} rules={len(self.rules)}, rows={self.rows}, "
+                f"quarantined={self.quarantined}>")
@@ -0,0 +1,92 @@
+"""
+Wide to long reshape of the five vehicle slots on an MVCC row.
+
+Every crash carries up to five (contributing_factor_vehicle_n, vehicle_type_code_n) pairs. Reshaping is done on the
+integer codes of the shared categoricals built by common.data_blend.normalize, so the long table is produced with a
+handful of NumPy array operations and no object column is ever copied or hashed again.
+"""
+import numpy as np
+import pandas as pd
+from common.data_blend.normalize import (
+    FACTOR_COLUMNS, VEHICLE_TYPE_COLUMNS, FACTOR_ALIASES, VEHICLE_TYPE_ALIASES, encode_shared
+)
+
+
+def _shared_codes(df, columns, aliases):
+    """
+    Returns a (rows, slots) int32 matrix of shared category codes and the shared dtype. Columns that are already
+    encoded with one common dtype are used as is, otherwise they are encoded first. Missing slots are filled with -1.
+    """
+    present = [col for col in columns if col in df.columns]
+    dtypes = {df[col].dtype for col in present}
+    if len(dtypes) == 1 and isinstance(next(iter(dtypes)), pd.CategoricalDtype):
+        dtype = dtypes.pop()
+    else:
+        df, dtype = encode_shared(df[present], present, aliases=aliases)
+
+    codes = np.full((len(df), len(columns)), -1, dtype=np.int32)
+    for i, col in enumerate(columns):
+        if col in df.columns:
+            codes[:, i] = df[col].cat.codes.to_numpy()
+    return codes, dtype
+
+
+def explode_vehicles(df, id_col='collision_id', factor_columns=None, vehicle_type_columns=None, dropna=True):
+    """
+    Reshapes the vehicle slots of the crash table into one row per vehicle.
+    @param df: pandas.DataFrame with the MVCC crash columns
+    @param id_col: name of the crash key column
+    @param factor_columns: Optional: ordered contributing factor columns, defaults to slots 1-5
+    @param vehicle_type_columns: Optional: ordered vehicle type columns, defaults to slots 1-5
+    @param dropna: drop slots where both the factor and the vehicle type are missing
+    @return: pandas.DataFrame with columns [id_col, vehicle_index, factor, vehicle_type]
+    """
+    factor_columns = FACTOR_COLUMNS if factor_columns is None else factor_columns
+    vehicle_type_columns = VEHICLE_TYPE_COLUMNS if vehicle_type_columns is None else vehicle_type_columns
+
+    if len(factor_columns) != len(vehicle_type_columns):
+        raise ValueError(f'Expected the same number of factor and vehicle type columns, '
+                         f'got={len(factor_columns)} and {len(vehicle_type_columns)}')
+
+    if id_col not in df.columns:
+        raise ValueError(f'Column={id_col} not found in DataFrame')
+
+    factor_codes, factor_dtype = _shared_codes(df, factor_columns, FACTOR_ALIASES)
+    type_codes, type_dtype = _shared_codes(df, vehicle_type_columns, VEHICLE_TYPE_ALIASES)
+
+    rows, slots = factor_codes.shape
+    # ravel is row-major, so the long table keeps crash order and slot order within a crash
+    factors = factor_codes.ravel()
+    vehicle_types = type_codes.ravel()
+    ids = np.repeat(df[id_col].to_numpy(), slots)
+    vehicle_index = np.tile(np.arange(1, slots + 1, dtype=np.int8), rows)
+
+    if dropna:
+        keep = (factors >= 0) | (vehicle_types >= 0)
+        factors, vehicle_types, ids, vehicle_index = factors[keep], vehicle_types[keep], ids[keep], vehicle_index[keep]
+
+    return pd.DataFrame({
+        id_col: ids,
+        'vehicle_index': vehicle_index,
+        'factor': pd.Categorical.from_codes(factors, dtype=factor_dtype),
+        'vehicle_type': pd.Categorical.from_codes(vehicle_types, dtype=type_dtype),
+    })
+
+
+def category_counts(vehicles, column='factor', top=None):
+    """
+    Counts the values of a categorical column with a single integer bincount over its codes.
+    @param vehicles: pandas.DataFrame, typically the output of explode_vehicles
+    @param column: categorical column to count
+    @param top: Optional: number of most frequent values to return
+    @return: pandas.Series of counts indexed by category, sorted descending
+    """
+    if not isinstance(vehicles[column].dtype, pd.CategoricalDtype):
+        raise ValueError(f'Expected a categorical column for category_counts, got={vehicles[column].dtype}')
+
+    categories = vehicles[column].cat.categories
+    codes = vehicles[column].cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+
+    out = pd.Series(counts, index=categories, name='collisions').sort_values(ascending=False, kind='stable')
+    return out if top is None else out.head(top)
@@ -1,5 +1,4 @@
 # from credentials import DATASOURCES
-import pyodbc
 import re
 
 # SQL_SERVER_DRIVERS = [r"^SQL Server$", r"^ODBC Driver [0-9]+ for SQL Server$"]
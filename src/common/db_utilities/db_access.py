@@ -1,8 +1,6 @@
 import sys
-import pandas as pd
-import datetime
-import time
 import logging
+from common.utilities.metrics import span
 
 
 def get_connection(
@@ -78,31 +76,33 @@ def query_df(
     Returns:
         pandas.DataFrame (read from server)
     """
-    # TODO: remove try clause - to a context manager (with clause)
-    start = datetime.datetime.now()
-    connection = get_connection(
-        connection_string, database_type=database_type, library=library
-    )
-    try:
-        data = pd.read_sql(sql_string, connection)
+    import pandas as pd
 
-    except Exception as err:
-        # logger(f'ERROR: {err}')
-        logger(
-            f"[{__name__}] Error reading SQL query: {err} - Time Elapsed: "
-            f"{(datetime.datetime.now() - start).total_seconds()} seconds"
+    # TODO: remove try clause - to a context manager (with clause)
+    with span("db.query_df") as s:
+        connection = get_connection(
+            connection_string, database_type=database_type, library=library
         )
-        if database_type in ["oracle", "sqlserver"] and library in [
-            "cx_Oracle",
-            "pyodbc",
-        ]:
-            logger("Using fallback library pypyodbc")
-            return query_df(
-                sql_string, connection_string, database_type, library="pypyodbc"
+        try:
+            data = pd.read_sql(sql_string, connection)
+            s.add(rows=len(data), nbytes=int(data.memory_usage(index=False).sum()))
+
+        except Exception as err:
+            # logger(f'ERROR: {err}')
+            logger(
+                f"[{__name__}] Error reading SQL query: {err} - Time Elapsed: "
+                f"{s.elapsed_s} seconds"
             )
-        return pd.DataFrame()
-    finally:
-        connection.close()
-    end = datetime.datetime.now()
-    logger(f"Retrieved {len(data)} rows in {(end-start).total_seconds()} seconds.")
+            if database_type in ["oracle", "sqlserver"] and library in [
+                "cx_Oracle",
+                "pyodbc",
+            ]:
+                logger("Using fallback library pypyodbc")
+                return query_df(
+                    sql_string, connection_string, database_type, library="pypyodbc"
+                )
+            return pd.DataFrame()
+        finally:
+            connection.close()
+    logger(f"Retrieved {len(data)} rows in {s.elapsed_s} seconds.")
     return data
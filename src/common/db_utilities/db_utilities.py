@@ -1,17 +1,16 @@
-import time
 import logging
-import datetime
-import numpy as np
-import pandas as pd
 import sys
 from types import MappingProxyType
+from common.utilities.logging_settings import stage_fields
+from common.utilities.metrics import span
 
-# database imports
-import pyodbc
-import pypyodbc
+# pandas, numpy and the ODBC drivers are imported by the functions using them, like db_access.query_df does, so
+# that importing this module is cheap
 
 MAX_VARCHAR = 8000
 
+logger = logging.getLogger(__name__)
+
 
 def create_postgresql_conn_str(db_name, user_name, password, host, port):
     return (
@@ -55,6 +54,9 @@ def get_table_details(schema, table, connect_str):
             c.Table_Schema = '{schema}' AND c.TABLE_NAME = '{table}'
         ORDER BY c.Table_Schema, c.TABLE_NAME
     """
+    import pandas as pd
+    import pypyodbc
+
     with pypyodbc.connect(connect_str) as conn:
         output_df = pd.read_sql(query, conn)
         if fields:
@@ -71,6 +73,9 @@ def map_pandas_to_sql_data_types(df):
     @param df: pandas dataframe to infer the corresponding sql data types from
     @return: dictionary containing pandas.DataFrame fields sql type and size
     """
+    import numpy as np
+    import pandas as pd
+
     data_types = {
         np.bool_: lambda field: "BIT",
         np.int8: lambda field: "INT",
@@ -129,6 +134,20 @@ def build_prim_keys_statement(prim_keys_list):
     return ", ".join(l1), ", ".join(l2)
 
 
+def primary_key_types(df, columns):
+    """
+    Primary keys as taken by build_create_table_query and bulk_insert, typed like the create table query types them.
+    @param df: pandas.DataFrame holding the key columns
+    @param columns: names of the key columns, e.g. ['collision_id']
+    @return: list of tuples (col_name, col_type), e.g. [('collision_id', 'BIGINT')]
+    """
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"Primary keys={missing} are not columns of the frame")
+    # a copy, map_pandas_to_sql_data_types truncates nanosecond timestamps in place
+    return [(name, data_type) for name, data_type, _ in map_pandas_to_sql_data_types(df[list(columns)].copy())]
+
+
 def build_sql_clause(fields, separator, schema, table):
     """
     Get a list of fields and types separated by a separator ``separator``.
@@ -154,9 +173,9 @@ def prepare_bulk_insert(schema, table, columns):
     @param columns: columns of the pandas.DataFrame to insert
     @return: query as string
     """
-    cols_pos = ". ".join(["?"] * len(columns))
+    cols_pos = ", ".join(["?"] * len(columns))
     cols_names = ", ".join(["[%s]" % col for col in columns])
-    return f"INSERT INTO [{schema}].[{table}] " f"({cols_names}] VALUES ({cols_pos})"
+    return f"INSERT INTO [{schema}].[{table}] " f"({cols_names}) VALUES ({cols_pos})"
 
 
 def execute_select_statement(conn_str, query):
@@ -166,6 +185,8 @@ def execute_select_statement(conn_str, query):
     @param query: the query statement to be executed
     @return: list of rows
     """
+    import pypyodbc
+
     try:
         with pypyodbc.connect(conn_str) as conn:
             cursor = conn.cursor()
@@ -327,6 +348,57 @@ def split_list(lst, chunk):
         yield send_lst
 
 
+def arrow_batches(df, chunk):
+    """
+    Converts the frame to Arrow once and slices it into record batches, the slices are zero-copy views.
+    @param df: pandas.DataFrame or pyarrow.Table
+    @param chunk: maximum number of rows per batch
+    @return: list of pyarrow.RecordBatch
+    """
+    import pyarrow as pa
+    from common.query.snapshot import to_arrow
+
+    table = df if isinstance(df, pa.Table) else to_arrow(df)
+    return table.to_batches(max_chunksize=chunk)
+
+
+def _column_values(column):
+    """
+    Converts an Arrow column to a list of native Python values, None where the validity bitmap marks a null.
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    kind = column.type
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        # strings become an object ndarray holding None for the nulls
+        return column.to_numpy(zero_copy_only=False).tolist()
+    if not (pa.types.is_integer(kind) or pa.types.is_floating(kind) or pa.types.is_boolean(kind)):
+        # dates, timestamps and decimals map to datetime / Decimal values
+        return column.to_pylist()
+    if not column.null_count:
+        return column.to_numpy(zero_copy_only=False).tolist()
+    # filled so that integers stay integers instead of NaN floats, only the null cells are touched after
+    values = column.fill_null(False if pa.types.is_boolean(kind) else 0).to_numpy(zero_copy_only=False).tolist()
+    for i in np.flatnonzero(column.is_null().to_numpy(zero_copy_only=False)).tolist():
+        values[i] = None
+    return values
+
+
+def batch_parameters(batch):
+    """
+    Row parameters of executemany for one record batch. Every column is converted at once from its Arrow buffers to
+    native Python values, nulls come from the validity bitmap as None, so no object ndarray of the whole frame and no
+    per cell null check is needed. This is not zero-copy: pyodbc only binds sequences of rows, so every cell still
+    becomes a Python value and every row a tuple, fast_executemany then packs them into its parameter arrays.
+    @param batch: pyarrow.RecordBatch
+    @return: list of tuples
+    """
+    return list(zip(*(_column_values(column) for column in batch.columns)))
+
+
 def bulk_insert(
     df,
     conn_str,
@@ -348,13 +420,15 @@ def bulk_insert(
     :param schema: database.schema
     :param table: database.schema.table (only table)
     :param pre_insert_query: Optional: query to be executed before the insert
-    :param chunks: Optional: Default 10000 - number of rows to be inserted before the insert
+    :param chunks: Optional: Default 10000 - number of rows per executemany call
     :param primary_keys: Optional: Default None - primary keys of the table
     :param identity: Optional: Default None - whether ID column is to be inc
     :param identity_name: Optional: Default "ID" - name of identity column
     :param execute_many: Optional: Default - True boolean to execute many into the dataframe
     :return: None
     """
+    import pyodbc
+
     prefix = f"bulk insert [{schema}].[{table}]"
     try:
         conn = pyodbc.connect(conn_str, autocommit=False)
@@ -372,43 +446,50 @@ def bulk_insert(
                 identity=identity,
                 identity_name=identity_name,
             )
-            logging.info(table_create_query)
+            logger.debug(f"{prefix}: create table query: {table_create_query}")
         else:
             # add any new columns or alter the size of existing ones if required
             new_columns_query = get_missing_columns_query(conn_str, df, schema, table)
 
-        # prepare data chunks to insert
-        all_sql_data = list(map(tuple, df.values))
-
-        start = time.time()
-        insert_query = prepare_bulk_insert(schema, table, df.columns)
-
-        schema_create_query = build_create_schema_query(schema)
-
-        for query in [
-            schema_create_query,
-            table_create_query,
-            new_columns_query,
-            pre_insert_query,
-        ]:
-            if query:
-                logging.info(f"Execute query: {query}")
-                print(query)
-                cursor.execute(query)
-
-        if execute_many:
-            cursor.fast_executemany = execute_many
-        for i, sql_data in enumerate(split_list(all_sql_data, chunks)):
-            if not sql_data:
-                continue
-            print("Insert nbr: %d" % (i + 1))
-            sql_data = [[None if pd.isnull(y) else y for y in x] for x in sql_data]
-            cursor.executemany(insert_query, sql_data)
-        conn.commit()
+        # converted once to Arrow, df.values would upcast a mixed frame to one object ndarray
+        batches = arrow_batches(df, chunks)
+
+        with span(
+            "db.bulk_insert", rows=len(df), nbytes=int(df.memory_usage(index=False).sum())
+        ) as insert_span:
+            insert_query = prepare_bulk_insert(schema, table, df.columns)
+
+            schema_create_query = build_create_schema_query(schema)
+
+            for query in [
+                schema_create_query,
+                table_create_query,
+                new_columns_query,
+                pre_insert_query,
+            ]:
+                if query:
+                    logger.debug(f"{prefix}: execute query: {query}")
+                    cursor.execute(query)
+
+            if execute_many:
+                cursor.fast_executemany = execute_many
+            for i, batch in enumerate(batches):
+                with span("db.bulk_insert.chunk", rows=batch.num_rows) as chunk_span:
+                    cursor.executemany(insert_query, batch_parameters(batch))
+                logger.info(
+                    f"{prefix}: chunk {i + 1}/{len(batches)}",
+                    extra=stage_fields("db.bulk_insert.chunk", rows=batch.num_rows,
+                                       duration_s=chunk_span.elapsed_s, rate_limited=True),
+                )
+            conn.commit()
 
-        logging.info(f"{prefix}: inserted {len(df)} in {time.time() - start}")
+        logger.info(
+            f"{prefix}: inserted {len(df)} rows",
+            extra=stage_fields("db.bulk_insert", rows=len(df), nbytes=insert_span.nbytes,
+                               duration_s=insert_span.elapsed_s),
+        )
     except Exception as e:
-        logging.exception(f"Unexpected exemption in {prefix}")
+        logger.exception(f"Unexpected exemption in {prefix}")
         conn.rollback()
         raise e
 
@@ -417,5 +498,4 @@ def bulk_insert(
             cursor.close()
             conn.close()
         except Exception as e:
-            print(e)
-            pass
+            logger.warning(f"{prefix}: closing the connection failed: {e}")
@@ -0,0 +1,5 @@
+from .engines import ENGINES, DuckDBEngine, DatatableEngine, PandasEngine, get_engine
+from .joins import join_stores
+from .questions import QUESTIONS, run_question
+from .rollups import ROLLUPS, Rollup, RollupStore, StaleRollup
+from .snapshot import open_snapshot, read_snapshot, snapshot_from_store, snapshot_info, write_snapshot
@@ -0,0 +1,270 @@
+"""
+Query engines used to answer the EDA questions directly against the local Parquet/CSV store or Arrow snapshot.
+
+All engines expose the same `count_by` method and return a small pandas.DataFrame with the group-by columns, a
+`collisions` count and optional column sums, sorted by count descending. DuckDB and datatable scan and aggregate the
+file on all cores and only hand the aggregated result back to pandas; the pandas engine is kept as a fallback and reads
+only the needed columns.
+"""
+import contextlib
+import os
+import uuid
+import pandas as pd
+from .snapshot import open_snapshot, read_snapshot
+
+COUNT_COLUMN = 'collisions'
+
+# columns the notebook derives from crash_date / crash_time before grouping, expressed per engine
+DERIVED_COLUMNS = {
+    'year': {
+        'source': 'crash_date',
+        'sql': 'year(CAST(crash_date AS TIMESTAMP))',
+        'pandas': lambda df: pd.to_datetime(df['crash_date']).dt.year,
+    },
+    'month': {
+        'source': 'crash_date',
+        'sql': 'month(CAST(crash_date AS TIMESTAMP))',
+        'pandas': lambda df: pd.to_datetime(df['crash_date']).dt.month,
+    },
+    'day_of_week': {
+        'source': 'crash_date',
+        # pandas weekday is Monday=0, isodow is Monday=1
+        'sql': 'isodow(CAST(crash_date AS TIMESTAMP)) - 1',
+        'pandas': lambda df: pd.to_datetime(df['crash_date']).dt.weekday,
+    },
+    'hour': {
+        'source': 'crash_time',
+        # substr / strpos rather than split_part, which duckdb 0.3 does not have
+        'sql': "CAST(substr(CAST(crash_time AS VARCHAR), 1, "
+               "CAST(strpos(CAST(crash_time AS VARCHAR), ':') - 1 AS INTEGER)) AS INTEGER)",
+        'pandas': lambda df: df['crash_time'].astype(str).str.split(':', n=1).str[0].astype(int),
+    },
+}
+
+_OPERATORS = {'==', '!=', '>', '>=', '<', '<='}
+
+
+def _file_format(source):
+    extension = os.path.splitext(source)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    elif extension in ('.csv', '.gz'):
+        return 'csv'
+    elif extension in ('.feather', '.arrow'):
+        return 'arrow'
+    raise ValueError(f'Unknown file format for source={source}, expected .parquet, .csv or .feather')
+
+
+def _sql_literal(value):
+    escaped = str(value).replace("'", "''")
+    return f"'{escaped}'"
+
+
+@contextlib.contextmanager
+def arrow_view(connection, table):
+    """
+    Registers a pyarrow.Table as a DuckDB view, under a name unique to the caller, for the duration of the context.
+    Older duckdb releases, e.g. 0.3.1, only register pandas DataFrames with register, Arrow tables need register_arrow.
+    @param connection: duckdb connection
+    @param table: pyarrow.Table, e.g. open_snapshot(path)
+    @return: view name
+    """
+    view = f'snapshot_{uuid.uuid4().hex}'
+    getattr(connection, 'register_arrow', connection.register)(view, table)
+    try:
+        yield view
+    finally:
+        connection.unregister(view)
+
+
+def _conditions(where):
+    """
+    Normalizes a where dict into (column, operator, value) triples. Values can be a scalar (equality), a list, set or
+    tuple of values (membership) or an (operator, value) tuple, e.g. {'number_of_cyclist_injured': ('>', 0)}.
+    """
+    if where is None:
+        return list()
+
+    if not isinstance(where, dict):
+        raise ValueError(f'Expected {dict.__name__} as argument of where, got={type(where)}')
+
+    out = list()
+    for col, cond in where.items():
+        if isinstance(cond, tuple) and len(cond) == 2 and cond[0] in _OPERATORS:
+            out.append((col, cond[0], cond[1]))
+        elif isinstance(cond, (list, set, tuple)):
+            out.append((col, 'in', list(cond)))
+        else:
+            out.append((col, '==', cond))
+    return out
+
+
+class QueryEngine:
+    name = None
+
+    def __init__(self, threads=None):
+        self.threads = threads
+
+    def count_by(self, source, by, where=None, top=None, sums=None):
+        """
+        Counts rows of source grouped by the given columns.
+        @param source: path to a .parquet, .csv or .feather/.arrow snapshot file
+        @param by: column name or list of column names, can include the DERIVED_COLUMNS names
+        @param where: Optional: dict of filters, see _conditions
+        @param top: Optional: keep only the n largest groups
+        @param sums: Optional: numeric columns summed per group, returned under their own name
+        @return: pandas.DataFrame with the group-by columns, COUNT_COLUMN and the sums
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        if not by:
+            raise ValueError('Expected at least one column to group by.')
+
+        out = self._count_by(source, _file_format(source), by, _conditions(where), top, list(sums or []))
+        return out.reset_index(drop=True)
+
+    def _count_by(self, source, file_format, by, conditions, top, sums):
+        raise NotImplementedError("Make sure this method is implemented.")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} threads={self.threads}>"
+
+
+class PandasEngine(QueryEngine):
+    name = 'pandas'
+
+    def _count_by(self, source, file_format, by, conditions, top, sums):
+        needed = set(sums)
+        for col in by:
+            needed.add(DERIVED_COLUMNS[col]['source'] if col in DERIVED_COLUMNS else col)
+        needed.update(col for col, _, _ in conditions)
+
+        if file_format == 'parquet':
+            df = pd.read_parquet(source, columns=sorted(needed))
+        elif file_format == 'arrow':
+            df = read_snapshot(source, columns=sorted(needed))
+        else:
+            df = pd.read_csv(source, usecols=sorted(needed), dtype={'zip_code': str})
+
+        for col, op, value in conditions:
+            if op == 'in':
+                df = df[df[col].isin(value)]
+            else:
+                df = df.query(f'`{col}` {op} @value')
+
+        df = df.assign(**{col: DERIVED_COLUMNS[col]['pandas'] for col in by if col in DERIVED_COLUMNS})
+
+        groups = df.groupby(by, observed=True)
+        out = groups.size().rename(COUNT_COLUMN).reset_index()
+        if sums:
+            out = out.merge(groups[sums].sum().reset_index(), on=by)
+        out = out.sort_values(by=COUNT_COLUMN, ascending=False, kind='stable')
+        return out if top is None else out.head(top)
+
+
+class DuckDBEngine(QueryEngine):
+    name = 'duckdb'
+
+    def __init__(self, threads=None, connection=None):
+        super().__init__(threads)
+        import duckdb
+
+        self._connection = connection or duckdb.connect(database=':memory:')
+        if threads:
+            self._connection.execute(f'SET threads TO {int(threads)}')
+
+    def _count_by(self, source, file_format, by, conditions, top, sums):
+        if file_format == 'arrow':
+            # the memory-mapped snapshot is scanned in place
+            with arrow_view(self._connection, open_snapshot(source)) as view:
+                return self._query(view, by, conditions, top, sums)
+
+        reader = 'read_parquet' if file_format == 'parquet' else 'read_csv_auto'
+        return self._query(f'{reader}({_sql_literal(source)})', by, conditions, top, sums)
+
+    def _query(self, relation, by, conditions, top, sums):
+        select = [f'{DERIVED_COLUMNS[col]["sql"]} AS {col}' if col in DERIVED_COLUMNS else f'"{col}"' for col in by]
+        aggregates = [f'count(*) AS {COUNT_COLUMN}'] + [f'sum("{col}") AS "{col}"' for col in sums]
+
+        # pandas drops missing group keys, do the same here so that engines return identical results
+        clauses = [f'"{col}" IS NOT NULL' for col in by if col not in DERIVED_COLUMNS]
+        params = list()
+        for col, op, value in conditions:
+            if op == 'in':
+                clauses.append(f'"{col}" IN ({", ".join(["?"] * len(value))})')
+                params.extend(value)
+            else:
+                clauses.append(f'"{col}" {"=" if op == "==" else op} ?')
+                params.append(value)
+
+        query = (
+            f'SELECT {", ".join(select + aggregates)} '
+            f'FROM {relation} '
+            f'{"WHERE " + " AND ".join(clauses) if clauses else ""} '
+            f'GROUP BY {", ".join(str(i + 1) for i in range(len(by)))} '
+            f'ORDER BY {COUNT_COLUMN} DESC '
+            f'{f"LIMIT {int(top)}" if top else ""}'
+        )
+        return self._connection.execute(query, params).df()
+
+
+class DatatableEngine(QueryEngine):
+    name = 'datatable'
+
+    def __init__(self, threads=None):
+        super().__init__(threads)
+        import datatable
+
+        self._dt = datatable
+        if threads:
+            datatable.options.nthreads = int(threads)
+
+    def _count_by(self, source, file_format, by, conditions, top, sums):
+        dt, f = self._dt, self._dt.f
+        if file_format != 'csv':
+            raise ValueError(f'{self.name} engine can only read csv sources, got={source}')
+
+        derived = [col for col in by if col in DERIVED_COLUMNS]
+        if derived:
+            raise ValueError(f'{self.name} engine does not support derived columns, got={derived}')
+
+        frame = dt.fread(source, columns=set(by) | set(sums) | {col for col, _, _ in conditions})
+        for col, op, value in conditions:
+            if op == 'in':
+                mask = None
+                for v in value:
+                    mask = (f[col] == v) if mask is None else (mask | (f[col] == v))
+                frame = frame[mask, :]
+            else:
+                frame = frame[{'==': f[col] == value, '!=': f[col] != value, '>': f[col] > value,
+                               '>=': f[col] >= value, '<': f[col] < value, '<=': f[col] <= value}[op], :]
+
+        frame = frame[:, {COUNT_COLUMN: dt.count(), **{col: dt.sum(f[col]) for col in sums}}, dt.by(*by)]
+        frame = frame[:, :, dt.sort(-f[COUNT_COLUMN])]
+        if top:
+            frame = frame[:int(top), :]
+        return frame.to_pandas()
+
+
+ENGINES = {engine.name: engine for engine in [DuckDBEngine, DatatableEngine, PandasEngine]}
+
+
+def get_engine(name='auto', threads=None, logger=print):
+    """
+    Returns a query engine by name. With 'auto' the first engine whose library is installed is returned, in the order
+    duckdb, datatable, pandas.
+    @param name: one of 'auto', 'duckdb', 'datatable' or 'pandas'
+    @param threads: Optional: number of threads for the multi-threaded engines (default: all cores)
+    @param logger: Optional - allows to change between print and logging.info
+    @return: QueryEngine instance
+    """
+    if name != 'auto' and name not in ENGINES:
+        raise ValueError(f"Expected one of auto, {', '.join(ENGINES)} as engine name, got={name}")
+
+    candidates = list(ENGINES) if name == 'auto' else [name]
+    for candidate in candidates:
+        try:
+            return ENGINES[candidate](threads=threads)
+        except ImportError:
+            logger(f"{candidate} was not found. run `pip install {candidate}`")
+            if name != 'auto':
+                raise
@@ -0,0 +1,104 @@
+"""
+Local joins of the columnar stores of related tables, e.g. the crashes, persons and vehicles tables on collision_id.
+
+The stores are scanned in place by DuckDB (Parquet and CSV files read by DuckDB, Arrow snapshots memory-mapped and
+registered) and only the joined, projected and filtered rows are handed back to pandas; no table is loaded into a
+DataFrame to be merged:
+
+    join_stores({'crashes': '.data/crashes.parquet', 'persons': ('.data/persons.feather', {'collision_id': 'BIGINT'})},
+                columns={'crashes': ['borough'], 'persons': ['person_type']},
+                where={'persons.person_injury': 'Killed'})
+
+Every table after the first one is joined to the first one. Selected columns keep their name, unless an earlier table
+already has it, they are then prefixed with their table name, e.g. persons_crash_date.
+"""
+import contextlib
+
+from .engines import _conditions, _file_format, _sql_literal, arrow_view
+from .snapshot import open_snapshot
+
+JOINS = {'inner': 'INNER JOIN', 'left': 'LEFT JOIN'}
+
+
+def _relation(connection, source, dtypes, views):
+    file_format = _file_format(source)
+    if file_format == 'arrow':
+        relation = views.enter_context(arrow_view(connection, open_snapshot(source)))
+    else:
+        reader = 'read_parquet' if file_format == 'parquet' else 'read_csv_auto'
+        relation = f'{reader}({_sql_literal(source)})'
+
+    names = [column[0] for column in connection.execute(f'SELECT * FROM {relation} LIMIT 0').description]
+    dtypes = {col: sql_type for col, sql_type in (dtypes or dict()).items() if col in names}
+    if dtypes:
+        # an explicit select list rather than SELECT * REPLACE, which older duckdb releases, e.g. 0.3.1, do not bind
+        projection = [f'TRY_CAST("{col}" AS {dtypes[col]}) AS "{col}"' if col in dtypes else f'"{col}"'
+                      for col in names]
+        relation = f'(SELECT {", ".join(projection)} FROM {relation})'
+    return relation, names
+
+
+def join_stores(tables, on='collision_id', columns=None, where=None, how='inner', connection=None):
+    """
+    Joins stores on a shared key.
+    @param tables: dict table name -> source path or (source path, dict column -> DuckDB type the column is cast to)
+    @param on: join key, present in every table
+    @param columns: Optional: dict table name -> columns selected from it, defaults to every column
+    @param where: Optional: dict of filters keyed by 'table.column', values as in the where of the engines' count_by
+    @param how: 'inner' or 'left', a left join keeps the rows of the first table without a match
+    @param connection: Optional: duckdb connection
+    @return: pandas.DataFrame
+    """
+    import duckdb
+
+    if how not in JOINS:
+        raise ValueError(f"Expected one of {', '.join(JOINS)} as join, got={how}")
+    if len(tables) < 2:
+        raise ValueError(f'Expected at least two tables to join, got={list(tables)}')
+    unknown = set(columns or dict()) - set(tables)
+    if unknown:
+        raise ValueError(f'Columns of unknown tables={sorted(unknown)}')
+
+    connection = connection or duckdb.connect(database=':memory:')
+    with contextlib.ExitStack() as views:
+        select, joins, seen = list(), list(), set()
+        first = None
+        for name, table in tables.items():
+            source, dtypes = table if isinstance(table, tuple) else (table, None)
+            relation, names = _relation(connection, source, dtypes, views)
+            if on not in names:
+                raise ValueError(f'Table {name} has no join key column={on}')
+
+            wanted = names if columns is None or name not in columns else list(columns[name])
+            for col in wanted:
+                if col not in names:
+                    raise ValueError(f'Table {name} has no column={col}')
+                if first is not None and col == on:
+                    continue
+                alias = col if col not in seen else f'{name}_{col}'
+                seen.add(alias)
+                select.append(f'"{name}"."{col}" AS "{alias}"')
+
+            if first is None:
+                first = name
+                joins.append(f'{relation} AS "{name}"')
+            else:
+                joins.append(f'{JOINS[how]} {relation} AS "{name}" ON "{first}"."{on}" = "{name}"."{on}"')
+
+        clauses, params = list(), list()
+        for col, op, value in _conditions(where):
+            table, _, col = col.rpartition('.')
+            column = f'"{table or first}"."{col}"'
+            if op == 'in':
+                clauses.append(f'{column} IN ({", ".join(["?"] * len(value))})')
+                params.extend(value)
+            else:
+                clauses.append(f'{column} {"=" if op == "==" else op} ?')
+                params.append(value)
+
+        query = (
+            f'SELECT {", ".join(select)} '
+            f'FROM {" ".join(joins)} '
+            f'{"WHERE " + " AND ".join(clauses) if clauses else ""}'
+        )
+        return connection.execute(query, params).df()
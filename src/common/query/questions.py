@@ -0,0 +1,39 @@
+"""
+The group-by / filter / top-N questions from part2_eda, expressed as QueryEngine.count_by arguments.
+"""
+
+QUESTIONS = {
+    # Which borough has the most collisions?
+    'collisions_by_borough': dict(by='borough'),
+    # What is the biggest reason for collisions in Brooklyn and Queens?
+    'top_factors_brooklyn_queens': dict(
+        by='contributing_factor_vehicle_1', where={'borough': ['BROOKLYN', 'QUEENS']}, top=15
+    ),
+    # What is the biggest reason for collisions?
+    'top_factors': dict(by='contributing_factor_vehicle_1', top=5),
+    # Which zipcodes have the largest collisions?
+    'top_zip_codes': dict(by='zip_code', top=5),
+    # Which street has the most collisions in my area?
+    'top_streets_10014': dict(by=['on_street_name', 'off_street_name'], where={'zip_code': '10014'}, top=5),
+    'top_vehicle_types_10014': dict(by='vehicle_type_code1', where={'zip_code': '10014'}, top=5),
+    # Collisions per weekday / year
+    'collisions_by_day_of_week': dict(by='day_of_week'),
+    'collisions_by_year': dict(by='year'),
+    # Worst hour to ride your bike?
+    'cyclist_injuries_by_hour': dict(by='hour', where={'number_of_cyclist_injured': ('>', 0)}),
+    # Collisions by year, month and borough (calc_question1)
+    'collisions_by_year_month_borough': dict(by=['year', 'month', 'borough']),
+}
+
+
+def run_question(engine, source, name):
+    """
+    Runs one of the named QUESTIONS on the given engine.
+    @param engine: QueryEngine instance
+    @param source: path to the .parquet or .csv store
+    @param name: key of QUESTIONS
+    @return: pandas.DataFrame
+    """
+    if name not in QUESTIONS:
+        raise ValueError(f"Unknown question={name}, expected one of {', '.join(QUESTIONS)}")
+    return engine.count_by(source, **QUESTIONS[name])
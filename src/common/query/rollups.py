@@ -0,0 +1,237 @@
+"""
+Incrementally maintained rollups of the collisions table.
+
+A rollup keeps additive aggregates, the `collisions` count and the sums of the number_of_* columns, keyed by a tuple
+of dimensions (raw columns or the DERIVED_COLUMNS of the engines, e.g. year / month / hour). Being additive, a sync
+only has to aggregate its delta rows: inserted and updated rows are added, the previous version of updated and deleted
+rows is retracted (added with a negative sign). Dashboards then read a table of a few thousand groups instead of
+scanning the whole store:
+
+    store = RollupStore('.data/rollups')
+    fetcher.sync('.data/crashes.parquet', rollups=store)
+    store.query('by_year_month_borough')
+
+Every rollup is an atomically written Parquet file holding the fingerprint (common.data_blend.hashing.fingerprint) of
+the table it aggregates. A delta is only applied on top of the version it was computed from, any other rollup, e.g. a
+new one or one left behind by an interrupted sync, is rebuilt from the full table.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.data_blend.validation import PERSON_COUNT_COLUMNS
+from common.utilities.filesystem import atomic_write
+from common.utilities.metrics import span
+from .engines import COUNT_COLUMN, DERIVED_COLUMNS
+
+METADATA_KEY = b'nyc.rollup'
+
+logger = logging.getLogger(__name__)
+
+
+class StaleRollup(ValueError):
+    def __init__(self, name, version, expected):
+        super().__init__(f'Rollup {name} is at version={version}, the delta applies to version={expected}')
+        self.name = name
+        self.version = version
+        self.expected = expected
+
+
+class Rollup:
+    def __init__(self, name, by, measures=None):
+        """
+        @param name: rollup name, also the name of its Parquet file
+        @param by: dimensions, raw columns or keys of DERIVED_COLUMNS
+        @param measures: Optional: numeric columns summed per group, defaults to the number_of_* columns
+        """
+        self.name = name
+        self.by = [by] if isinstance(by, str) else list(by)
+        self.measures = PERSON_COUNT_COLUMNS if measures is None else list(measures)
+
+    @property
+    def columns(self):
+        """Columns of the table read by the rollup."""
+        sources = [DERIVED_COLUMNS[col]['source'] if col in DERIVED_COLUMNS else col for col in self.by]
+        return list(dict.fromkeys(sources + self.measures))
+
+    def aggregate(self, df, sign=1):
+        """
+        @param df: pandas.DataFrame of rows of the table
+        @param sign: 1 to add the rows, -1 to retract them
+        @return: pandas.DataFrame with the dimensions, the collisions count and the measures, one row per group
+        """
+        frame = pd.DataFrame({col: _dimension(df, col) for col in self.by}, index=df.index)
+        frame[COUNT_COLUMN] = np.int64(sign)
+        for col in self.measures:
+            frame[col] = _numeric(df, col) * sign
+        return frame.groupby(self.by, dropna=False, sort=False).sum().reset_index()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} name={self.name}, by={self.by}>"
+
+
+def _column(df, col):
+    # Socrata leaves out fields that are null in every row of a page
+    return df[col] if col in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def _numeric(df, col):
+    return pd.to_numeric(_column(df, col), errors='coerce').fillna(0).astype(np.int64)
+
+
+def _dimension(df, col):
+    if col not in DERIVED_COLUMNS:
+        return _column(df, col)
+    # the derived columns of the engines, evaluated on the distinct dates / times only and nullable so that adding and
+    # retracting rows group alike
+    source = DERIVED_COLUMNS[col]['source']
+    codes, uniques = pd.factorize(_column(df, source))
+    derived = pd.array(DERIVED_COLUMNS[col]['pandas'](pd.DataFrame({source: uniques})).to_numpy(), dtype='Int64')
+    return pd.Series(derived.take(codes, allow_fill=True), index=df.index)
+
+
+def combine(table, delta, by):
+    """
+    Adds a delta to a rollup table, groups whose count drops to 0 are removed.
+    @return: pandas.DataFrame
+    """
+    if table is None or not len(table):
+        combined = delta
+    else:
+        combined = pd.concat([table, delta], ignore_index=True).groupby(by, dropna=False, sort=False).sum()
+        combined = combined.reset_index()
+    return combined[combined[COUNT_COLUMN] != 0].reset_index(drop=True)
+
+
+ROLLUPS = [
+    # calc_question1: average collisions per month, by borough and year
+    Rollup('by_year_month_borough', ['year', 'month', 'borough']),
+    # injury histograms: worst hour for cyclists, pedestrians and motorists
+    Rollup('by_hour', ['hour']),
+    Rollup('by_day_of_week_hour', ['day_of_week', 'hour']),
+]
+
+
+class RollupStore:
+    def __init__(self, directory, rollups=None):
+        """
+        @param directory: directory of the rollup Parquet files
+        @param rollups: Optional: list of Rollup, defaults to ROLLUPS
+        """
+        self.directory = directory
+        self.rollups = {rollup.name: rollup for rollup in (ROLLUPS if rollups is None else rollups)}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def columns(self):
+        """Columns of the table read by every rollup, e.g. to read only those from the previous store."""
+        return list(dict.fromkeys(col for rollup in self.rollups.values() for col in rollup.columns))
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.parquet')
+
+    def read(self, name):
+        """
+        @return: pandas.DataFrame of the rollup and its version, (None, None) if it was never built
+        """
+        import pyarrow.parquet as pq
+
+        path = self.path(name)
+        if not os.path.exists(path):
+            return None, None
+        table = pq.read_table(path)
+        metadata = json.loads((table.schema.metadata or dict()).get(METADATA_KEY, b'{}'))
+        return table.to_pandas(), metadata.get('version')
+
+    def query(self, name):
+        """
+        @param name: rollup name
+        @return: pandas.DataFrame with the dimensions, the collisions count and the measures, sorted by count
+        """
+        if name not in self.rollups:
+            raise ValueError(f"Unknown rollup={name}, expected one of {', '.join(self.rollups)}")
+        table, _ = self.read(name)
+        if table is None:
+            table = self.rollups[name].aggregate(pd.DataFrame())
+        return table.sort_values(COUNT_COLUMN, ascending=False, kind='stable').reset_index(drop=True)
+
+    def _write(self, name, table, version):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(table, preserve_index=False)
+        metadata = dict(table.schema.metadata or dict())
+        metadata[METADATA_KEY] = json.dumps(dict(version=version, by=self.rollups[name].by)).encode()
+        with atomic_write(self.path(name), 'wb') as fp:
+            pq.write_table(table.replace_schema_metadata(metadata), fp)
+
+    def rebuild(self, df, version=None, names=None):
+        """
+        Recomputes rollups from the full table.
+        @param df: pandas.DataFrame, the table
+        @param version: Optional: fingerprint of the table
+        @param names: Optional: rollups to rebuild, defaults to all
+        """
+        for name in (self.rollups if names is None else names):
+            with span('common.query.rollups.rebuild', rows=len(df)):
+                self._write(name, self.rollups[name].aggregate(df), version)
+            logger.info(f'Rebuilt rollup {name} from {len(df)} rows')
+
+    def apply(self, inserted=None, retracted=None, since=None, version=None, names=None):
+        """
+        Applies the delta rows of a sync.
+        @param inserted: Optional: pandas.DataFrame of the inserted rows and of the new version of the updated rows
+        @param retracted: Optional: pandas.DataFrame of the deleted rows and of the previous version of the updated rows
+        @param since: Optional: version the delta was computed from, StaleRollup is raised for a rollup at another
+                      version
+        @param version: Optional: version of the table after the delta
+        @param names: Optional: rollups to update, defaults to all
+        """
+        names = list(self.rollups if names is None else names)
+        tables = dict()
+        for name in names:
+            tables[name], current = self.read(name)
+            if since is not None and current != since:
+                raise StaleRollup(name, current, since)
+
+        rows = sum(len(frame) for frame in (inserted, retracted) if frame is not None)
+        for name in names:
+            rollup = self.rollups[name]
+            with span('common.query.rollups.apply', rows=rows):
+                deltas = [rollup.aggregate(frame, sign) for frame, sign in ((inserted, 1), (retracted, -1))
+                          if frame is not None and len(frame)]
+                table = tables[name]
+                for delta in deltas:
+                    table = combine(table, delta, rollup.by)
+                self._write(name, rollup.aggregate(pd.DataFrame()) if table is None else table, version)
+        logger.info(f'Applied {rows} delta rows to rollups {names}')
+
+    def update(self, df, inserted=None, retracted=None, since=None, version=None):
+        """
+        Brings every rollup to version: the ones at version since apply the delta, the others are rebuilt from df.
+        @param df: pandas.DataFrame, the table after the delta
+        @return: dict rollup name -> 'applied', 'rebuilt' or 'current'
+        """
+        actions = dict()
+        for name in self.rollups:
+            _, current = self.read(name)
+            if current is not None and current == version:
+                actions[name] = 'current'
+            elif since is not None and current == since:
+                actions[name] = 'applied'
+            else:
+                actions[name] = 'rebuilt'
+        applied = [name for name, action in actions.items() if action == 'applied']
+        rebuilt = [name for name, action in actions.items() if action == 'rebuilt']
+        if applied:
+            self.apply(inserted, retracted, since, version, applied)
+        if rebuilt:
+            self.rebuild(df, version, rebuilt)
+        return actions
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} directory={self.directory}, rollups={list(self.rollups)}>"
+
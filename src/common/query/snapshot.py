@@ -0,0 +1,140 @@
+"""
+Snapshot of the normalized collisions table as an uncompressed Arrow IPC (Feather v2) file.
+
+Loading output.csv re-parses 2M rows of text in every kernel and worker. The snapshot is written once, after
+df_prepare, and opened with a memory map: the file is not read up front, columns are views on the page cache shared by
+every process that opens it, and only the columns that are used are ever paged in.
+
+    write_snapshot(df, '.data/output.feather')
+    table = open_snapshot('.data/output.feather')                  # pyarrow.Table, zero-copy
+    df = read_snapshot('.data/output.feather', columns=['borough'])  # pandas.DataFrame
+
+Numeric columns without nulls are converted to pandas without a copy, strings are materialized as Python objects.
+The query engines read .feather/.arrow stores directly (see common.query.engines).
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from common.utilities.filesystem import atomic_write
+from common.utilities.metrics import span
+
+EXTENSIONS = ('.feather', '.arrow')
+METADATA_KEY = b'nyc.snapshot'
+
+logger = logging.getLogger(__name__)
+
+
+def to_arrow(df, dtypes=None):
+    """
+    Converts df to a pyarrow.Table once, NaN and None become nulls of the validity bitmaps.
+    @param df: pandas.DataFrame
+    @param dtypes: Optional: dict column -> dtype applied before the conversion
+    @return: pyarrow.Table
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    if dtypes:
+        df = df.astype(dtypes)
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+
+    # object columns mixing types, e.g. zip codes parsed as int and str, are stored as strings
+    columns = dict()
+    for col in df.columns:
+        try:
+            columns[col] = pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            logger.warning(f'Column {col} has mixed types, stored as string')
+            columns[col] = pa.array(df[col].where(pd.isnull(df[col]), df[col].astype(str)), type=pa.string(),
+                                    from_pandas=True)
+    return pa.table(columns)
+
+
+def write_snapshot(df, path, dtypes=None, source=None):
+    """
+    Writes df atomically as an uncompressed Arrow IPC file, readers never see a partial snapshot.
+    @param df: pandas.DataFrame or pyarrow.Table, e.g. the output of data_blend.operations.df_prepare
+    @param path: .feather or .arrow path
+    @param dtypes: Optional: dict column -> dtype applied to a pandas.DataFrame before the conversion
+    @param source: Optional: description of where the data comes from, stored in the file metadata
+    @return: number of rows written
+    """
+    import pyarrow as pa
+
+    if not path.endswith(EXTENSIONS):
+        raise ValueError(f"Expected a {' or '.join(EXTENSIONS)} path, got={path}")
+
+    with span('common.query.snapshot.write') as s:
+        table = df if isinstance(df, pa.Table) else to_arrow(df, dtypes)
+        metadata = dict(rows=table.num_rows, source=source, created_at=datetime.now(timezone.utc).isoformat())
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               METADATA_KEY: json.dumps(metadata).encode()})
+        with atomic_write(path, 'wb') as fp:
+            # no compression: compressed buffers would have to be decoded, and copied, on every read
+            with pa.ipc.new_file(fp, table.schema) as writer:
+                writer.write_table(table)
+        s.add(rows=table.num_rows, nbytes=os.path.getsize(path))
+    return table.num_rows
+
+
+def open_snapshot(path, columns=None):
+    """
+    Opens the snapshot with a memory map, no data is read until a column is used.
+    @param path: .feather or .arrow path
+    @param columns: Optional: columns to keep
+    @return: pyarrow.Table whose buffers point into the mapped file
+    """
+    import pyarrow as pa
+
+    with span('common.query.snapshot.open'):
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table if columns is None else table.select(list(columns))
+
+
+def read_snapshot(path, columns=None):
+    """
+    @param path: .feather or .arrow path
+    @param columns: Optional: columns to read
+    @return: pandas.DataFrame
+    """
+    table = open_snapshot(path, columns)
+    with span('common.query.snapshot.to_pandas') as s:
+        # one block per column lets numeric columns stay views on the mapped file
+        df = table.to_pandas(split_blocks=True)
+        s.add(rows=len(df))
+    return df
+
+
+def snapshot_info(path):
+    """
+    @return: dict with the rows, source and created_at recorded by write_snapshot, read from the schema only
+    """
+    import pyarrow as pa
+
+    with pa.memory_map(path, 'r') as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return json.loads(metadata[METADATA_KEY]) if METADATA_KEY in metadata else dict()
+
+
+def snapshot_from_store(source, path, dtypes=None):
+    """
+    Converts a .csv or .parquet store, e.g. .data/output.csv, into a snapshot.
+    @param source: .csv or .parquet path
+    @param path: .feather or .arrow path
+    @param dtypes: Optional: dict column -> dtype, e.g. {'zip_code': str}
+    @return: number of rows written
+    """
+    import pandas as pd
+
+    if source.endswith('.parquet'):
+        df = pd.read_parquet(source)
+    elif source.endswith('.csv'):
+        df = pd.read_csv(source, dtype={'zip_code': str})
+    else:
+        raise ValueError(f'Unknown file format for source={source}, expected .parquet or .csv')
+    return write_snapshot(df, path, dtypes=dtypes, source=os.path.basename(source))
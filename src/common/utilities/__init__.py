@@ -1,2 +1,6 @@
 from .decorators import retry, parallel_task
-from .filesystem import most_recent_file, most_recent_folder
\ No newline at end of file
+from .filesystem import atomic_write, most_recent_file, most_recent_folder
+from .metrics import REGISTRY, span, timed
+from .retrying import CircuitBreaker, RetryBudget, RetryableHTTPError, retry_backoff
+from .rate_limit import TokenBucket, get_limiter
+from .executors import MANAGER, get_executor
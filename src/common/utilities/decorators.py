@@ -1,26 +1,11 @@
+import logging
 import time
 
-from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from .metrics import span
+from .parallel import parallel_task  # noqa: F401, kept importable from decorators
 
-_DEFAULT_POOL = ThreadPoolExecutor()
-
-
-def parallel_task(func, executor=None):
-    """
-    Decorator designed to parallelize any method invocation. We use this by writing @parallel_task before any
-    method declaration, and it will be called in parallel without blocking the main thread.
-
-    To fetch the result of this Future Objet, one has to call Future.result(), which will block the main thread until
-    the result is fetched.
-    @param func: function or method to be called in parallel
-    @param executor: Optional ThreadPoolExecutor
-    @return: Returns a concurrent.futures.Future instance
-    """
-    @wraps(func)
-    def wrap(*args, **kwargs):
-        return (executor or _DEFAULT_POOL).submit(func, *args, **kwargs)
-    return wrap
+logger = logging.getLogger(__name__)
 
 
 def retry(exception=Exception, value_type=None, tries=3, delay=3, backoff=2, logger=None):
@@ -72,13 +57,19 @@ def retry(exception=Exception, value_type=None, tries=3, delay=3, backoff=2, log
 
 
 def timeit(method):
+    """
+    Records every call of method as a span in the metrics registry and logs its duration.
+    @param method: function to time
+    @return: decorated function
+    """
+    name = f'{method.__module__}.{method.__qualname__}'
+
     @wraps(method)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = method(*args, **kwargs)
-        end_time = time.time()
-        print(f"{method.__name__} => {(end_time-start_time)*1000} ms")
+        with span(name) as s:
+            result = method(*args, **kwargs)
+        logger.info(f"{method.__name__} => {s.duration_ns / 1e6:.3f} ms")
 
         return result
 
-    return wrapper
\ No newline at end of file
+    return wrapper
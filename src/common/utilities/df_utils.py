@@ -1,6 +1,6 @@
 import pandas as pd
 
-# TODO Create cardinality function for multiple dtypes(df, array, series, list)
+# Cardinality: distinct values / rows
 # High is a lot of distinct values low is a lot of repeated values
 
 
@@ -9,50 +9,52 @@ def calc_cardinality(iterable, verbose=False):
        If a pandas dataframe is passed then all object columns are looped through
        and their cardinality returned.
 
-       Value is between 0 and 100
+       Value is between 0 and 1: distinct values / rows
 
     Arguments:
         iterable {iterable} -- pandas series, dataframe, or numpy array
-    """
+        verbose {bool} -- print the scores
 
+    Returns:
+        float for a series or array, pandas.Series of scores per object column for a dataframe
+    """
     if isinstance(iterable, pd.DataFrame):
-        print("<===== Cardinality Score =====>")
-        rows = iterable.shape[1]
+        rows = iterable.shape[0]
         df_str = iterable.select_dtypes(include=[object])
-        for c in df_str.columns:
-            col_unique_val_count = len(iterable[c].unique())
-            cardinality = col_unique_val_count / rows
-            print(f"{c}: {cardinality}")
+        cardinality = df_str.nunique(dropna=False) / rows if rows else df_str.nunique(dropna=False).astype(float)
+        if verbose:
+            print("<===== Cardinality Score =====>")
+            for c, score in cardinality.items():
+                print(f"{c}: {score}")
+        return cardinality
 
+    values = pd.Series(iterable)
+    cardinality = values.nunique(dropna=False) / len(values) if len(values) else float('nan')
+    if verbose:
+        print(f"Cardinality Score: {cardinality}")
+    return cardinality
 
-# TODO Create a describe stats helper that adds additional summary stats to a described pandas df.
-# TODO Add a cardinality row
 
-
-def describe_stats(df_to_describe):
-    """[summary]
+def describe_stats(df_to_describe, approximate=False):
+    """Describes the numeric columns with the coefficient of variation, the interquartile range and the cardinality.
 
     Arguments:
-        df {[type]} -- [description]
+        df_to_describe {pandas.DataFrame} -- frame to describe
+        approximate {bool} -- use the one-pass sketches of common.utilities.profiling (approximate quantiles and
+                              distinct counts) instead of exact pandas statistics, e.g. for 2M+ rows
 
     Returns:
-        [type] -- [description]
+        pandas.DataFrame -- one column per numeric column, rows in stats_index
     """
-    df = df_to_describe.describe()
+    stats_index = ["count", "mean", "std", "cv", "min", "25%", "50%", "75%", "max", "iqr", "cardinality"]
+    numeric = df_to_describe.select_dtypes(include="number")
+    if approximate:
+        from .profiling import profile_frame
+
+        return profile_frame(numeric).to_frame().reindex(stats_index)
+
+    df = numeric.describe()
     df.loc["cv"] = df.loc["std"] / df.loc["mean"]
     df.loc["iqr"] = df.loc["75%"] - df.loc["25%"]
-    # Index order
-    stats_index = [
-        "count",
-        "mean",
-        "std",
-        "cv",
-        "min",
-        "25%",
-        "50%",
-        "75%",
-        "max",
-        "iqr",
-    ]
-    stats_df = df.reindex(stats_index)
-    return stats_df
+    df.loc["cardinality"] = numeric.nunique() / len(numeric) if len(numeric) else float("nan")
+    return df.reindex(stats_index)
@@ -0,0 +1,157 @@
+"""
+Named, bounded executor pools shared by the package.
+
+Two pools are configured by default and created on first use:
+    - 'io':  ThreadPoolExecutor for API calls and database round trips
+    - 'cpu': ProcessPoolExecutor for parsing and blending
+Their sizes come from the NYC_POOL_<NAME>_WORKERS / NYC_POOL_<NAME>_MAX_PENDING environment variables, or from the
+CPU count. Submissions block once max_pending tasks are queued or running, which gives producers backpressure
+instead of an unbounded queue of futures, and every pool is shut down at interpreter exit.
+"""
+import atexit
+import collections
+import concurrent.futures
+import os
+import threading
+from concurrent.futures import Executor
+
+# resolved on pool creation, concurrent.futures only imports multiprocessing once a process pool is needed
+_KINDS = {'thread': 'ThreadPoolExecutor', 'process': 'ProcessPoolExecutor'}
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class BoundedExecutor(Executor):
+    """Wraps an executor so that at most max_pending submitted tasks are queued or running at any time."""
+    def __init__(self, executor, max_pending):
+        if max_pending < 1:
+            raise ValueError(f'Expected max_pending >= 1, got={max_pending}')
+        self.executor = executor
+        self.max_pending = max_pending
+        self._semaphore = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        self._semaphore.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(lambda _: self._semaphore.release())
+        return future
+
+    def map_batched(self, fn, iterable, batch_size=1):
+        """
+        Lazily maps fn over iterable, in order, keeping at most max_pending batches in flight.
+        @param fn: function called once per item
+        @param iterable: items, consumed lazily
+        @param batch_size: number of items sent to a worker per task, larger batches amortize process pool IPC
+        @return: generator of results
+        """
+        if batch_size < 1:
+            raise ValueError(f'Expected batch_size >= 1, got={batch_size}')
+
+        in_flight = collections.deque()
+        batch = list()
+        for item in iterable:
+            batch.append(item)
+            if len(batch) == batch_size:
+                # hold at most max_pending of our own futures, so submit never waits on unconsumed results
+                while len(in_flight) >= self.max_pending:
+                    yield from in_flight.popleft().result()
+                in_flight.append(self.submit(_map_batch, fn, batch))
+                batch = list()
+        if batch:
+            while len(in_flight) >= self.max_pending:
+                yield from in_flight.popleft().result()
+            in_flight.append(self.submit(_map_batch, fn, batch))
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+    def shutdown(self, wait=True, **kwargs):
+        self.executor.shutdown(wait=wait, **kwargs)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} executor={self.executor.__class__.__name__}, max_pending={self.max_pending}>"
+
+
+def _map_batch(fn, batch):
+    # module level, so that it can be pickled to process pool workers
+    return [fn(item) for item in batch]
+
+
+class ExecutorManager:
+    def __init__(self):
+        cpu_count = os.cpu_count() or 1
+        self._specs = dict()
+        self._pools = dict()
+        self._lock = threading.Lock()
+        self.register('io', kind='thread', workers=min(32, cpu_count + 4))
+        self.register('cpu', kind='process', workers=cpu_count)
+        atexit.register(self.shutdown)
+
+    def register(self, name, kind='thread', workers=None, max_pending=None):
+        """
+        Declares a named pool, environment variables take precedence over the given sizes.
+        @param name: pool name
+        @param kind: 'thread' or 'process'
+        @param workers: Optional: number of workers, defaults to the CPU count
+        @param max_pending: Optional: bound of queued plus running tasks, defaults to 4 x workers
+        """
+        if kind not in _KINDS:
+            raise ValueError(f"Expected one of {', '.join(_KINDS)} as pool kind, got={kind}")
+
+        workers = _env_int(f'NYC_POOL_{name.upper()}_WORKERS', workers or os.cpu_count() or 1)
+        max_pending = _env_int(f'NYC_POOL_{name.upper()}_MAX_PENDING', max_pending or 4 * workers)
+        with self._lock:
+            if name in self._pools:
+                raise ValueError(f'Pool={name} is already running, shut it down before registering it again')
+            self._specs[name] = dict(kind=kind, workers=workers, max_pending=max_pending)
+
+    def get(self, name='io'):
+        """
+        Returns the named pool, creating it on first use.
+        @param name: pool name
+        @return: BoundedExecutor
+        """
+        with self._lock:
+            if name not in self._pools:
+                if name not in self._specs:
+                    raise ValueError(f"Unknown pool={name}, expected one of {', '.join(self._specs)}")
+                spec = self._specs[name]
+                executor = getattr(concurrent.futures, _KINDS[spec['kind']])(max_workers=spec['workers'])
+                self._pools[name] = BoundedExecutor(executor, spec['max_pending'])
+            return self._pools[name]
+
+    def spec(self, name):
+        return dict(self._specs[name])
+
+    def shutdown(self, wait=True, names=None):
+        """
+        Shuts down running pools, a pool that is used again is created anew, after it may be registered again.
+        @param wait: wait for the pending tasks
+        @param names: Optional: names of the pools to shut down, defaults to all
+        """
+        with self._lock:
+            names = list(self._pools) if names is None else [name for name in names if name in self._pools]
+            pools = [self._pools.pop(name) for name in names]
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} pools={self._specs}>"
+
+
+MANAGER = ExecutorManager()
+
+
+def get_executor(name='io'):
+    """
+    Returns a named pool of the process wide ExecutorManager.
+    @param name: 'io', 'cpu' or any name registered with MANAGER.register
+    @return: BoundedExecutor
+    """
+    return MANAGER.get(name)
@@ -1,5 +1,7 @@
+import contextlib
 import glob
 import os
+import tempfile
 
 
 def most_recent_file(path, pattern="*", level=0, key=os.path.getctime):
@@ -30,3 +32,27 @@ def most_recent_folder(path, pattern="*", key=os.path.getctime):
     except ValueError as e:
         raise ValueError("No files found at this path/level") from e
 
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', **kwargs):
+    """
+    Opens a temporary file next to path and moves it over path once the block succeeds, readers never see a partial
+    file and a crash leaves the previous version in place.
+    @param path: destination file
+    @param mode: 'wb' or 'w'
+    @param kwargs: passed to open, e.g. encoding
+    @return: file object
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
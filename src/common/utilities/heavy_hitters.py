@@ -0,0 +1,200 @@
+"""
+Streaming top-K (heavy hitters) sketches with bounded memory.
+
+"Which zip codes / streets / vehicle types have the most collisions" only needs the few largest groups, not a full
+groupby of every row. The sketches below are updated page by page, e.g. from CheckpointedDownloader(on_page=...),
+merged across workers, and answer top-K at any time:
+
+    - SpaceSaving(capacity): keeps at most capacity items with an upper bound count and its maximum overestimation
+      `error`; every item more frequent than N / capacity is kept, and error <= N / capacity (N = rows seen)
+    - CountMinSketch(width, depth): frequency of any item, overestimated by at most e * N / width with probability
+      1 - exp(-depth)
+
+    hitters = HeavyHitters(['zip_code', 'on_street_name'])
+    hitters.update(page_df)
+    hitters.merge(other_worker_hitters).top('zip_code', 5)
+
+Each page is first reduced to its value counts, so the per row work is one vectorized value_counts per column.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+# fixed so that sketches built in different processes can be merged
+HASH_KEY = '0c0ffee0ddba11ed'
+
+
+class SpaceSaving:
+    def __init__(self, capacity=1000):
+        """
+        @param capacity: maximum number of monitored items, counts are overestimated by at most rows / capacity
+        """
+        if capacity < 1:
+            raise ValueError(f'Expected capacity >= 1, got={capacity}')
+        self.capacity = capacity
+        self.rows = 0
+        self.counts = pd.Series(dtype=np.int64)
+        self.errors = pd.Series(dtype=np.int64)
+
+    @property
+    def min_count(self):
+        # an item that is not monitored by a full summary occurred at most min_count times
+        return int(self.counts.min()) if len(self.counts) >= self.capacity else 0
+
+    def _combine(self, counts, errors, floor, rows):
+        items = self.counts.index.union(counts.index)
+        own_floor = self.min_count
+        combined = (self.counts.reindex(items, fill_value=own_floor)
+                    + counts.reindex(items, fill_value=floor)).astype(np.int64)
+        combined_errors = (self.errors.reindex(items, fill_value=own_floor)
+                           + errors.reindex(items, fill_value=floor)).astype(np.int64)
+        keep = combined.nlargest(self.capacity, keep='first').index
+        self.counts, self.errors = combined[keep], combined_errors[keep]
+        self.rows += rows
+        return self
+
+    def update(self, values):
+        """
+        @param values: pandas.Series (or array) of items, nulls are ignored
+        """
+        return self.add_counts(pd.Series(values).value_counts(dropna=True))
+
+    def add_counts(self, counts):
+        """
+        @param counts: pandas.Series item -> exact count, e.g. the value_counts of a page
+        """
+        counts = counts.astype(np.int64)
+        # the page counts are exact: no error, and absent items did not occur
+        return self._combine(counts, pd.Series(0, index=counts.index, dtype=np.int64), 0, int(counts.sum()))
+
+    def merge(self, other):
+        return self._combine(other.counts, other.errors, other.min_count, other.rows)
+
+    def top(self, k=5):
+        """
+        @param k: number of items
+        @return: pandas.DataFrame with the item, its count upper bound, the maximum overestimation error and whether
+                 the item is guaranteed to be in the true top k (its lower bound beats the next item's upper bound)
+        """
+        counts = self.counts.sort_values(ascending=False, kind='stable')
+        errors = self.errors[counts.index]
+        top = pd.DataFrame({'item': counts.index[:k], 'count': counts.to_numpy()[:k], 'error': errors.to_numpy()[:k]})
+        following = int(counts.iloc[k]) if len(counts) > k else self.min_count
+        top['guaranteed'] = (top['count'] - top['error']) >= following
+        return top
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} capacity={self.capacity}, items={len(self.counts)}, rows={self.rows}>"
+
+
+class CountMinSketch:
+    def __init__(self, width=2048, depth=5):
+        """
+        @param width: counters per row, the overestimation is at most e * rows / width
+        @param depth: rows of counters, the bound holds with probability 1 - exp(-depth)
+        """
+        self.width = width
+        self.depth = depth
+        self.rows = 0
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _columns(self, items):
+        hashes = pd.util.hash_pandas_object(pd.Series(items), index=False, hash_key=HASH_KEY).to_numpy()
+        # double hashing: row i uses h1 + i * h2
+        h1, h2 = hashes & np.uint64(0xFFFFFFFF), (hashes >> np.uint64(32)) | np.uint64(1)
+        return [((h1 + np.uint64(i) * h2) % np.uint64(self.width)).astype(np.intp) for i in range(self.depth)]
+
+    def update(self, values):
+        """
+        @param values: pandas.Series (or array) of items, nulls are ignored
+        """
+        return self.add_counts(pd.Series(values).value_counts(dropna=True))
+
+    def add_counts(self, counts):
+        """
+        @param counts: pandas.Series item -> count
+        """
+        if len(counts):
+            weights = counts.to_numpy(dtype=np.int64)
+            for row, columns in enumerate(self._columns(counts.index.to_numpy())):
+                np.add.at(self.table[row], columns, weights)
+            self.rows += int(weights.sum())
+        return self
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Can not merge CountMinSketch of different width or depth')
+        self.table += other.table
+        self.rows += other.rows
+        return self
+
+    def estimate(self, items):
+        """
+        @param items: list of items
+        @return: numpy int64 array of the estimated frequencies, never below the true frequencies
+        """
+        columns = self._columns(np.asarray(items, dtype=object))
+        return np.min([self.table[row, cols] for row, cols in enumerate(columns)], axis=0)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} width={self.width}, depth={self.depth}, rows={self.rows}>"
+
+
+class HeavyHitters:
+    def __init__(self, columns, capacity=1000, count_min=None):
+        """
+        @param columns: columns tracked, e.g. ['zip_code', 'on_street_name', 'vehicle_type_code1']
+        @param capacity: SpaceSaving capacity per column
+        @param count_min: Optional: (width, depth) to also keep a CountMinSketch per column
+        """
+        self.columns = list(columns)
+        self.summaries = {col: SpaceSaving(capacity) for col in self.columns}
+        self.frequencies = {col: CountMinSketch(*count_min) for col in self.columns} if count_min else dict()
+        self._lock = threading.Lock()
+
+    def update(self, df):
+        """
+        Adds a page, safe to call from the threads of a downloader.
+        @param df: pandas.DataFrame or list of records
+        """
+        if not isinstance(df, pd.DataFrame):
+            df = pd.DataFrame.from_records(df)
+        counts = {col: df[col].value_counts(dropna=True) for col in self.columns if col in df.columns}
+        with self._lock:
+            for col, values in counts.items():
+                self.summaries[col].add_counts(values)
+                if col in self.frequencies:
+                    self.frequencies[col].add_counts(values)
+        return self
+
+    def on_page(self, url, records):
+        """Callback for api.checkpoint.CheckpointedDownloader(on_page=...), records is a page DataFrame."""
+        self.update(records)
+
+    def merge(self, other):
+        with self._lock:
+            for col, summary in other.summaries.items():
+                self.summaries.setdefault(col, SpaceSaving(summary.capacity)).merge(summary)
+            for col, sketch in other.frequencies.items():
+                if col in self.frequencies:
+                    self.frequencies[col].merge(sketch)
+        return self
+
+    def top(self, column, k=5):
+        """
+        @return: pandas.DataFrame with the column values, their count, error and guaranteed flag, see SpaceSaving.top
+        """
+        return self.summaries[column].top(k).rename(columns={'item': column})
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} columns={self.columns}>"
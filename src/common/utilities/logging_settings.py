@@ -1,121 +1,186 @@
-# import sys
-# import logging
-# from logging.config import dictConfig
-#
-# dummy = print({'dev': 1})
-#
-# print(type(dummy))
-# def initialize_logger(location, log_name):
-#
-#     location = r'\\Users\jordancarson\Projects'
-#
-#     logging_config = dict(
-#         version=1,
-#         formatters={
-#             'verbose': {
-#                 'format': ("[%(asctime)s] %(levelname)s "
-#                            "[%(name)s:%(lineno)s] %(message)s"),
-#                 'datefmt': "%d/%b/%Y %H:%M:%S",
-#             },
-#             'simple': {
-#                 'format': '%(levelname)s %(message)s',
-#             },
-#         },
-#         handlers={
-#             # 'api-logger': {'class': 'logging.handlers.RotatingFileHandler',
-#             #                'formatter': 'verbose',
-#             #                'level': logging.DEBUG,
-#             #                'filename': 'logs/api.log',
-#             #                'maxBytes': 52428800,
-#             #                'backupCount': 7},
-#             # 'batch-process-logger': {'class': 'logging.handlers.RotatingFileHandler',
-#             #                          'formatter': 'verbose',
-#             #                          'level': logging.DEBUG,
-#             #                          'filename': 'logs/batch.log',
-#             #                          'maxBytes': 52428800,
-#             #                          'backupCount': 7},
-#             # 'development-logger': {'class': 'logging.handlers.RotatingFileHandler',
-#             #                        'formatter': 'verbose',
-#             #                        'level': logging.DEBUG,
-#             #                        'filename': 'logs/development.log',
-#             #                        'maxBytes': 52428800,
-#             #                        'backupCount': 7},
-#             f'{log_name}-logger': {'class': 'logging.handlers.RotatingFileHandler',
-#                                    'formatter': 'verbose',
-#                                    'level': logging.DEBUG,
-#                                    'filename': f'logs/{log_name}.log', #{location}/
-#                                    'maxBytes': 52428800,
-#                                    'backupCount': 7},
-#             'console': {
-#                 'class': 'logging.StreamHandler',
-#                 'level': 'DEBUG',
-#                 'formatter': 'simple',
-#                 'stream': sys.stdout,
-#             },
-#         },
-#         loggers={
-#             # 'api_logger': {
-#             #     'handlers': ['api-logger', 'console'],
-#             #     'level': logging.DEBUG
-#             # },
-#             # 'batch_process_logger': {
-#             #     'handlers': ['batch-process-logger', 'console'],
-#             #     'level': logging.DEBUG
-#             # },
-#             # 'development_logger': {
-#             #     'handlers': ['development-logger', 'console'],
-#             #     'level': logging.DEBUG
-#             # },
-#             f'{log_name}_logger': {
-#                 'handlers': [f'{log_name}-logger', 'console'],
-#                 'level': logging.DEBUG
-#             },
-#
-#         }
-#     )
-#     dictConfig(logging_config)
-#
-#     logger = logging.getLogger(f'{log_name}_logger')
-#     return logger
-    # api_logger = logging.getLogger('api_logger')
-    # batch_process_logger = logging.getLogger('batch_process_logger')
-    # development_logger = logging.getLogger('development_logger')
+"""
+Non-blocking logging setup for the pipeline.
+
+Importing this module has no side effect. configure_logging() installs a single QueueHandler on the root logger: a
+log call in a hot loop (a fetched page, an inserted chunk) only puts the record on an in-memory queue, and a
+QueueListener thread does the formatting and the stderr / file I/O.
+
+    configure_logging(level='INFO', filename='logs/pipeline.log', json_format=True)
+    logger.info('Inserted chunk', extra=stage_fields('db.bulk_insert.chunk', rows=10000, duration_s=0.8,
+                                                     rate_limited=True))
+
+With json_format every record is one JSON object holding the STRUCTURED_FIELDS it was given, e.g.
+{"time": ..., "level": "INFO", "logger": ..., "message": "Inserted chunk", "stage": "db.bulk_insert.chunk",
+"rows": 10000, "duration_s": 0.8}. Records logged with rate_limited=True are sampled per stage by RateLimitFilter,
+at most `burst` of them every `interval` seconds, the next record that passes reports how many were suppressed.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s - %(message)s'
+DATE_FORMAT = '%m-%d %H:%M:%S'
+# fields of stage_fields, written as JSON keys and appended to the text messages
+STRUCTURED_FIELDS = ('stage', 'rows', 'nbytes', 'duration_s', 'suppressed')
+RATE_KEY = 'rate_key'
+
+_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+def stage_fields(stage, rows=None, nbytes=None, duration_s=None, rate_limited=False):
+    """
+    Builds the `extra` of a log call about a pipeline stage.
+    @param stage: stage name, e.g. the span name 'api.checkpoint.page'
+    @param rows: Optional: rows processed
+    @param nbytes: Optional: bytes processed
+    @param duration_s: Optional: duration of the stage in seconds
+    @param rate_limited: whether the record is sampled by RateLimitFilter, for per page / per chunk events
+    @return: dict
+    """
+    fields = {key: value for key, value in dict(stage=stage, rows=rows, nbytes=nbytes, duration_s=duration_s).items()
+              if value is not None}
+    if rate_limited:
+        fields[RATE_KEY] = stage
+    return fields
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most burst records per rate key every interval seconds, records without a rate key always pass.
+    Filtering happens in the calling thread before the record is queued, so suppressed records cost a dict lookup.
+    """
+    def __init__(self, burst=5, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, RATE_KEY, None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            start, passed, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, passed = now, 0
+            if passed >= self.burst:
+                self._windows[key] = (start, passed, suppressed + 1)
+                return False
+            self._windows[key] = (start, passed + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} burst={self.burst}, interval={self.interval}>"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the STRUCTURED_FIELDS set on the record."""
+    def format(self, record):
+        entry = dict(time=datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                     level=record.levelname, logger=record.name, message=record.getMessage())
+        for key in STRUCTURED_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """LOG_FORMAT followed by the STRUCTURED_FIELDS set on the record, e.g. `... - Inserted chunk rows=10000`."""
+    def format(self, record):
+        message = super().format(record)
+        fields = ' '.join(f'{key}={getattr(record, key)}' for key in STRUCTURED_FIELDS
+                          if getattr(record, key, None) is not None)
+        return f'{message} {fields}' if fields else message
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # unlike QueueHandler.prepare, the record is not formatted in the calling thread: only the arguments, which may
+        # be mutated once queued, are merged into the message and the rare exception rendered
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def configure_logging(level='INFO', filename=None, json_format=False, stream=sys.stderr, burst=5, interval=10.0,
+                      max_bytes=50 * 1024 * 1024, backup_count=7):
+    """
+    Routes the root logger through a queue to stream and file handlers run by a QueueListener thread. Calling it
+    again replaces the previous setup.
+    @param level: root logger level
+    @param filename: Optional: log file, appended to and rotated at max_bytes
+    @param json_format: one JSON object per line instead of LOG_FORMAT text
+    @param stream: Optional: stream handler target, None for a file only setup
+    @param burst: records per rate key and interval let through by RateLimitFilter
+    @param interval: seconds of a RateLimitFilter window
+    @param max_bytes: size of a log file before it is rotated
+    @param backup_count: rotated log files kept
+    @return: logging.handlers.QueueListener
+    """
+    global _listener, _handler
+
+    formatter = JsonFormatter() if json_format else TextFormatter(LOG_FORMAT, DATE_FORMAT)
+    handlers = list()
+    if stream is not None:
+        handlers.append(logging.StreamHandler(stream))
+    if filename:
+        handlers.append(logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count,
+                                                             encoding='utf-8', delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    with _lock:
+        _stop()
+        records = queue.SimpleQueue()
+        _handler = _QueueHandler(records)
+        _handler.addFilter(RateLimitFilter(burst, interval))
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+    return _listener
+
+
+def _stop():
+    global _listener, _handler
+
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        # flushes the queued records
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def stop_logging():
+    """Flushes the queued records and removes the handlers installed by configure_logging."""
+    with _lock:
+        _stop()
+
 
-logformat = "%(asctime)s %(levelname)s %(module)s - %(funcName)s: %(message)s"
-datefmt = "%m-%d %H:%M"
-
-logging.basicConfig(filename="app.log", level=logging.INFO, filemode="w",
-                    format=logformat, datefmt=datefmt)
-
-stream_handler = logging.StreamHandler(sys.stderr)
-stream_handler.setFormatter(logging.Formatter(fmt=logformat, datefmt=datefmt))
-
-logger = logging.getLogger("app")
-logger.addHandler(stream_handler)
-
-logger.info("information")
-logger.warning("warning")
-
-
-def fun():
-    logger.info(" fun inf")
-    logger.warning("fun warn")
-
-if __name__ == "__main__":
-    fun()
-# initialize_logger('', 'examplelog2')
-#
-# logging.info('Log One')
-# logging.info('Log Second')
-# logging.info('Log One')
-# logging.info('Log Second')
-# logging.info('Log One')
-# logging.info('Log Second')
-# logging.info('Log One')
-# logging.info('Log Second')
-# logging.info('Log One')
-# logging.info('Log Second')
-# logging.info('Log One')
-# logging.info('Log Second')
\ No newline at end of file
+atexit.register(stop_logging)
@@ -0,0 +1,211 @@
+"""
+In-process timing and throughput metrics.
+
+Stages are measured with `span` (context manager) or `timed` (decorator). Every span records its duration with
+time.perf_counter_ns, the number of rows and bytes it processed and, when tracemalloc is tracing, its memory delta,
+into a histogram per span name held by a MetricsRegistry. The registry can be exported as JSON or in the Prometheus
+text exposition format.
+
+    with span('api.page', rows=len(df), nbytes=len(payload)):
+        ...
+"""
+import json
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from functools import wraps
+
+# histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class SpanStats:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.duration_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.rows = 0
+        self.bytes = 0
+        self.memory_delta = 0
+
+    def add(self, duration_ns, rows=None, nbytes=None, memory_delta=None, error=False):
+        self.bucket_counts[bisect_left(self.buckets, duration_ns / 1e9)] += 1
+        self.count += 1
+        self.errors += int(error)
+        self.duration_ns += duration_ns
+        self.min_ns = duration_ns if self.min_ns is None else min(self.min_ns, duration_ns)
+        self.max_ns = duration_ns if self.max_ns is None else max(self.max_ns, duration_ns)
+        self.rows += rows or 0
+        self.bytes += nbytes or 0
+        self.memory_delta += memory_delta or 0
+
+    def to_dict(self):
+        seconds = self.duration_ns / 1e9
+        return dict(
+            count=self.count,
+            errors=self.errors,
+            total_s=seconds,
+            mean_ms=(self.duration_ns / self.count / 1e6) if self.count else 0.0,
+            min_ms=(self.min_ns or 0) / 1e6,
+            max_ms=(self.max_ns or 0) / 1e6,
+            rows=self.rows,
+            bytes=self.bytes,
+            memory_delta=self.memory_delta,
+            rows_per_s=(self.rows / seconds) if seconds else 0.0,
+            bytes_per_s=(self.bytes / seconds) if seconds else 0.0,
+            buckets={('+Inf' if i == len(self.buckets) else str(self.buckets[i])): n
+                     for i, n in enumerate(self.bucket_counts)},
+        )
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._spans = dict()
+        self._lock = threading.Lock()
+
+    def record(self, name, duration_ns, rows=None, nbytes=None, memory_delta=None, error=False):
+        """
+        Adds one observation to the histogram of span name.
+        @param name: span name, e.g. 'api.page' or 'db.bulk_insert'
+        @param duration_ns: duration in nanoseconds
+        @param rows: Optional: rows processed
+        @param nbytes: Optional: bytes transferred or processed
+        @param memory_delta: Optional: traced memory difference in bytes
+        @param error: whether the span ended with an exception
+        """
+        with self._lock:
+            if name not in self._spans:
+                self._spans[name] = SpanStats(self.buckets)
+            self._spans[name].add(duration_ns, rows, nbytes, memory_delta, error)
+
+    def get(self, name):
+        with self._lock:
+            stats = self._spans.get(name)
+            return stats.to_dict() if stats else None
+
+    def reset(self):
+        with self._lock:
+            self._spans = dict()
+
+    def to_dict(self):
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in sorted(self._spans.items())}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix='nyc_open_data'):
+        """
+        Returns the registry in the Prometheus text exposition format, one labelled family per measure.
+        @param prefix: metric name prefix
+        @return: str
+        """
+        lines = [
+            f'# HELP {prefix}_span_duration_seconds Duration of instrumented spans.',
+            f'# TYPE {prefix}_span_duration_seconds histogram',
+        ]
+        totals = {'rows': list(), 'bytes': list(), 'errors': list()}
+        for name, stats in self.to_dict().items():
+            label = f'span="{name}"'
+            cumulative = 0
+            for bound, count in stats['buckets'].items():
+                cumulative += count
+                lines.append(f'{prefix}_span_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_span_duration_seconds_sum{{{label}}} {stats["total_s"]}')
+            lines.append(f'{prefix}_span_duration_seconds_count{{{label}}} {stats["count"]}')
+            for measure in totals:
+                totals[measure].append(f'{prefix}_span_{measure}_total{{{label}}} {stats[measure]}')
+
+        for measure, samples in totals.items():
+            lines.append(f'# HELP {prefix}_span_{measure}_total Total {measure} of instrumented spans.')
+            lines.append(f'# TYPE {prefix}_span_{measure}_total counter')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Span:
+    """
+    Context manager measuring one execution of a stage. rows and nbytes can be given upfront or set/added while the
+    span is open, e.g. once the size of a response is known.
+    """
+    def __init__(self, name, rows=None, nbytes=None, registry=None):
+        self.name = name
+        self.rows = rows
+        self.nbytes = nbytes
+        self.registry = registry or REGISTRY
+        self.duration_ns = None
+        self._start = None
+        self._memory = None
+
+    def add(self, rows=None, nbytes=None):
+        if rows:
+            self.rows = (self.rows or 0) + rows
+        if nbytes:
+            self.nbytes = (self.nbytes or 0) + nbytes
+        return self
+
+    @property
+    def elapsed_s(self):
+        end = self._start + self.duration_ns if self.duration_ns is not None else time.perf_counter_ns()
+        return (end - self._start) / 1e9
+
+    def __enter__(self):
+        self._memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.duration_ns = time.perf_counter_ns() - self._start
+        memory_delta = None
+        if self._memory is not None and tracemalloc.is_tracing():
+            memory_delta = tracemalloc.get_traced_memory()[0] - self._memory
+        self.registry.record(self.name, self.duration_ns, self.rows, self.nbytes, memory_delta, exc_type is not None)
+        return False
+
+
+def span(name, rows=None, nbytes=None, registry=None):
+    """
+    Returns a Span context manager recording into registry (default: the module REGISTRY).
+    @param name: span name
+    @param rows: Optional: rows processed
+    @param nbytes: Optional: bytes transferred or processed
+    @param registry: Optional: MetricsRegistry
+    @return: Span
+    """
+    return Span(name, rows=rows, nbytes=nbytes, registry=registry)
+
+
+def timed(name=None, rows=None, nbytes=None, registry=None):
+    """
+    Decorator recording every call of the decorated function as a span.
+    @param name: Optional: span name, defaults to module.qualname of the function
+    @param rows: Optional: callable receiving the result and returning the number of rows, e.g. len
+    @param nbytes: Optional: callable receiving the result and returning the number of bytes
+    @param registry: Optional: MetricsRegistry
+    @return: decorated function
+    """
+    def deco(func):
+        span_name = name or f'{func.__module__}.{func.__qualname__}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, registry=registry) as s:
+                result = func(*args, **kwargs)
+                s.add(rows=rows(result) if rows else None, nbytes=nbytes(result) if nbytes else None)
+            return result
+        return wrapper
+
+    if callable(name):
+        # used as @timed without arguments
+        func, name = name, None
+        return deco(func)
+    return deco
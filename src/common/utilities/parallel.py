@@ -1,21 +1,48 @@
-from concurrent.futures import ThreadPoolExecutor
+import importlib
 from functools import wraps
+from .executors import BoundedExecutor, get_executor
 
-_DEFAULT_POOL = ThreadPoolExecutor()
 
+def _resolve_executor(executor):
+    return get_executor(executor or 'io') if executor is None or isinstance(executor, str) else executor
 
-def parallel_task(func, executor=None):
+
+def _is_process_pool(executor):
+    from concurrent.futures import ProcessPoolExecutor
+
+    inner = executor.executor if isinstance(executor, BoundedExecutor) else executor
+    return isinstance(inner, ProcessPoolExecutor)
+
+
+def _call_wrapped(module, qualname, *args, **kwargs):
+    # the module attribute is the decorated wrapper, workers call the original function behind it
+    target = importlib.import_module(module)
+    for attr in qualname.split('.'):
+        target = getattr(target, attr)
+    return target.__wrapped__(*args, **kwargs)
+
+
+def parallel_task(func=None, executor=None):
     """
     Decorator designed to parallelize any method invocation. We use this by writing @parallel_task before any
     method declaration, and it will be called in parallel without blocking the main thread.
 
     To fetch the result of this Future Objet, one has to call Future.result(), which will block the main thread until
     the result is fetched.
+
+    Can be used as @parallel_task, @parallel_task(executor='cpu') or @parallel_task(executor=my_pool).
     @param func: function or method to be called in parallel
-    @param executor: Optional ThreadPoolExecutor
+    @param executor: Optional: name of a common.utilities.executors pool ('io' by default, 'cpu') or an Executor
     @return: Returns a concurrent.futures.Future instance
     """
+    if func is None:
+        return lambda f: parallel_task(f, executor=executor)
+
     @wraps(func)
     def wrap(*args, **kwargs):
-        return (executor or _DEFAULT_POOL).submit(func, *args, **kwargs)
+        pool = _resolve_executor(executor)
+        if _is_process_pool(pool):
+            # the decorated function can not be pickled by reference, send its import path instead
+            return pool.submit(_call_wrapped, func.__module__, func.__qualname__, *args, **kwargs)
+        return pool.submit(func, *args, **kwargs)
     return wrap
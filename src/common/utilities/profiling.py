@@ -0,0 +1,373 @@
+"""
+One-pass, mergeable column profiles.
+
+Every column is summarized by small sketches that are updated chunk by chunk and can be merged, so the full dataset
+can be profiled out-of-core (Parquet row batches) and in parallel (one profile per file or partition, merged after):
+    - rows and nulls
+    - approximate distinct count: HyperLogLog with Ertl's improved estimator, ~0.8% standard error (1.04 / sqrt(2^p))
+      with the default 2^14 registers, over the whole range of cardinalities
+    - min / max, mean / std: Welford's moments, merged with Chan's parallel formula
+    - approximate quantiles: KLL sketch, rank error ~1.5% with the default k=200
+
+    profile = Profile()
+    for chunk in chunks:
+        profile.update(chunk)
+    profile.merge(other_profile).to_frame()
+
+    profile_parquet(['.data/partitions/crashes/2012-07_2013-01.parquet', ...], executor='cpu').to_frame()
+
+Profiles are plain Python / numpy objects, they can be pickled to and from worker processes.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+# fixed so that the distinct counts of profiles built in different processes can be merged
+HASH_KEY = '5f3759df1badcafe'
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+def hash_values(values):
+    """
+    @param values: pandas.Series without nulls
+    @return: numpy uint64 array, one hash per value
+    """
+    return pd.util.hash_pandas_object(values, index=False, hash_key=HASH_KEY).to_numpy()
+
+
+def _sigma(x):
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous, z = z, z + x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x in (0, 1):
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        y *= 0.5
+        previous, z = z, z - (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class HyperLogLog:
+    def __init__(self, p=14):
+        """
+        @param p: 2^p registers of one byte each, standard error 1.04 / sqrt(2^p)
+        """
+        if not 4 <= p <= 18:
+            raise ValueError(f'Expected 4 <= p <= 18, got={p}')
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def update(self, hashes):
+        """
+        @param hashes: numpy uint64 array
+        """
+        if not len(hashes):
+            return self
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # the exponent of frexp is the bit length, exact since rest has less than 53 bits
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError(f'Can not merge HyperLogLog sketches with p={self.p} and p={other.p}')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(1 << self.p)
+
+    def estimate(self):
+        # improved raw estimator of Ertl (2017), computed from the histogram of the register values: unlike the raw
+        # HyperLogLog estimate with its switch to linear counting, it has no bias bump around 2.5 * m and needs no
+        # empirical bias tables, the relative error stays within standard_error over the whole range
+        m, q = len(self.registers), 64 - self.p
+        histogram = np.bincount(self.registers, minlength=q + 2).astype(np.float64)
+        z = m * _tau(1 - histogram[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += m * _sigma(histogram[0] / m)
+        return int(round(m * m / (2 * math.log(2) * z)))
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} p={self.p}, estimate={self.estimate()}>"
+
+
+class Moments:
+    """Count, mean, sum of squared deviations, min and max, updated with Welford / Chan's parallel algorithm."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def _combine(self, count, mean, m2, low, high):
+        if not count:
+            return self
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        return self
+
+    def update(self, values):
+        """
+        @param values: numpy float array without NaN
+        """
+        if not len(values):
+            return self
+        mean = float(values.mean())
+        return self._combine(len(values), mean, float(((values - mean) ** 2).sum()), float(values.min()),
+                             float(values.max()))
+
+    def merge(self, other):
+        return self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    @property
+    def std(self):
+        # sample standard deviation, as pandas.DataFrame.describe
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float('nan')
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} count={self.count}, mean={self.mean}, std={self.std}>"
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch: level h holds items of weight 2^h, a full level is sorted and every other item, from a random
+    offset, is promoted to the next level. Capacities shrink by c for lower levels, the sketch keeps O(k) items.
+    """
+    def __init__(self, k=200, c=2 / 3, seed=None):
+        self.k = k
+        self.c = c
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * self.c ** depth)))
+
+    def _compress(self):
+        while sum(len(items) for items in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            level = next(h for h, items in enumerate(self.levels) if len(items) >= self._capacity(h))
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            # an odd item stays behind, the others are halved into the next level
+            keep, items = (items[:1], items[1:]) if len(items) % 2 else (items[:0], items)
+            promoted = items[self._rng.integers(0, 2)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def update(self, values):
+        """
+        @param values: numpy float array without NaN
+        """
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype=np.float64)])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+        return self
+
+    def quantiles(self, qs=QUANTILES):
+        """
+        @param qs: quantiles between 0 and 1
+        @return: list of approximate quantiles, NaN if the sketch is empty
+        """
+        items = np.concatenate(self.levels)
+        if not len(items):
+            return [float('nan')] * len(qs)
+        weights = np.concatenate([np.full(len(level_items), 1 << level)
+                                  for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return [float(items[min(position, len(items) - 1)]) for position in positions]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} k={self.k}, items={sum(len(items) for items in self.levels)}>"
+
+
+class ColumnProfile:
+    def __init__(self, name, p=14, k=200):
+        """
+        @param name: column name
+        @param p: HyperLogLog precision
+        @param k: KLL sketch size
+        """
+        self.name = name
+        self.rows = 0
+        self.nulls = 0
+        self.numeric = None
+        self.distinct = HyperLogLog(p)
+        self.moments = Moments()
+        self.sketch = KLLSketch(k)
+
+    def update(self, values):
+        """
+        @param values: pandas.Series, numeric and boolean columns also get moments and quantiles
+        """
+        self.rows += len(values)
+        numeric = pd.api.types.is_numeric_dtype(values)
+        self.numeric = numeric if self.numeric is None else self.numeric and numeric
+        if numeric:
+            # always hashed as float64, so that chunks parsed as int and as float count the same distinct values
+            numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            numbers = numbers[~np.isnan(numbers)]
+            self.nulls += len(values) - len(numbers)
+            self.distinct.update(hash_values(pd.Series(numbers)))
+            self.moments.update(numbers)
+            self.sketch.update(numbers)
+        else:
+            # HyperLogLog ignores repeated values, only the distinct values of the chunk are hashed
+            codes, uniques = pd.factorize(values)
+            self.nulls += int(np.count_nonzero(codes == -1))
+            self.distinct.update(hash_values(pd.Series(uniques)))
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        if other.numeric is not None:
+            self.numeric = other.numeric if self.numeric is None else self.numeric and other.numeric
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def to_dict(self):
+        distinct = min(self.distinct.estimate(), self.rows - self.nulls)
+        stats = dict(count=self.rows - self.nulls, nulls=self.nulls, distinct=distinct,
+                     cardinality=distinct / self.rows if self.rows else float('nan'))
+        if self.numeric and self.moments.count:
+            q1, median, q3 = self.sketch.quantiles(QUANTILES)
+            mean, std = self.moments.mean, self.moments.std
+            stats.update({'mean': mean, 'std': std, 'cv': std / mean if mean else float('nan'), 'min': self.moments.min,
+                          '25%': q1, '50%': median, '75%': q3, 'max': self.moments.max, 'iqr': q3 - q1})
+        return stats
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} name={self.name}, rows={self.rows}, nulls={self.nulls}>"
+
+
+STATS_INDEX = ['count', 'nulls', 'distinct', 'cardinality', 'mean', 'std', 'cv', 'min', '25%', '50%', '75%', 'max',
+               'iqr']
+
+
+class Profile:
+    def __init__(self, columns=None, p=14, k=200):
+        """
+        @param columns: Optional: columns to profile, defaults to every column seen
+        @param p: HyperLogLog precision
+        @param k: KLL sketch size
+        """
+        self.columns = None if columns is None else list(columns)
+        self.p = p
+        self.k = k
+        self.profiles = dict()
+
+    def _profile(self, name):
+        if name not in self.profiles:
+            self.profiles[name] = ColumnProfile(name, self.p, self.k)
+        return self.profiles[name]
+
+    def update(self, df):
+        """
+        Adds a chunk of rows.
+        @param df: pandas.DataFrame
+        """
+        for col in (df.columns if self.columns is None else self.columns):
+            if col in df.columns:
+                self._profile(col).update(df[col])
+            else:
+                # Socrata leaves out fields that are null in every row of a page
+                self._profile(col).update(pd.Series(np.nan, index=df.index, dtype=object))
+        return self
+
+    def merge(self, other):
+        for name, profile in other.profiles.items():
+            self._profile(name).merge(profile)
+        return self
+
+    def to_frame(self):
+        """
+        @return: pandas.DataFrame with one column per profiled column and the STATS_INDEX rows, like describe()
+        """
+        return pd.DataFrame({name: profile.to_dict() for name, profile in self.profiles.items()}).reindex(STATS_INDEX)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} columns={len(self.profiles)}>"
+
+
+def profile_frame(df, columns=None, chunk_size=1_000_000):
+    """
+    Profiles an in-memory DataFrame chunk by chunk, so that the temporary arrays stay small.
+    @return: Profile
+    """
+    profile = Profile(columns)
+    for start in range(0, len(df), chunk_size):
+        profile.update(df.iloc[start:start + chunk_size])
+    return profile
+
+
+def _profile_file(path, columns=None, batch_size=500_000):
+    import pyarrow.parquet as pq
+
+    profile = Profile(columns)
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        profile.update(batch.to_pandas())
+    return profile
+
+
+def profile_parquet(paths, columns=None, batch_size=500_000, executor=None):
+    """
+    Profiles Parquet files out-of-core, batch by batch, one file per task when an executor is given.
+    @param paths: path or list of paths, e.g. the partition files of api.partitions.PartitionedFetcher
+    @param columns: Optional: columns to profile
+    @param batch_size: rows per batch
+    @param executor: Optional: name of a common.utilities.executors pool ('cpu') or an Executor
+    @return: Profile merged over every file
+    """
+    from .executors import get_executor
+
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    if executor is None:
+        profiles = [_profile_file(path, columns, batch_size) for path in paths]
+    else:
+        pool = get_executor(executor) if isinstance(executor, str) else executor
+        profiles = [future.result() for future in
+                    [pool.submit(_profile_file, path, columns, batch_size) for path in paths]]
+
+    profile = Profile(columns)
+    for other in profiles:
+        profile.merge(other)
+    return profile
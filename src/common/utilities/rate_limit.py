@@ -0,0 +1,124 @@
+"""
+Client side rate limiting shared by the thread pool and asyncio fetchers.
+
+TokenBucket hands out reservations under a threading.Lock: a caller takes its token(s) immediately, possibly driving
+the bucket negative, and sleeps for the time it takes the bucket to refill to zero. Threads sleep with time.sleep,
+coroutines with asyncio.sleep, so both kinds of workers can share one bucket without busy waiting.
+
+The rate adapts AIMD style: every successful request adds `increase` requests/second up to max_rate, every 429
+multiplies the rate by `decrease` and, if the server sent a Retry-After, pauses the bucket for that long.
+"""
+import threading
+import time
+
+from .metrics import REGISTRY
+
+
+class TokenBucket:
+    def __init__(self, rate=5.0, capacity=None, min_rate=0.5, max_rate=50.0, increase=0.05, decrease=0.5,
+                 name='default'):
+        """
+        @param rate: initial requests per second
+        @param capacity: Optional: burst size, defaults to max(1, rate)
+        @param min_rate: rate floor after repeated throttling
+        @param max_rate: rate ceiling reached by additive increase
+        @param increase: requests/second added after every successful request
+        @param decrease: factor applied to the rate after a throttled request
+        @param name: used for the wait time metric `rate_limit.<name>.wait`
+        """
+        if rate <= 0 or min_rate <= 0 or min_rate > max_rate:
+            raise ValueError(f'Expected 0 < min_rate <= max_rate and rate > 0, got rate={rate}, '
+                             f'min_rate={min_rate}, max_rate={max_rate}')
+
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.capacity = capacity or max(1.0, rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.name = name
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket.
+        @param tokens: number of tokens (requests)
+        @return: seconds the caller has to wait before using its reservation
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def _record_wait(self, wait):
+        REGISTRY.record(f'rate_limit.{self.name}.wait', int(wait * 1e9))
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        self._record_wait(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        import asyncio
+
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        self._record_wait(wait)
+        return wait
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        """
+        Slows the bucket down after a 429 response.
+        @param retry_after: Optional: seconds the server asked us to wait
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            if retry_after:
+                # nobody gets a token before retry_after seconds have passed
+                self._tokens = min(self._tokens, -retry_after * self.rate)
+
+    def update(self, status, retry_after=None):
+        """
+        Feeds a response status back into the bucket.
+        @param status: HTTP status code
+        @param retry_after: Optional: parsed Retry-After header
+        """
+        if status == 429:
+            self.on_throttle(retry_after)
+        elif status < 400:
+            self.on_success()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} name={self.name}, rate={self.rate:.2f}/s, capacity={self.capacity}>"
+
+
+_LIMITERS = dict()
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(name='socrata', **kwargs):
+    """
+    Returns the process wide TokenBucket registered under name, creating it with kwargs on first use.
+    @param name: limiter name, e.g. one per API host
+    @param kwargs: TokenBucket arguments, only used when the limiter is created
+    @return: TokenBucket
+    """
+    with _LIMITERS_LOCK:
+        if name not in _LIMITERS:
+            _LIMITERS[name] = TokenBucket(name=name, **kwargs)
+        return _LIMITERS[name]
@@ -0,0 +1,320 @@
+"""
+Retry subsystem for the API fetchers, usable on both sync functions and asyncio coroutines.
+
+- full-jitter exponential backoff: sleep uniform(0, min(cap, base * 2 ** attempt)) so workers do not retry in lockstep
+- Retry-After: a RetryableHTTPError carrying the header value (429/503) is honoured before the jittered backoff
+- RetryBudget: retries shared by all workers are capped to a ratio of the recent requests
+- CircuitBreaker: after repeated failures every caller is paused until the service had time to recover
+- FETCH_RETRY_BUDGET / FETCH_CIRCUIT_BREAKER: the budget and breaker shared by every fetcher of the Socrata API
+
+Coroutines are retried with asyncio.sleep, so a throttled request never blocks the event loop.
+"""
+import collections
+import inspect
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import wraps
+
+from .metrics import REGISTRY
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableHTTPError(Exception):
+    def __init__(self, status, url=None, retry_after=None):
+        super().__init__(f'HTTP {status} for url={url}')
+        self.status = status
+        self.url = url
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryBudgetExhausted(Exception):
+    pass
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header, given either as delay seconds or as an HTTP date.
+    @param value: header value or None
+    @return: seconds to wait as float, or None
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def raise_for_retry_status(status, headers, url=None):
+    """
+    Raises RetryableHTTPError for throttling / transient server statuses, carrying the Retry-After delay.
+    @param status: HTTP status code
+    @param headers: response headers mapping
+    @param url: Optional: requested url, for the error message
+    """
+    if status in RETRY_STATUS_CODES:
+        raise RetryableHTTPError(status, url=url, retry_after=parse_retry_after(headers.get('Retry-After')))
+
+
+def full_jitter(attempt, base=0.5, cap=30.0):
+    """
+    Returns the full-jitter exponential backoff delay for a zero based attempt number.
+    @param attempt: number of failed attempts so far minus one
+    @param base: delay of the first retry window in seconds
+    @param cap: maximum window in seconds
+    @return: seconds to wait
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryBudget:
+    """
+    Caps retries to `ratio` of the requests seen in the last `window` seconds, plus `min_retries` so that a quiet
+    fetcher can still retry. Shared by threads and tasks, the state is protected by a lock and never awaited on.
+    """
+    def __init__(self, ratio=0.2, min_retries=10, window=10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_acquire(self):
+        """
+        @return: True and records a retry if the budget allows one, False otherwise
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ratio={self.ratio}, min_retries={self.min_retries}, window={self.window}>"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, callers wait (or fail with CircuitOpenError
+    when block=False) until `reset_timeout` seconds have passed, then a single trial call is let through (half-open):
+    its success closes the circuit, its failure opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, block=True):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.block = block
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """
+        @return: 0 if the call can proceed, otherwise seconds to wait before asking again
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return 0
+            return max(remaining, 0.05)
+
+    def before_call(self):
+        while True:
+            wait = self._acquire()
+            if not wait:
+                return
+            if not self.block:
+                raise CircuitOpenError(f'Circuit open, retry in {wait:.1f} seconds')
+            time.sleep(wait)
+
+    async def before_call_async(self):
+        import asyncio
+
+        while True:
+            wait = self._acquire()
+            if not wait:
+                return
+            if not self.block:
+                raise CircuitOpenError(f'Circuit open, retry in {wait:.1f} seconds')
+            await asyncio.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def release(self):
+        """
+        Lets the next caller run the half-open trial, used when a call ends with an error unrelated to the service.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f'Circuit opened after {self._failures} failures')
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} state={self.state}, failures={self._failures}>"
+
+
+# shared by every fetcher of the Socrata API, thread pools and asyncio tasks alike, so that a throttled or failing API
+# slows down the whole ingestion rather than each worker retrying on its own
+FETCH_RETRY_BUDGET = RetryBudget()
+FETCH_CIRCUIT_BREAKER = CircuitBreaker()
+
+
+class _Attempts:
+    """Shared bookkeeping of one retried call, used by both the sync and the async wrapper."""
+    def __init__(self, name, tries, base, cap, budget, breaker):
+        self.name = name
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.breaker = breaker
+        self.attempt = 0
+
+    def started(self):
+        self.attempt += 1
+        if self.budget:
+            self.budget.record_request()
+
+    def succeeded(self):
+        if self.breaker:
+            self.breaker.record_success()
+
+    def aborted(self):
+        if self.breaker:
+            self.breaker.release()
+
+    def failed(self, err):
+        """
+        @return: seconds to wait before the next attempt, raises if the call must not be retried
+        """
+        if self.breaker:
+            self.breaker.record_failure()
+        if self.attempt >= self.tries:
+            raise err
+        if self.budget and not self.budget.try_acquire():
+            raise RetryBudgetExhausted(f'Retry budget exhausted for {self.name}') from err
+
+        delay = full_jitter(self.attempt - 1, self.base, self.cap)
+        retry_after = getattr(err, 'retry_after', None)
+        if retry_after is not None:
+            # the server told us when to come back, the jitter on top spreads the workers that got the same answer
+            delay = min(retry_after, self.cap * 10) + random.uniform(0, self.base)
+
+        REGISTRY.record(f'retry.{self.name}', int(delay * 1e9), error=True)
+        logger.warning(f'{err.__class__.__name__} - {err} - attempt {self.attempt}/{self.tries}, '
+                       f'retrying in {delay:.2f} seconds.')
+        return delay
+
+
+def retry_backoff(exceptions=(RetryableHTTPError, ConnectionError, TimeoutError), tries=5, base=0.5, cap=30.0,
+                  budget=None, breaker=None):
+    """
+    Retry decorator with full-jitter exponential backoff for functions and coroutines.
+    @param exceptions: exception class or tuple of classes that trigger a retry
+    @param tries: maximum number of attempts, including the first one
+    @param base: backoff base in seconds
+    @param cap: maximum backoff window in seconds
+    @param budget: Optional: RetryBudget shared by concurrent workers
+    @param breaker: Optional: CircuitBreaker shared by concurrent workers
+    @return: decorator
+    """
+    if tries < 1:
+        raise ValueError(f'Expected tries >= 1, got={tries}')
+
+    def deco(func):
+        name = func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                import asyncio
+
+                attempts = _Attempts(name, tries, base, cap, budget, breaker)
+                while True:
+                    if breaker:
+                        await breaker.before_call_async()
+                    attempts.started()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except exceptions as err:
+                        await asyncio.sleep(attempts.failed(err))
+                    except BaseException:
+                        attempts.aborted()
+                        raise
+                    else:
+                        attempts.succeeded()
+                        return result
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            attempts = _Attempts(name, tries, base, cap, budget, breaker)
+            while True:
+                if breaker:
+                    breaker.before_call()
+                attempts.started()
+                try:
+                    result = func(*args, **kwargs)
+                except exceptions as err:
+                    time.sleep(attempts.failed(err))
+                except BaseException:
+                    attempts.aborted()
+                    raise
+                else:
+                    attempts.succeeded()
+                    return result
+        return wrapper
+
+    return deco
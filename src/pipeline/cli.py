@@ -0,0 +1,263 @@
+"""
+Command line entry point of the pipeline, so that the ingestion, blending, loading and profiling paths can be run and
+timed headless, e.g. on a server or from cron:
+
+    cd src
+    python -m pipeline fetch --mode incremental --since 2021-09-01 --output ../.data/crashes.parquet
+    python -m pipeline fetch --dataset persons --output ../.data/persons.parquet
+    python -m pipeline blend --input ../.data/crashes.parquet --output ../.data/blended.parquet --executor process
+    python -m pipeline load --input ../.data/blended.parquet --sink db --table crashes --chunk-size 20000
+    python -m pipeline profile --input ../.data/partitions/crashes --executor process
+
+Every command records its stages as common.utilities.metrics spans and prints a throughput summary (rows, bytes,
+rows/s and MB/s per stage) when it ends, --metrics also writes the full registry as JSON.
+"""
+import argparse
+import glob
+import logging
+import os
+import time
+from datetime import date
+
+from api.config import API_LIMIT, ROOT
+from api.datasets import DATASETS, get_dataset
+from common.utilities.executors import MANAGER, get_executor
+from common.utilities.logging_settings import configure_logging, stop_logging
+from common.utilities.metrics import REGISTRY, span
+
+DATA_DIR = ROOT / '.data'
+STORE = DATA_DIR / 'crashes.parquet'
+EXECUTORS = ('serial', 'thread', 'process')
+SINKS = ('parquet', 'snapshot', 'csv', 'db')
+SINK_EXTENSIONS = {'parquet': '.parquet', 'snapshot': '.feather', 'csv': '.csv'}
+# pool sized by --workers for the cpu bound commands
+POOL = 'cli'
+
+logger = logging.getLogger(__name__)
+
+
+def _executor(args):
+    """
+    @return: BoundedExecutor of the --executor kind with --workers workers, None for serial
+    """
+    if args.executor == 'serial':
+        return None
+    MANAGER.register(POOL, kind=args.executor, workers=args.workers)
+    return get_executor(POOL)
+
+
+def _input_paths(path):
+    # a directory stands for its Parquet files, e.g. the partitions of a PartitionedFetcher
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.parquet')))
+    return [path]
+
+
+def _cache_dir(args):
+    return args.cache_dir or str(DATA_DIR / 'partitions' / args.dataset)
+
+
+def _fetcher(args):
+    from api.partitions import PartitionedFetcher
+
+    if args.workers:
+        # the io pool is created on first use, its size can still be changed here
+        MANAGER.register('io', kind='thread', workers=args.workers)
+    return PartitionedFetcher(_cache_dir(args), endpoint=args.endpoint, target_rows=args.target_rows,
+                              limit=args.page_size, auth=False if args.anonymous else None, dataset=args.dataset)
+
+
+def fetch(args):
+    """Pulls the stale (incremental) or every (full) partition, then optionally syncs them into the store."""
+    fetcher = _fetcher(args)
+    with span('cli.fetch') as s:
+        fetched = fetcher.fetch(refresh_since=args.since, refresh_all=args.mode == 'full')
+        s.add(rows=sum(fetcher.state[partition.key]['fetched_rows'] for partition in fetched))
+    logger.info(f'Fetched {len(fetched)} {args.dataset} partitions into {_cache_dir(args)}')
+
+    if args.output:
+        from common.query.rollups import RollupStore
+
+        rollups = RollupStore(args.rollups) if args.rollups else None
+        with span('cli.sync') as s:
+            changes = fetcher.sync(args.output, rollups=rollups)
+            s.add(rows=sum(changes.counts().values()))
+        logger.info(f'Synced {args.output}: {changes}')
+
+
+def _validate_chunk(df):
+    # module level, so that it can be pickled to process pool workers
+    from common.data_blend.validation import validate
+
+    result = validate(df)
+    return result.valid, result.quarantined, result.counts
+
+
+def blend(args):
+    """Validates the store chunk by chunk on the executor, normalizes the valid rows and writes them."""
+    import pandas as pd
+    from api.checkpoint import read_store, write_store
+    from common.data_blend.normalize import normalize_frame
+
+    with span('cli.blend.read') as s:
+        df = read_store(args.input)
+        s.add(rows=len(df), nbytes=os.path.getsize(args.input))
+
+    pool = _executor(args)
+    chunks = (df.iloc[start:start + args.chunk_size] for start in range(0, len(df), args.chunk_size))
+    with span('cli.blend.validate', rows=len(df)):
+        results = list(pool.map_batched(_validate_chunk, chunks) if pool else map(_validate_chunk, chunks))
+    valid = pd.concat([result[0] for result in results], ignore_index=True) if results else df
+    quarantined = [result[1] for result in results if len(result[1])]
+    counts = {name: sum(result[2][name] for result in results) for name in (results[0][2] if results else ())}
+    logger.info(f'{len(df) - len(valid)}/{len(df)} rows quarantined, failing rows per rule: '
+                f'{ {name: n for name, n in counts.items() if n} }')
+
+    with span('cli.blend.normalize', rows=len(valid)):
+        valid, _ = normalize_frame(valid, inplace=True)
+    with span('cli.blend.write', rows=len(valid)) as s:
+        write_store(valid, args.output)
+        if args.quarantine and quarantined:
+            write_store(pd.concat(quarantined, ignore_index=True), args.quarantine)
+        s.add(nbytes=os.path.getsize(args.output))
+
+
+def load(args):
+    """Writes the store to a file sink, or bulk inserts it into the database chunk by chunk."""
+    from api.checkpoint import read_store, write_store
+
+    with span('cli.load.read') as s:
+        df = read_store(args.input)
+        s.add(rows=len(df), nbytes=os.path.getsize(args.input))
+
+    if args.sink == 'db':
+        from common.db_utilities.db_utilities import bulk_insert, primary_key_types
+
+        conn_str = args.conn_str or os.getenv('NYC_DB_CONN_STR')
+        if not conn_str:
+            raise ValueError('The db sink needs --conn-str or the NYC_DB_CONN_STR environment variable')
+        dataset = get_dataset(args.dataset)
+        # the create table query of a new table takes (name, sql type) tuples, typed from the frame
+        primary_keys = primary_key_types(df, args.primary_keys or [dataset.key])
+        bulk_insert(df, conn_str, args.schema, args.table or dataset.name, chunks=args.chunk_size,
+                    primary_keys=primary_keys)
+        return
+
+    output = args.output or os.path.splitext(args.input)[0] + SINK_EXTENSIONS[args.sink]
+    if os.path.abspath(output) == os.path.abspath(args.input):
+        raise ValueError(f'The {args.sink} sink would overwrite its input={args.input}, pass --output')
+    with span('cli.load.write', rows=len(df)) as s:
+        write_store(df, output)
+        s.add(nbytes=os.path.getsize(output))
+
+
+def profile(args):
+    """Profiles Parquet files out-of-core, one file per task on the executor."""
+    from common.utilities.profiling import profile_parquet
+
+    paths = _input_paths(args.input)
+    if not paths:
+        raise ValueError(f'No Parquet file found in {args.input}')
+    with span('cli.profile', nbytes=sum(os.path.getsize(path) for path in paths)) as s:
+        result = profile_parquet(paths, columns=args.columns, batch_size=args.chunk_size, executor=_executor(args))
+        s.add(rows=max((column.rows for column in result.profiles.values()), default=0))
+    stats = result.to_frame()
+    if args.output:
+        stats.to_csv(args.output)
+    print(stats.to_string())
+
+
+COMMANDS = {'fetch': fetch, 'blend': blend, 'load': load, 'profile': profile}
+
+
+def throughput_summary(stats, elapsed_s):
+    """
+    @param stats: dict span name -> SpanStats.to_dict(), e.g. REGISTRY.to_dict()
+    @param elapsed_s: wall clock duration of the command
+    @return: str, one line per span that processed rows or bytes
+    """
+    lines = [f"{'stage':<32} {'calls':>7} {'rows':>11} {'MB':>9} {'busy s':>8} {'rows/s':>11} {'MB/s':>8}"]
+    for name, stat in sorted(stats.items()):
+        if not (stat['rows'] or stat['bytes']):
+            continue
+        lines.append(f"{name:<32} {stat['count']:>7} {stat['rows']:>11} {stat['bytes'] / 1e6:>9.1f} "
+                     f"{stat['total_s']:>8.2f} {stat['rows_per_s']:>11.0f} {stat['bytes_per_s'] / 1e6:>8.1f}")
+    lines.append(f'wall clock {elapsed_s:.2f}s, busy seconds of concurrent stages add up over their workers')
+    return '\n'.join(lines)
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--workers', type=int, default=None, help='concurrency: io threads for fetch, pool size for '
+                                                                  'blend and profile (default: CPU count)')
+    common.add_argument('--executor', choices=EXECUTORS, default='thread', help='pool of the cpu bound commands')
+    common.add_argument('--chunk-size', type=int, default=500_000, help='rows per chunk / batch / insert')
+    common.add_argument('--log-level', default='INFO')
+    common.add_argument('--log-file', default=None, help='also log to this file, rotated')
+    common.add_argument('--log-json', action='store_true', help='one JSON object per log record')
+    common.add_argument('--metrics', default=None, help='write the metrics registry as JSON to this path')
+
+    parser = argparse.ArgumentParser(prog='python -m pipeline',
+                                     description='Fetch, blend, load and profile the MVCC datasets.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = commands.add_parser('fetch', parents=[common], help='pull the dataset by date partitions')
+    fetch_parser.add_argument('--mode', choices=('incremental', 'full'), default='incremental',
+                              help='incremental only pulls new or changed partitions, full pulls every partition')
+    fetch_parser.add_argument('--since', type=date.fromisoformat, default=None,
+                              help='incremental: also re-pull the partitions ending after this YYYY-MM-DD date')
+    fetch_parser.add_argument('--dataset', choices=list(DATASETS), default='crashes', help='registered dataset')
+    fetch_parser.add_argument('--cache-dir', default=None, help='defaults to .data/partitions/<dataset>')
+    fetch_parser.add_argument('--endpoint', default=None, help='defaults to the endpoint of the dataset')
+    fetch_parser.add_argument('--page-size', type=int, default=API_LIMIT)
+    fetch_parser.add_argument('--target-rows', type=int, default=500_000, help='maximum rows per partition')
+    fetch_parser.add_argument('--anonymous', action='store_true', help='pull without the API credentials')
+    fetch_parser.add_argument('--output', default=None, help='sync the partitions into this .parquet, .csv or '
+                                                             '.feather store')
+    fetch_parser.add_argument('--rollups', default=None, help='crashes: directory of the rollups updated by the sync')
+
+    blend_parser = commands.add_parser('blend', parents=[common], help='validate and normalize the store')
+    blend_parser.add_argument('--input', default=str(STORE))
+    blend_parser.add_argument('--output', required=True)
+    blend_parser.add_argument('--quarantine', default=None, help='store of the rows failing an ERROR rule')
+
+    load_parser = commands.add_parser('load', parents=[common], help='write the store to a file or the database')
+    load_parser.add_argument('--input', default=str(STORE))
+    load_parser.add_argument('--sink', choices=SINKS, default='snapshot')
+    load_parser.add_argument('--output', default=None, help='file sinks, defaults to the input with the sink '
+                                                            'extension')
+    load_parser.add_argument('--conn-str', default=None, help='db sink, defaults to $NYC_DB_CONN_STR')
+    load_parser.add_argument('--schema', default='dbo')
+    load_parser.add_argument('--dataset', choices=list(DATASETS), default='crashes',
+                             help='db sink, dataset the default table and primary key are taken from')
+    load_parser.add_argument('--table', default=None, help='db sink, defaults to the dataset name')
+    load_parser.add_argument('--primary-keys', nargs='*', default=None, help='db sink, defaults to the dataset key')
+
+    profile_parser = commands.add_parser('profile', parents=[common], help='one-pass profile of Parquet files')
+    profile_parser.add_argument('--input', default=str(STORE), help='Parquet file or directory of Parquet files')
+    profile_parser.add_argument('--columns', nargs='*', default=None)
+    profile_parser.add_argument('--output', default=None, help='write the profile as csv')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'fetch' and args.rollups and args.dataset != 'crashes':
+        # common.query.rollups.ROLLUPS aggregate the columns of the crashes table
+        parser.error(f'--rollups only applies to the crashes dataset, got --dataset {args.dataset}')
+    configure_logging(level=args.log_level, filename=args.log_file, json_format=args.log_json)
+    REGISTRY.reset()
+    start = time.perf_counter()
+    try:
+        COMMANDS[args.command](args)
+    finally:
+        # the pools sized by this command are shut down, so that main can be called again in-process
+        MANAGER.shutdown(names=[POOL, 'io'] if args.command == 'fetch' and args.workers else [POOL])
+        # the queued records are written before the summary
+        stop_logging()
+        print(throughput_summary(REGISTRY.to_dict(), time.perf_counter() - start))
+        if args.metrics:
+            with open(args.metrics, 'w') as fp:
+                fp.write(REGISTRY.to_json(indent=1))
+    return 0
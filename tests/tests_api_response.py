@@ -1,19 +1,66 @@
 import sys
-sys.path.append(r'/Users/jordancarson/Projects/JPM/data-engineering-nyc')
+from pathlib import Path
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+sys.path.append(str(ROOT / 'src'))
 
+import json
 import unittest
 import requests_mock
 from unittest.mock import patch
-from src.api.get_data import get_response
+from infra.aws.secrets_manager import EnvSecretsProvider
+from src.api.config import NYC_OPEN_DATA_API_ENDPOINT, REQUEST_TIMEOUT, OpenDataConfig
+from common.data_blend import Field
+from src.api.async_api import create_urls
+from src.api.datasets import get_dataset
+from src.api.get_data import get_page, get_response
+from src.api.soql import add_clauses
+from src.api.transport import parse_body, resource_url
 
 
 class BasicTests(unittest.TestCase):
     @patch('requests.get') # decorator to mock the requests.get method
     def test_request_response(self, mock_get):
         mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
         res = get_response()
 
         self.assertEqual(res.status_code, 200)
+        # a hung connection raises requests.Timeout, which is retried
+        get_page('http://test/h9gi-nx95.json', auth=False)
+        self.assertEqual(mock_get.call_args.kwargs['timeout'], REQUEST_TIMEOUT)
+
+    def test_config_headers(self):
+        secret = json.dumps({'NYC_OPEN_DATA_API_KEY': 'key', 'NYC_OPEN_DATA_API_SECRET': 'secret'})
+        provider = EnvSecretsProvider(environ={'SECRET_NYC_OPEN_DATA': secret})
+        config = OpenDataConfig(secret_name='nyc-open-data', provider=provider)
+        self.assertEqual(config.headers, {'Authorization': 'Basic a2V5OnNlY3JldA=='})
+
+    def test_transport_formats(self):
+        endpoint = 'https://data.cityofnewyork.us/resource/h9gi-nx95.json'
+        self.assertEqual(resource_url(endpoint, 'csv'), 'https://data.cityofnewyork.us/resource/h9gi-nx95.csv')
+        from_json = parse_body(b'[{"collision_id": "1", "borough": "BRONX"}, {"collision_id": "2"}]', 'json')
+        from_csv = parse_body(b'collision_id,borough\n1,BRONX\n2,\n', 'csv', dtype=str)
+        self.assertEqual(from_json['collision_id'].tolist(), from_csv['collision_id'].tolist())
+        self.assertEqual(from_csv['borough'].isna().tolist(), [False, True])
+
+    def test_select_fields(self):
+        fields = {'collision_id': Field.KEEP, 'crash_date': 'date', 'location': Field.DROP, 'latitude': None}
+        url, = create_urls(endpoint='http://test/h9gi-nx95.json', limit=10, total=10, fields=fields)
+        self.assertEqual(url, 'http://test/h9gi-nx95.json?$limit=10&$offset=0&$order=collision_id'
+                              '&$select=collision_id,%20crash_date,%20latitude')
+        self.assertEqual(create_urls(endpoint='http://test/h9gi-nx95.json', limit=10, total=10),
+                         ['http://test/h9gi-nx95.json?$limit=10&$offset=0&$order=collision_id'])
+        with self.assertRaises(ValueError):
+            add_clauses(url, select='borough')
+
+    def test_datasets(self):
+        url, = create_urls(limit=10, total=10, dataset='f55k-p6yu')
+        self.assertEqual(url, 'https://data.cityofnewyork.us/resource/f55k-p6yu.json?$limit=10&$offset=0'
+                              '&$order=unique_id')
+        self.assertEqual(get_dataset('crashes').endpoint, NYC_OPEN_DATA_API_ENDPOINT)
+        with self.assertRaises(ValueError):
+            get_dataset('unknown')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+import os
+import tempfile
+import unittest
+from datetime import date
+from urllib.parse import unquote
+import pandas as pd
+from api.checkpoint import CheckpointedDownloader, IncompleteDownload, page_key
+from api.partitions import PartitionedFetcher, parse_counts, plan_partitions
+
+
+class FlakyFetch:
+    """Serves 3 records per page and fails the first request of the urls in fail_once."""
+    def __init__(self, fail_once=()):
+        self.fail_once = set(fail_once)
+        self.calls = list()
+
+    def __call__(self, url):
+        self.calls.append(url)
+        if url in self.fail_once:
+            self.fail_once.discard(url)
+            raise ConnectionError(f'reset by peer: {url}')
+        page = int(url.rsplit('=', 1)[1])
+        return [{'collision_id': str(page * 3 + i), 'borough': 'BROOKLYN'} for i in range(3)]
+
+
+class CheckpointTests(unittest.TestCase):
+    urls = [f'http://localhost/resource.json?$offset={page}' for page in range(5)]
+
+    def test_resume_fetches_missing_pages(self):
+        for file_format in ('parquet', 'ndjson'):
+            with tempfile.TemporaryDirectory() as tmp:
+                fetch = FlakyFetch(fail_once=[self.urls[3]])
+                downloader = CheckpointedDownloader(tmp, self.urls, file_format=file_format, fetch=fetch)
+                with self.assertRaises(IncompleteDownload) as ctx:
+                    downloader.download()
+                self.assertEqual(ctx.exception.failed, [page_key(self.urls[3])])
+
+                # a new process reads the manifest and only asks for the failed page
+                fetch.calls.clear()
+                resumed = CheckpointedDownloader(tmp, self.urls, file_format=file_format, fetch=fetch)
+                self.assertEqual(resumed.missing(), [self.urls[3]])
+                output = os.path.join(tmp, 'crashes.parquet')
+                self.assertEqual(resumed.run(output), 15)
+                self.assertEqual(fetch.calls, [self.urls[3]])
+                self.assertEqual(pd.read_parquet(output)['collision_id'].tolist(), [str(i) for i in range(15)])
+
+    def test_corrupted_page_is_refetched(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            downloader = CheckpointedDownloader(tmp, self.urls, file_format='ndjson', fetch=FlakyFetch())
+            downloader.download()
+            with open(os.path.join(tmp, downloader.manifest.pages[page_key(self.urls[1])]['file']), 'ab') as fp:
+                fp.write(b'garbage')
+            self.assertEqual(downloader.missing(), [self.urls[1]])
+
+
+class PartitionTests(unittest.TestCase):
+    counts = [{'month': '2021-07-01T00:00:00.000', 'n': '40'}, {'month': '2021-08-01T00:00:00.000', 'n': '50'},
+              {'month': '2021-10-01T00:00:00.000', 'n': '30'}, {'month': '2021-11-01T00:00:00.000', 'n': '150'},
+              {'n': '7'}]
+
+    def test_plan_partitions(self):
+        partitions = plan_partitions(parse_counts(self.counts), target_rows=100)
+        self.assertEqual([(p.key, p.rows) for p in partitions],
+                         [('2021-07_2021-10', 90), ('2021-10_2021-11', 30), ('2021-11_2021-12', 150)])
+        self.assertEqual(partitions[0].where(), "crash_date between '2021-07-01T00:00:00.000' and "
+                                                "'2021-09-30T23:59:59.999'")
+
+    def test_late_rows_keep_other_partitions(self):
+        counts = [(date(2021, month, 1), 200) for month in range(1, 5)]
+        before = {p.key for p in plan_partitions(counts, target_rows=500)}
+        # reports filed late for January
+        counts[0] = (date(2021, 1, 1), 350)
+        after = plan_partitions(counts, target_rows=500)
+        self.assertEqual(before, {p.key for p in after})
+        self.assertEqual([p.key for p in after if (p.key, p.rows) != ('2021-01_2021-02', 350)],
+                         ['2021-02_2021-03', '2021-03_2021-04', '2021-04_2021-07'])
+
+    def test_refresh_recent_partitions(self):
+        requested, counts = list(), list(self.counts)
+
+        def fetch(url):
+            requested.append(url)
+            return counts if 'date_trunc_ym' in url else []
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fetcher = PartitionedFetcher(tmp, endpoint='http://localhost/resource/h9gi-nx95.json', target_rows=100,
+                                         limit=100, fetch=fetch)
+            self.assertEqual(len(fetcher.fetch()), 3)
+            self.assertEqual(fetcher.fetch(), [])
+            refreshed = fetcher.fetch(refresh_since=date(2021, 11, 1))
+            self.assertEqual([p.key for p in refreshed], ['2021-11_2021-12'])
+            # the newest partition grew: only its pages are pulled again
+            counts[-2] = {'month': '2021-11-01T00:00:00.000', 'n': '151'}
+            requested.clear()
+            self.assertEqual([p.key for p in fetcher.fetch()], ['2021-11_2021-12'])
+            self.assertTrue(all('2021-11-01' in url for url in requested[1:]))
+
+    def test_refresh_updated_partitions(self):
+        counts = [dict(record, updated='2021-12-01T00:00:00.000') for record in self.counts]
+
+        def fetch(url):
+            if 'date_trunc_ym' not in url:
+                return []
+            self.assertIn('max(:updated_at) AS updated', unquote(url))
+            return counts
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fetcher = PartitionedFetcher(tmp, endpoint='http://localhost/resource/h9gi-nx95.json', target_rows=100,
+                                         limit=100, fetch=fetch)
+            self.assertEqual(len(fetcher.fetch()), 3)
+            # a report of July is amended, the counts are unchanged
+            counts[0] = dict(counts[0], updated='2022-01-05T10:00:00.000')
+            self.assertEqual([p.key for p in fetcher.fetch()], ['2021-07_2021-10'])
+            self.assertEqual(fetcher.fetch(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
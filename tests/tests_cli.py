@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import pandas as pd
+from common.query import read_snapshot
+from pipeline.cli import main
+
+
+class CliTests(unittest.TestCase):
+    def test_load_and_profile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = os.path.join(tmp, 'crashes.parquet')
+            pd.DataFrame({'collision_id': ['1', '2', '3'], 'borough': ['BRONX', None, 'QUEENS'],
+                          'number_of_persons_injured': [0, 2, 1]}).to_parquet(store, index=False)
+
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                main(['load', '--input', store, '--sink', 'snapshot', '--log-level', 'WARNING'])
+                main(['profile', '--input', tmp, '--executor', 'serial', '--log-level', 'WARNING'])
+            self.assertEqual(len(read_snapshot(os.path.join(tmp, 'crashes.feather'))), 3)
+
+            output = stdout.getvalue()
+            self.assertIn('cli.load.write', output)
+            self.assertRegex(output, r'cli\.profile\s+1\s+3\s')
+            self.assertRegex(output, r'mean\s+NaN\s+NaN\s+1\.0\n')
+
+            # the cli pool of the first run is shut down, a second run registers it again
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(2):
+                    main(['profile', '--input', tmp, '--executor', 'thread', '--workers', '2',
+                          '--log-level', 'WARNING'])
+
+            with self.assertRaises(SystemExit):
+                main(['load', '--sink', 'xml'])
+            with self.assertRaises(SystemExit):
+                main(['fetch', '--dataset', 'persons', '--rollups', tmp])
+
+    @patch('common.db_utilities.db_utilities.check_existing_view_or_table', return_value=False)
+    def test_load_new_table(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = os.path.join(tmp, 'persons.parquet')
+            pd.DataFrame({'unique_id': [10, 11], 'collision_id': [1, 1],
+                          'person_type': ['Pedestrian', 'Occupant']}).to_parquet(store, index=False)
+
+            # the ODBC driver is not installed here, the fake one records the queries of the load
+            pyodbc = MagicMock()
+            with patch.dict(sys.modules, {'pyodbc': pyodbc}), contextlib.redirect_stdout(io.StringIO()):
+                main(['load', '--input', store, '--sink', 'db', '--conn-str', 'DSN=test', '--dataset', 'persons',
+                      '--primary-keys', 'unique_id', 'person_type', '--log-level', 'WARNING'])
+
+            cursor = pyodbc.connect.return_value.cursor.return_value
+            queries = [call.args[0] for call in cursor.execute.call_args_list]
+            create = next(query for query in queries if query.startswith('CREATE TABLE [dbo].[persons]'))
+            self.assertIn('unique_id BIGINT NOT NULL, person_type VARCHAR(20) NOT NULL', create)
+            self.assertIn('[collision_id] BIGINT', create)
+            self.assertNotIn('[unique_id]', create)
+            self.assertEqual(cursor.executemany.call_args.args[1], [(10, 1, 'Pedestrian'), (11, 1, 'Occupant')])
+
+            # without --primary-keys the key of the dataset is the primary key
+            pyodbc = MagicMock()
+            with patch.dict(sys.modules, {'pyodbc': pyodbc}), contextlib.redirect_stdout(io.StringIO()):
+                main(['load', '--input', store, '--sink', 'db', '--conn-str', 'DSN=test', '--dataset', 'persons',
+                      '--table', 'people', '--log-level', 'WARNING'])
+            cursor = pyodbc.connect.return_value.cursor.return_value
+            create = next(call.args[0] for call in cursor.execute.call_args_list
+                          if call.args[0].startswith('CREATE TABLE [dbo].[people]'))
+            self.assertIn('unique_id BIGINT NOT NULL,', create)
+            self.assertIn('[person_type] VARCHAR(20)', create)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from common.data_blend.hashing import dedupe, diff, row_hashes
+from common.data_blend.normalize import VEHICLE_TYPE_ALIASES, encode_shared, normalize_frame
+from common.data_blend.validation import Validator
+from common.data_blend.vehicles import category_counts, explode_vehicles
+
+
+class NormalizeTests(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'vehicle_type_code1': ['Sedan', ' sedan ', 'SUV', None],
+            'vehicle_type_code2': ['Station Wagon/Sport Utility Vehicle', 'Bike', '', 'SEDAN'],
+            'on_street_name': ['west   10 st', 'WEST 10 STREET', 'broadway', np.nan],
+        })
+
+    def test_encode_shared_uses_one_dictionary(self):
+        columns = ['vehicle_type_code1', 'vehicle_type_code2', 'vehicle_type_code_3']
+        out, dtype = encode_shared(self.df, columns, aliases=VEHICLE_TYPE_ALIASES)
+
+        self.assertEqual(out['vehicle_type_code1'].dtype, dtype)
+        self.assertEqual(out['vehicle_type_code2'].dtype, dtype)
+        self.assertEqual(list(dtype.categories), ['BICYCLE', 'SEDAN', 'SPORT UTILITY / STATION WAGON'])
+        self.assertEqual(out['vehicle_type_code1'].cat.codes.tolist(), [1, 1, 2, -1])
+        self.assertEqual(out['vehicle_type_code2'].cat.codes.tolist(), [2, 0, -1, 1])
+        # the input frame is left untouched
+        self.assertEqual(self.df['vehicle_type_code1'].iloc[0], 'Sedan')
+
+    def test_normalize_frame_street_suffixes(self):
+        out, dtypes = normalize_frame(self.df)
+
+        self.assertEqual(out['on_street_name'].tolist()[:3], ['WEST 10 STREET', 'WEST 10 STREET', 'BROADWAY'])
+        self.assertTrue(pd.isnull(out['on_street_name'].iloc[3]))
+        self.assertEqual(set(dtypes), {'street', 'factor', 'vehicle_type'})
+
+
+class VehicleTests(unittest.TestCase):
+    def test_explode_vehicles(self):
+        df = pd.DataFrame({
+            'collision_id': [1, 2],
+            'contributing_factor_vehicle_1': ['Unspecified', 'Driver Inattention/Distraction'],
+            'contributing_factor_vehicle_2': ['unspecified', None],
+            'vehicle_type_code1': ['Sedan', 'Taxi'],
+            'vehicle_type_code2': ['SUV', None],
+        })
+        vehicles = explode_vehicles(df)
+
+        self.assertEqual(vehicles['collision_id'].tolist(), [1, 1, 2])
+        self.assertEqual(vehicles['vehicle_index'].tolist(), [1, 2, 1])
+        self.assertEqual(vehicles['vehicle_type'].tolist(), ['SEDAN', 'SPORT UTILITY / STATION WAGON', 'TAXI'])
+
+        counts = category_counts(vehicles, 'factor', top=1)
+        self.assertEqual(counts.to_dict(), {'UNSPECIFIED': 2})
+
+
+class ValidationTests(unittest.TestCase):
+    def test_validator(self):
+        # values as returned by the API: strings, and fields missing from a page
+        df = pd.DataFrame({
+            'collision_id': ['1', '2', '3', None],
+            'crash_date': ['2020-01-01T00:00:00.000'] * 4,
+            'zip_code': ['10014', '10014.0', None, '11201'],
+            'latitude': ['40.7', '0.0', None, '40.6'],
+            'borough': ['BROOKLYN', None, 'QUEENS', 'BROOKLYN'],
+            'number_of_persons_killed': ['0', '0', '1', '0'],
+            'number_of_pedestrians_killed': ['0', '1', '1', '-1'],
+        })
+        with tempfile.TemporaryDirectory() as directory:
+            validator = Validator(quarantine_dir=directory)
+            result = validator.validate(df, part='2020-01_2020-02')
+            quarantined = pd.read_parquet(os.path.join(directory, '2020-01_2020-02.parquet'))
+
+        self.assertEqual(result.valid['collision_id'].tolist(), ['1', '3'])
+        self.assertEqual(quarantined['failed_rules'].tolist(), [
+            'persons_killed_total,latitude_in_range,zip_code_format,borough_not_null',
+            'collision_id_not_null,number_of_pedestrians_killed_in_range',
+        ])
+        self.assertEqual({name: n for name, n in validator.counts.items() if n}, {
+            'collision_id_not_null': 1, 'number_of_pedestrians_killed_in_range': 1, 'persons_killed_total': 1,
+            'latitude_in_range': 1, 'zip_code_format': 1, 'borough_not_null': 1,
+        })
+
+
+class HashingTests(unittest.TestCase):
+    def test_diff(self):
+        old = pd.DataFrame({'collision_id': [1, 2, 3], 'borough': ['BRONX', 'QUEENS', None], 'injured': [0, 1, 2]})
+        new = pd.DataFrame({'injured': [0, 5, 2, 0, 1], 'borough': ['BRONX', 'QUEENS', None, 'BRONX', 'BROOKLYN'],
+                            'collision_id': [1, 2, 3, 4, 4]})
+
+        # the column order does not matter, only the values
+        same = row_hashes(old)['row_hash'] == row_hashes(new.head(3))['row_hash']
+        self.assertEqual(same.tolist(), [True, False, True])
+        self.assertEqual(dedupe(new)['borough'].tolist(), ['BRONX', 'QUEENS', None, 'BROOKLYN'])
+
+        changes = diff(row_hashes(old), new)
+        self.assertEqual(changes.counts(), {'inserted': 1, 'updated': 1, 'deleted': 0, 'unchanged': 2})
+        self.assertEqual(changes.rows(dedupe(new))['collision_id'].tolist(), [2, 4])
+        self.assertEqual(diff(new, old).deleted.tolist(), [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+import unittest
+import numpy as np
+import pandas as pd
+from common.db_utilities.db_utilities import arrow_batches, batch_parameters, prepare_bulk_insert
+
+
+class BulkInsertTests(unittest.TestCase):
+    def test_batch_parameters(self):
+        df = pd.DataFrame({
+            'collision_id': [1, 2, 3],
+            'injured': pd.array([0, None, 2], dtype='Int64'),
+            'latitude': [40.7, np.nan, 40.6],
+            'borough': pd.Categorical(['BRONX', None, 'QUEENS']),
+            'zip_code': ['10014', None, 11201],
+        })
+        batches = arrow_batches(df, 2)
+        self.assertEqual([batch.num_rows for batch in batches], [2, 1])
+        rows = [row for batch in batches for row in batch_parameters(batch)]
+        self.assertEqual(rows, [(1, 0, 40.7, 'BRONX', '10014'), (2, None, None, None, None),
+                                (3, 2, 40.6, 'QUEENS', '11201')])
+        # native Python values, the ODBC driver does not bind numpy scalars
+        self.assertEqual({type(value) for value in rows[0]}, {int, float, str})
+
+    def test_prepare_bulk_insert(self):
+        self.assertEqual(prepare_bulk_insert('dbo', 'crashes', ['collision_id', 'borough']),
+                         'INSERT INTO [dbo].[crashes] ([collision_id], [borough]) VALUES (?, ?)')
+
+
+if __name__ == '__main__':
+    unittest.main()
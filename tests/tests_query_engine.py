@@ -0,0 +1,197 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+import os
+import tempfile
+import unittest
+import pandas as pd
+from urllib.parse import parse_qs, urlsplit
+from api.aggregate import SoQLEngine, build_query
+from api.datasets import join_datasets
+from common.data_blend.hashing import diff, fingerprint, row_hashes
+from common.query import (
+    PandasEngine, RollupStore, StaleRollup, get_engine, read_snapshot, run_question, snapshot_info, write_snapshot
+)
+
+
+class QueryEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'output.parquet')
+        pd.DataFrame({
+            'collision_id': range(6),
+            'borough': ['BROOKLYN', 'QUEENS', 'BROOKLYN', None, 'BRONX', 'BROOKLYN'],
+            'zip_code': ['11207', '11368', '11207', '10014', '10458', '11201'],
+            'crash_date': ['2020-01-01T00:00:00.000'] * 3 + ['2021-05-02T00:00:00.000'] * 3,
+            'crash_time': ['0:10', '13:45', '13:05', '9:00', '23:59', '13:00'],
+            'number_of_cyclist_injured': [0, 1, 2, 0, 0, 1],
+        }).to_parquet(self.path, index=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pandas_engine(self):
+        engine = PandasEngine()
+        out = engine.count_by(self.path, 'borough', where={'zip_code': ['11207', '11201', '10458']}, top=1)
+        self.assertEqual(out.to_dict(orient='records'), [{'borough': 'BROOKLYN', 'collisions': 3}])
+
+        out = engine.count_by(self.path, 'hour', where={'number_of_cyclist_injured': ('>', 0)})
+        self.assertEqual(out.to_dict(orient='records'), [{'hour': 13, 'collisions': 3}])
+
+        out = engine.count_by(self.path, 'borough', sums=['number_of_cyclist_injured'], top=1)
+        self.assertEqual(out.to_dict(orient='records'),
+                         [{'borough': 'BROOKLYN', 'collisions': 3, 'number_of_cyclist_injured': 3}])
+
+    def test_engines_agree(self):
+        try:
+            engine = get_engine('duckdb')
+        except ImportError:
+            self.skipTest('duckdb is not installed')
+
+        questions = ['collisions_by_borough', 'top_zip_codes', 'collisions_by_day_of_week', 'collisions_by_year',
+                     'cyclist_injuries_by_hour', 'collisions_by_year_month_borough']
+        for name in questions:
+            expected = run_question(PandasEngine(), self.path, name)
+            result = run_question(engine, self.path, name)
+            by = [c for c in expected.columns if c != 'collisions']
+            pd.testing.assert_frame_equal(
+                expected.sort_values(by).reset_index(drop=True).astype(str),
+                result.sort_values(by).reset_index(drop=True).astype(str),
+            )
+
+    def test_snapshot(self):
+        df = pd.read_parquet(self.path)
+        df['zip_code'] = [11207, '11368', 11207, '10014', None, '11201']
+        snapshot = os.path.join(self.tmp.name, 'output.feather')
+        self.assertEqual(write_snapshot(df, snapshot, source='output.parquet'), 6)
+        self.assertEqual(snapshot_info(snapshot)['source'], 'output.parquet')
+
+        out = read_snapshot(snapshot, columns=['zip_code', 'number_of_cyclist_injured'])
+        self.assertEqual(out['zip_code'].tolist(), ['11207', '11368', '11207', '10014', None, '11201'])
+        self.assertEqual(out['number_of_cyclist_injured'].tolist(), [0, 1, 2, 0, 0, 1])
+
+        engines = [PandasEngine()]
+        try:
+            engines.append(get_engine('duckdb'))
+        except ImportError:
+            pass
+        for engine in engines:
+            expected = run_question(engine, self.path, 'collisions_by_year_month_borough')
+            pd.testing.assert_frame_equal(run_question(engine, snapshot, 'collisions_by_year_month_borough'), expected)
+
+
+class SoQLEngineTests(unittest.TestCase):
+    setUp = QueryEngineTests.setUp
+    tearDown = QueryEngineTests.tearDown
+
+    def test_build_query(self):
+        url = build_query(['year', 'borough'], where={'borough': ['BROOKLYN', "QUEEN'S"], 'number_of_persons_killed':
+                          ('>', 0)}, top=5, sums=['number_of_persons_injured'], endpoint='http://test/h9gi-nx95.json')
+        params = {key: value[0] for key, value in parse_qs(urlsplit(url).query).items()}
+        self.assertEqual(params, {
+            '$select': 'date_extract_y(crash_date) AS year, borough AS borough, count(*) AS collisions, '
+                       'sum(number_of_persons_injured) AS number_of_persons_injured',
+            '$where': "borough IS NOT NULL AND borough in('BROOKLYN', 'QUEEN''S') AND number_of_persons_killed > 0",
+            '$group': 'date_extract_y(crash_date), borough',
+            '$order': 'collisions DESC',
+            '$limit': '5',
+        })
+
+    def test_typed_result(self):
+        urls = list()
+
+        def fetch(url):
+            urls.append(url)
+            return [{'day_of_week': '0', 'collisions': '2'}, {'day_of_week': '1', 'collisions': '4'}]
+
+        out = SoQLEngine(fetch=fetch).count_by(None, 'day_of_week')
+        # Sunday=0 in SoQL is 6 for pandas
+        self.assertEqual(out.to_dict(orient='records'), [{'day_of_week': 0, 'collisions': 4},
+                                                         {'day_of_week': 6, 'collisions': 2}])
+        self.assertEqual(out['collisions'].dtype, 'int64')
+        self.assertEqual(len(urls), 1)
+
+    def test_local_fallback(self):
+        def fetch(url):
+            raise AssertionError(f'unexpected request {url}')
+
+        engine = SoQLEngine(local_source=self.path, local_engine=PandasEngine(), fetch=fetch)
+        out = run_question(engine, None, 'cyclist_injuries_by_hour')
+        self.assertEqual(out.to_dict(orient='records'), [{'hour': 13, 'collisions': 3}])
+
+        engine = SoQLEngine(local_engine=PandasEngine(), fetch=fetch, remote_columns={'borough'})
+        with self.assertRaises(ValueError):
+            engine.count_by(None, 'zip_code')
+        out = engine.count_by(self.path, 'zip_code', top=1)
+        self.assertEqual(out.to_dict(orient='records'), [{'zip_code': '11207', 'collisions': 2}])
+
+
+class RollupTests(unittest.TestCase):
+    setUp = QueryEngineTests.setUp
+    tearDown = QueryEngineTests.tearDown
+
+    def test_delta_matches_rebuild(self):
+        old = pd.read_parquet(self.path)
+        # an amended report, a deleted one and a new one
+        new = old[old['collision_id'] != 4].copy()
+        new.loc[new['collision_id'] == 1, ['borough', 'number_of_cyclist_injured']] = ['BROOKLYN', 3]
+        new = pd.concat([new, old.iloc[[0]].assign(collision_id=6, crash_time='7:30')], ignore_index=True)
+
+        store = RollupStore(os.path.join(self.tmp.name, 'rollups'))
+        old_hashes, new_hashes = row_hashes(old), row_hashes(new)
+        store.rebuild(old, fingerprint(old_hashes))
+        changes = diff(old_hashes, new_hashes)
+        actions = store.update(new, inserted=changes.rows(new), retracted=changes.rows(old, 'updated', 'deleted'),
+                               since=fingerprint(old_hashes), version=fingerprint(new_hashes))
+        self.assertEqual(set(actions.values()), {'applied'})
+
+        expected = RollupStore(os.path.join(self.tmp.name, 'expected'))
+        expected.rebuild(new)
+        for name in store.rollups:
+            by = store.rollups[name].by
+            pd.testing.assert_frame_equal(store.query(name).sort_values(by, ignore_index=True),
+                                          expected.query(name).sort_values(by, ignore_index=True))
+        by_borough = store.query('by_year_month_borough').set_index('borough')
+        self.assertEqual(by_borough.loc['BROOKLYN', 'collisions'].tolist(), [4, 1])
+        self.assertNotIn('BRONX', by_borough.index)
+        self.assertEqual(store.query('by_hour').set_index('hour').loc[13, 'number_of_cyclist_injured'], 6)
+
+        # a delta computed from another version is not applied twice
+        with self.assertRaises(StaleRollup):
+            store.apply(changes.rows(new), since=fingerprint(old_hashes))
+
+
+class JoinTests(unittest.TestCase):
+    setUp = QueryEngineTests.setUp
+    tearDown = QueryEngineTests.tearDown
+
+    def test_join_datasets(self):
+        # pulled from the JSON endpoint, the persons keys are strings
+        persons = os.path.join(self.tmp.name, 'persons.feather')
+        write_snapshot(pd.DataFrame({
+            'unique_id': ['10', '11', '12', '13'],
+            'collision_id': ['0', '0', '4', '9'],
+            'crash_date': ['2020-01-01T00:00:00.000'] * 4,
+            'person_type': ['Occupant', 'Pedestrian', 'Bicyclist', 'Occupant'],
+        }), persons)
+
+        joined = join_datasets({'crashes': self.path, 'persons': persons},
+                               columns={'crashes': ['collision_id', 'borough', 'crash_date'],
+                                        'persons': ['person_type', 'crash_date']})
+        joined = joined.sort_values('person_type', ignore_index=True)
+        self.assertEqual(joined.columns.tolist(),
+                         ['collision_id', 'borough', 'crash_date', 'person_type', 'persons_crash_date'])
+        self.assertEqual(joined['collision_id'].tolist(), [4, 0, 0])
+        self.assertEqual(joined['borough'].tolist(), ['BRONX', 'BROOKLYN', 'BROOKLYN'])
+
+        left = join_datasets({'crashes': self.path, 'persons': persons}, columns={'persons': ['person_type']},
+                             where={'crashes.borough': 'BROOKLYN'}, how='left')
+        self.assertEqual(len(left), 4)
+        self.assertEqual(left['person_type'].isna().sum(), 2)
+        with self.assertRaises(ValueError):
+            join_datasets({'crashes': self.path, 'persons': persons}, columns={'persons': ['vehicle_id']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from infra.aws.secrets_manager import (
+    CachedSecretsProvider, ChainSecretsProvider, EncryptedDiskCache, EnvSecretsProvider, FileSecretsProvider,
+    SecretNotFound, SecretsProvider
+)
+
+
+class CountingProvider(SecretsProvider):
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, secret_name):
+        self.calls += 1
+        return f'{secret_name}-{self.calls}'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SecretsTests(unittest.TestCase):
+    def test_ttl_cache(self):
+        provider, clock = CountingProvider(), Clock()
+        cached = CachedSecretsProvider(provider, ttl=60, clock=clock)
+        self.assertEqual(cached.get('nyc'), 'nyc-1')
+        clock.now += 59
+        self.assertEqual(cached.get('nyc'), 'nyc-1')
+        clock.now += 1
+        self.assertEqual(cached.get('nyc'), 'nyc-2')
+        cached.invalidate('nyc')
+        self.assertEqual(cached.get('nyc'), 'nyc-3')
+
+    def test_threads_share_one_fetch(self):
+        provider = CountingProvider()
+        cached = CachedSecretsProvider(provider, ttl=60)
+        threads = [threading.Thread(target=cached.get, args=('nyc',)) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(provider.calls, 1)
+
+    def test_chain_env_and_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'secrets.json')
+            with open(path, 'w') as fp:
+                json.dump({'nyc/open-data': {'NYC_OPEN_DATA_API_KEY': 'file'}}, fp)
+            chain = ChainSecretsProvider([EnvSecretsProvider(environ={'SECRET_OTHER': 'env'}), FileSecretsProvider(path)])
+            self.assertEqual(chain.get('other'), 'env')
+            self.assertEqual(json.loads(chain.get('nyc/open-data')), {'NYC_OPEN_DATA_API_KEY': 'file'})
+            with self.assertRaises(SecretNotFound):
+                chain.get('missing')
+
+    def test_encrypted_disk_cache(self):
+        from cryptography.fernet import Fernet
+
+        key = Fernet.generate_key()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.json')
+            first = CachedSecretsProvider(CountingProvider(), ttl=60, disk_cache=EncryptedDiskCache(path, key))
+            self.assertEqual(first.get('nyc'), 'nyc-1')
+            with open(path) as fp:
+                self.assertNotIn('nyc-1', fp.read())
+
+            # a second process with the same key reuses the secret, a different key refetches
+            provider = CountingProvider()
+            second = CachedSecretsProvider(provider, ttl=60, disk_cache=EncryptedDiskCache(path, key))
+            self.assertEqual(second.get('nyc'), 'nyc-1')
+            self.assertEqual(provider.calls, 0)
+            other = CachedSecretsProvider(provider, ttl=60, disk_cache=EncryptedDiskCache(path, Fernet.generate_key()))
+            self.assertEqual(other.get('nyc'), 'nyc-1')
+            self.assertEqual(provider.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+
+import asyncio
+import io
+import json
+import logging
+import pickle
+import unittest
+import numpy as np
+import pandas as pd
+from common.utilities.df_utils import calc_cardinality, describe_stats
+from common.utilities.metrics import REGISTRY, MetricsRegistry, span, timed
+from common.utilities.executors import BoundedExecutor, ExecutorManager
+from common.utilities.heavy_hitters import CountMinSketch, HeavyHitters
+from common.utilities.logging_settings import configure_logging, stage_fields, stop_logging
+from common.utilities.parallel import parallel_task
+from common.utilities.profiling import HyperLogLog, profile_frame
+from common.utilities.rate_limit import TokenBucket
+from concurrent.futures import ThreadPoolExecutor
+from common.utilities.retrying import (
+    CircuitBreaker, CircuitOpenError, RetryBudget, RetryableHTTPError, full_jitter, parse_retry_after, retry_backoff
+)
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_span_records_rows_and_bytes(self):
+        with span('api.page', rows=10, registry=self.registry) as s:
+            s.add(rows=5, nbytes=100)
+
+        stats = self.registry.get('api.page')
+        self.assertEqual((stats['count'], stats['rows'], stats['bytes'], stats['errors']), (1, 15, 100, 0))
+        self.assertEqual(sum(stats['buckets'].values()), 1)
+
+    def test_timed_and_exports(self):
+        @timed('blend', rows=len, registry=self.registry)
+        def blend(n):
+            return list(range(n))
+
+        blend(3)
+        blend(4)
+        with self.assertRaises(KeyError):
+            with span('blend', registry=self.registry):
+                raise KeyError('boom')
+
+        stats = json.loads(self.registry.to_json())['blend']
+        self.assertEqual((stats['count'], stats['rows'], stats['errors']), (3, 7, 1))
+
+        text = self.registry.to_prometheus()
+        self.assertIn('nyc_open_data_span_duration_seconds_count{span="blend"} 3', text)
+        self.assertIn('nyc_open_data_span_rows_total{span="blend"} 7', text)
+        self.assertIn('le="+Inf"} 3', text)
+
+
+class RetryTests(unittest.TestCase):
+    def test_full_jitter_and_retry_after(self):
+        for attempt in range(10):
+            self.assertTrue(0 <= full_jitter(attempt, base=0.5, cap=4) <= 4)
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_sync_and_async_retry(self):
+        calls = list()
+
+        @retry_backoff(tries=3, base=0.001)
+        def flaky():
+            calls.append('sync')
+            if len(calls) < 3:
+                raise RetryableHTTPError(429, retry_after=0)
+            return 'ok'
+
+        @retry_backoff(tries=2, base=0.001)
+        async def always_503():
+            calls.append('async')
+            raise RetryableHTTPError(503, retry_after=0)
+
+        self.assertEqual(flaky(), 'ok')
+        with self.assertRaises(RetryableHTTPError):
+            asyncio.run(always_503())
+        self.assertEqual(calls, ['sync'] * 3 + ['async'] * 2)
+
+    def test_budget_and_breaker(self):
+        budget = RetryBudget(ratio=0.0, min_retries=1)
+        self.assertTrue(budget.try_acquire())
+        self.assertFalse(budget.try_acquire())
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05, block=False)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker.block = True
+        breaker.before_call()  # waits for the reset timeout, then runs as the half-open trial
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class RateLimitTests(unittest.TestCase):
+    def test_token_bucket_paces_and_adapts(self):
+        bucket = TokenBucket(rate=100, capacity=1, max_rate=200, increase=10, name='test')
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.01, delta=0.005)
+        self.assertGreater(asyncio.run(bucket.acquire_async()), 0.01)
+
+        bucket.update(200)
+        self.assertEqual(bucket.rate, 110)
+        bucket.update(429, retry_after=1)
+        self.assertEqual(bucket.rate, 55)
+        self.assertGreater(bucket.reserve(), 1)
+        self.assertEqual(REGISTRY.get('rate_limit.test.wait')['count'], 2)
+
+
+@parallel_task(executor='cpu')
+def _square(x):
+    return x * x
+
+
+class ExecutorTests(unittest.TestCase):
+    def test_bounded_map_batched(self):
+        pool = BoundedExecutor(ThreadPoolExecutor(max_workers=2), max_pending=2)
+        try:
+            self.assertEqual(list(pool.map_batched(abs, range(-7, 0), batch_size=3)), [7, 6, 5, 4, 3, 2, 1])
+        finally:
+            pool.shutdown()
+
+    def test_manager_and_parallel_task(self):
+        manager = ExecutorManager()
+        manager.register('test', kind='thread', workers=1, max_pending=1)
+        pool = manager.get('test')
+        self.assertIs(pool, manager.get('test'))
+        self.assertEqual(parallel_task(sum, executor=pool)([1, 2]).result(), 3)
+        self.assertEqual(parallel_task(executor=pool)(len)('abc').result(), 3)
+        manager.shutdown()
+        with self.assertRaises(ValueError):
+            manager.get('unknown')
+
+        # process pools receive the import path of the decorated function
+        self.assertEqual(_square(4).result(timeout=30), 16)
+
+
+class ProfilingTests(unittest.TestCase):
+    def test_merged_profiles_match_pandas(self):
+        rng = np.random.default_rng(7)
+        df = pd.DataFrame({
+            'injured': rng.poisson(2.0, 50_000),
+            'latitude': np.where(rng.random(50_000) < 0.1, np.nan, rng.uniform(40.5, 40.9, 50_000)),
+            'borough': rng.choice(np.array(['BRONX', 'QUEENS', 'BROOKLYN', None], dtype=object), 50_000),
+        })
+        # profiled in two halves, one of them round tripped through pickle as from a worker process
+        profile = pickle.loads(pickle.dumps(profile_frame(df.iloc[:20_000]))).merge(profile_frame(df.iloc[20_000:]))
+        stats = profile.to_frame()
+
+        self.assertEqual(stats.loc['count', 'latitude'], df['latitude'].count())
+        self.assertEqual(stats.loc['nulls', 'borough'], df['borough'].isna().sum())
+        self.assertEqual(stats.loc['distinct', 'borough'], 3)
+        # within 3 standard errors of the documented bound
+        self.assertAlmostEqual(stats.loc['distinct', 'latitude'] / df['latitude'].nunique(), 1,
+                               delta=3 * HyperLogLog().standard_error)
+        exact = df.describe()
+        for col in ['injured', 'latitude']:
+            for stat in ['mean', 'std', 'min', 'max']:
+                self.assertAlmostEqual(stats.loc[stat, col], exact.loc[stat, col], places=6)
+        self.assertAlmostEqual(stats.loc['50%', 'latitude'], exact.loc['50%', 'latitude'], delta=0.01)
+        self.assertTrue(np.isnan(stats.loc['mean', 'borough']))
+
+    def test_df_utils(self):
+        df = pd.DataFrame({'borough': ['BRONX', 'BRONX', 'QUEENS', None], 'injured': [0, 1, 1, 2]})
+        self.assertEqual(calc_cardinality(df).to_dict(), {'borough': 0.75})
+        stats = describe_stats(df)
+        self.assertEqual(stats.loc['iqr', 'injured'], 0.5)
+        self.assertEqual(stats.loc['cardinality', 'injured'], 0.75)
+        self.assertEqual(describe_stats(df, approximate=True).loc['max', 'injured'], 2)
+
+
+class HeavyHitterTests(unittest.TestCase):
+    def test_merged_top_k_matches_value_counts(self):
+        rng = np.random.default_rng(3)
+        zip_codes = pd.Series(rng.zipf(1.5, 100_000) % 5000).astype(str)
+        df = pd.DataFrame({'zip_code': zip_codes})
+        exact = zip_codes.value_counts()
+
+        # pages split between two workers, one of them round tripped through pickle as from a worker process
+        workers = [HeavyHitters(['zip_code'], capacity=200, count_min=(2048, 5)) for _ in range(2)]
+        for i, start in enumerate(range(0, len(df), 10_000)):
+            workers[i % 2].on_page(None, df.iloc[start:start + 10_000])
+        hitters = pickle.loads(pickle.dumps(workers[0])).merge(workers[1])
+
+        top = hitters.top('zip_code', 5)
+        self.assertEqual(top['zip_code'].tolist(), exact.index[:5].tolist())
+        self.assertTrue(top['guaranteed'].all())
+        true = exact[top['zip_code']].to_numpy()
+        self.assertTrue(((top['count'] >= true) & (top['count'] - top['error'] <= true)).all())
+        self.assertTrue((top['error'] <= len(df) / 200).all())
+
+        estimates = hitters.frequencies['zip_code'].estimate(exact.index[:100])
+        self.assertTrue((estimates >= exact.to_numpy()[:100]).all())
+        with self.assertRaises(ValueError):
+            CountMinSketch(1024).merge(CountMinSketch(2048))
+
+
+class LoggingTests(unittest.TestCase):
+    def test_json_records_are_rate_limited(self):
+        stream = io.StringIO()
+        configure_logging(stream=stream, json_format=True, burst=2, interval=60)
+        try:
+            logger = logging.getLogger('tests.pages')
+            for page in range(5):
+                logger.info('page %d', page, extra=stage_fields('api.checkpoint.page', rows=100, duration_s=0.5,
+                                                                 rate_limited=True))
+            logger.info('done', extra=stage_fields('db.bulk_insert', rows=500))
+        finally:
+            stop_logging()
+
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([record['message'] for record in records], ['page 0', 'page 1', 'done'])
+        self.assertEqual(records[0]['stage'], 'api.checkpoint.page')
+        self.assertEqual(records[0]['duration_s'], 0.5)
+        self.assertEqual(records[2]['rows'], 500)
+        self.assertFalse([handler for handler in logging.getLogger().handlers
+                          if isinstance(handler, logging.handlers.QueueHandler)])
+
+
+if __name__ == '__main__':
+    unittest.main()